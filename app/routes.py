@@ -1,5 +1,5 @@
 from flask import Blueprint, jsonify, render_template, request, abort
-from .tasks import step_simulation, setup_simulation, record_vote, add_player, remove_player, choose_proposer, start_vote, reset, add_client, end_vote
+from .tasks import step_simulation, setup_simulation, record_vote, add_player, remove_player, choose_proposer, start_vote, reset, add_client, end_vote, resync_client
 from world.population import load_population
 
 routes = Blueprint('routes', __name__)
@@ -17,6 +17,10 @@ def register_simulation():
     """a new simulation frontend"""
     add_client.delay(request.sid)
 
+def resync_simulation():
+    """a simulation frontend missed a population frame"""
+    resync_client.delay(request.sid)
+
 
 
 # hacky, but doesn't seem to work any other way
@@ -27,6 +31,9 @@ handlers = {
     },
     'disconnect': {
         '/player': unregister_player,
+    },
+    'resync': {
+        '/simulation': resync_simulation
     }
 }
 
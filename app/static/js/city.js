@@ -74,6 +74,60 @@ define([
       this.population = _.without(this.population, person);
     },
 
+    // add someone new to the city
+    arrive: function(data) {
+      var person = new Person(data);
+      this.population.push(person);
+      this.placePersonDelayed(person);
+      return person;
+    },
+
+    updatePerson: function(person, changes) {
+      if (person.apply(changes)) {
+        this.blink(person.mesh);
+      }
+    },
+
+    // apply a population frame (see world/frames.py): a keyframe
+    // has everyone, a delta who changed, arrived or left since the last frame
+    applyFrame: function(frame) {
+      var self = this,
+          people = _.indexBy(this.population, 'id');
+      if (frame.keyframe) {
+        var present = _.indexBy(frame.people, 'id');
+        _.each(frame.people, function(data) {
+          if (people[data.id]) {
+            self.updatePerson(people[data.id], data);
+          } else {
+            self.arrive(data);
+          }
+        });
+        _.each(people, function(person, id) {
+          if (!present[id]) {
+            self.die(person);
+          }
+        });
+      } else {
+        _.each(frame.removed, function(id) {
+          if (people[id]) {
+            self.die(people[id]);
+          }
+        });
+        _.each(frame.changed, function(changes) {
+          if (people[changes.id]) {
+            self.updatePerson(people[changes.id], changes);
+          }
+        });
+        _.each(frame.added, function(data) {
+          if (people[data.id]) {
+            self.updatePerson(people[data.id], data);
+          } else {
+            self.arrive(data);
+          }
+        });
+      }
+    },
+
     // spawn the city
     spawn: function(population, buildings) {
       this.spawnBuildings(buildings);
@@ -172,7 +172,29 @@ require([
         })
       });
 
+      // population frames: a keyframe, then deltas of who changed.
+      // if we miss a frame, ask for a keyframe to catch up,
+      // skipping deltas until it comes
+      var frameSeq = null,
+          resyncing = false;
+      socket.on("step", function(frame) {
+        if (!sim.city) {
+          return;
+        }
+        if (!frame.keyframe && (frameSeq === null || frame.seq !== frameSeq + 1)) {
+          if (!resyncing) {
+            resyncing = true;
+            socket.emit("resync");
+          }
+          return;
+        }
+        resyncing = false;
+        frameSeq = frame.seq;
+        sim.city.applyFrame(frame);
+      });
+
       socket.on("setup", function(data){
+        frameSeq = data.seq;
         var config = {
           maxTenants: max_tenants
         }
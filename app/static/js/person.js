@@ -29,6 +29,7 @@ define([], function() {
     }
 
     this.id = data.id;
+    this.data = _.clone(data);
     this.mesh = new THREE.Mesh(geometry, material);
     this.distanceTraveled = {x:0, z:0};
     this.velocity = {x:0, z:0};
@@ -62,6 +63,20 @@ define([], function() {
           this.mesh.geometry = new THREE.TetrahedronGeometry(radius*1.5);
       }
       // note that the mesh needs to removed then readded to the scene for the update to take place
+    },
+
+    // apply changed fields (e.g. from a population frame).
+    // returns whether the person's status changed
+    apply: function(changes) {
+      var before = this.data.firm_owner ? 'owner' : (this.data.employer ? 'employed' : 'unemployed'),
+          after;
+      _.extend(this.data, changes);
+      after = this.data.firm_owner ? 'owner' : (this.data.employer ? 'employed' : 'unemployed');
+      if (after === before) {
+        return false;
+      }
+      this.status(after);
+      return true;
     }
   };
 
@@ -1,10 +1,13 @@
+import os
 import random
 import logging
 from city import City
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from calendar import monthrange
 from flask_socketio import SocketIO
 from world.population import load_population #, generate population
+from world import tracing
 from .handlers import SocketsHandler
 from app import create_app
 
@@ -17,7 +20,11 @@ def make_celery(app):
         abstract = True
         def __call__(self, *args, **kwargs):
             with app.app_context():
-                return TaskBase.__call__(self, *args, **kwargs)
+                tracer = tracing.current()
+                if tracer is None:
+                    return TaskBase.__call__(self, *args, **kwargs)
+                with tracer.span('task', {'name': self.name}):
+                    return TaskBase.__call__(self, *args, **kwargs)
     celery.Task = ContextTask
     return celery
 
@@ -33,6 +40,19 @@ app.config.update(
 )
 celery = make_celery(app)
 
+# trace each worker process's tasks and the simulation steps they run,
+# e.g. TRACE_PATH=/tmp/hosny-{pid}.json.gz TRACE_SAMPLE=0.1.
+# started in the worker processes themselves, so `{pid}` is theirs
+@worker_process_init.connect
+def start_tracing(**kwargs):
+    if os.environ.get('TRACE_PATH'):
+        tracing.start(os.environ['TRACE_PATH'], sample=float(os.environ.get('TRACE_SAMPLE', 1)))
+
+
+@worker_process_shutdown.connect
+def stop_tracing(**kwargs):
+    tracing.stop()
+
 
 # ehhh hacky
 model = None
@@ -71,10 +91,12 @@ def setup_simulation(config):
         model = City(pop, config)
 
         # send population to the frontend
+        frame = model.frames.keyframe()
         s = socketio()
         s.emit('setup', {
             'existing': False,
-            'population': [p.as_json() for p in pop],
+            'seq': frame['seq'],
+            'population': frame['people'],
             'buildings': [{
                 'id': b.id,
                 'tenants': []
@@ -100,9 +122,11 @@ def add_client(sid):
     print('===ADDING CLIENT===')
     s = socketio()
     if model is not None:
+        frame = model.frames.keyframe()
         s.emit('setup', {
             'existing': True,
-            'population': [p.as_json() for p in model.people],
+            'seq': frame['seq'],
+            'population': frame['people'],
             'buildings': [{
                 'id': b.id,
                 'tenants': [{'id': t.id, 'type': type(t).__name__} for t in b.tenants]
@@ -116,6 +140,13 @@ def add_client(sid):
         }, namespace='/simulation', room=sid)
 
 
+@celery.task
+def resync_client(sid):
+    """a client missed a population frame, send it a keyframe"""
+    if model is not None:
+        socketio().emit('step', model.frames.keyframe(), namespace='/simulation', room=sid)
+
+
 @celery.task
 def step_simulation():
     """steps through one month of the simulation"""
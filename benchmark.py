@@ -0,0 +1,175 @@
+"""
+benchmarks `City.step` on synthetic cities (see `world/synthetic.py`),
+so it runs without the PUMS data.
+
+    python benchmark.py                              # 200, 2k, 20k and 200k people
+    python benchmark.py --sizes 200,2000 --days 30 --out results.json
+    python benchmark.py --sizes 2000 --baseline results.json
+
+for each size it times building the city and each step, both overall and
+per phase (with the city's profiler, see `world/profiler.py`), along with
+the work counted in each phase, and measures peak RSS. each size runs in its own process, so
+their peak RSS don't mix. results are written as json; given a baseline
+(an earlier results file), phases which got slower (or used more memory)
+by more than `--tolerance` are reported, and the exit status is 1.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from city import City
+from economy.firms import set_employment_dist
+from world import synthetic
+from world.profiler import Profiler
+
+SIZES = (200, 2000, 20000, 200000)
+
+
+def _peak_rss_mb():
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/(1024 * 1024) if sys.platform == 'darwin' else rss/1024
+
+
+def _summary(times):
+    times = np.asarray(times)
+    return {
+        'mean': float(times.mean()),
+        'median': float(np.median(times)),
+        'p95': float(np.percentile(times, 95)),
+        'max': float(times.max()),
+        'total': float(times.sum())
+    }
+
+
+def run(n, days, warmup=1, seed=0):
+    """benchmark a synthetic city of `n` people for `days` steps,
+    after `warmup` untimed steps (the first creates the firms)"""
+    set_employment_dist(synthetic.employment_dist())
+    start = time.perf_counter()
+    population = synthetic.population(n, seed=seed)
+    config = dict(synthetic.config(n), seed=seed, profile=True)
+    city = City(population, config)
+    build = time.perf_counter() - start
+
+    for _ in range(warmup):
+        city.step()
+
+    # times and counts for each step, from the city's profiler
+    city.profiler = Profiler()
+    steps = []
+    for _ in range(days):
+        city.step()
+        steps.append(city.profiler.last)
+    city.close()
+
+    names = {name for step in steps for name in step['times']} - {'step'}
+    phases = {name: [step['times'].get(name, 0.) for step in steps] for name in names}
+    step_times = [step['times']['step'] for step in steps]
+    phases['other'] = [t - sum(step['times'].get(name, 0.) for name in names)
+                       for t, step in zip(step_times, steps)]
+    counts = {name for step in steps for name in step['counts']}
+
+    return {
+        'n_people': n,
+        'build': build,
+        'step': _summary(step_times),
+        'phases': {name: _summary(times) for name, times in phases.items()},
+        'counts': {name: float(np.mean([step['counts'].get(name, 0) for step in steps])) for name in counts},
+        'peak_rss_mb': _peak_rss_mb(),
+        'final': {'n_people': len(city.people), 'n_firms': len(city.firms)}
+    }
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(sizes=SIZES, days=10, warmup=1, seed=0):
+    """benchmark each size in its own process"""
+    results = {}
+    ctx = mp.get_context('fork')
+    for n in sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+            results[str(n)] = executor.submit(run, n, days, warmup, seed).result()
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'days': days,
+            'warmup': warmup,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """`(size, what, baseline value, value, ratio)` for every median step/phase time
+    and peak RSS in both, and the ones which are worse than the baseline by more than `tolerance`"""
+    rows, regressions = [], []
+    for size, res in results['results'].items():
+        base = baseline['results'].get(size)
+        if base is None:
+            continue
+        pairs = [('step', base['step']['median'], res['step']['median']),
+                 ('peak_rss_mb', base['peak_rss_mb'], res['peak_rss_mb'])]
+        pairs += [(name, base['phases'][name]['median'], s['median'])
+                  for name, s in res['phases'].items() if name in base['phases']]
+        for what, before, after in pairs:
+            ratio = after/before if before else float('inf') if after else 1.
+            row = (size, what, before, after, ratio)
+            rows.append(row)
+            if ratio > 1 + tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+def report(results):
+    for size, res in results['results'].items():
+        print('{} people: build {:.2f}s, step median {:.4f}s (p95 {:.4f}s), peak rss {:.0f}MB'.format(
+            size, res['build'], res['step']['median'], res['step']['p95'], res['peak_rss_mb']))
+        for name, s in sorted(res['phases'].items(), key=lambda kv: -kv[1]['median']):
+            print('    {:<26} {:.4f}s'.format(name, s['median']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark City.step on synthetic cities')
+    parser.add_argument('--sizes', default=','.join(str(n) for n in SIZES),
+                        help='comma-separated population sizes')
+    parser.add_argument('--days', type=int, default=10, help='timed steps per size')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed steps before timing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='where to write the results json')
+    parser.add_argument('--baseline', help='a previous results json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='how much slower than the baseline counts as a regression')
+    args = parser.parse_args()
+
+    results = run_all([int(n) for n in args.sizes.split(',')], args.days, args.warmup, args.seed)
+    report(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        _, regressions = compare(results, baseline, args.tolerance)
+        for size, what, before, after, ratio in regressions:
+            print('regression: {} people, {}: {:.4f} -> {:.4f} ({:.2f}x)'.format(size, what, before, after, ratio))
+        if regressions:
+            sys.exit(1)
@@ -1,20 +1,28 @@
-import math
 import json
-import random
 import logging
 from datetime import datetime
-import scipy.stats as st
 from cess import Simulation
-from cess.util import random_choice, shuffle, ewma
-from people import Person
+from cess.util import ewma
+from people import Person, StateStore
 from economy import Household, Firm, ConsumerGoodFirm, CapitalEquipmentFirm, RawMaterialFirm, Hospital, Building, Government
+from economy import fiscal, healthcare, labor
+from economy.household import HouseholdDemand
+from economy.firms import employment_table
+from economy.sampler import SumTree, supplier_weight
 from dateutil.relativedelta import relativedelta
 from world import work
+from world.contagion import Contagion
+from world.registry import Registry
+from world.rng import RNG
+from world.profiler import Profiler, NullProfiler
+from world import telemetry, checkpoint, tracing
+from world.frames import FrameEncoder
 
 world_data = json.load(open('data/world/nyc.json', 'r'))
 
 default_conf = {
     'starting_wage': 5,
+    'labor_market_mode': 'iterative', # or 'deferred_acceptance'
     'max_tenants': 10,
     'n_buildings': 16,
     'patient_zero_prob': 0.01,
@@ -22,6 +30,7 @@ default_conf = {
     'transmission_rate': 0.1,
     'sickness_severity': 0.01,
     'recovery_prob': 0.8,
+    'contagion_mode': 'loop', # or 'sparse'
     'tax_rate': 0.3,
     'tax_rate_increment': 0.1,
     'welfare_increment': 1,
@@ -32,6 +41,7 @@ default_conf = {
     'material_cost_per_good': 2,
     'labor_per_worker': 20,
     'labor_per_equipment': 1,
+    'asset_optimizer': 'exact', # or 'scipy'
     'supply_increment': 1,
     'profit_increment': 1,
     'wage_increment': 1,
@@ -40,7 +50,17 @@ default_conf = {
     'base_min_consumption': 1,
     'wage_under_market_multiplier': 1,
     'min_business_capital': 50000,
-    'starting_welfare_req': 10000
+    'starting_welfare_req': 10000,
+    'telemetry_path': None, # directory to write telemetry to, if any
+    'telemetry_fields': telemetry.DEFAULT_FIELDS,
+    'telemetry_every': 1, # days between agent snapshots
+    'telemetry_month_end': False, # or snapshot only at month end
+    'telemetry_sample': 1., # fraction of agents to snapshot
+    'keyframe_every': 30, # population frames between keyframes
+    'seed': None, # for the city's random streams; None for a fresh seed
+    'profile': False, # time each phase of a step and count the work done in it
+    'trace_path': None, # file to write a chrome trace of the run to, if any
+    'trace_sample': 1., # fraction of steps to trace
 }
 
 START_DATE = datetime(day=1, month=1, year=2005)
@@ -55,14 +75,14 @@ class City(Simulation):
 
         config = default_conf.copy()
         config.update(conf)
-        self.config = config
+        self._configure(config)
 
-        Firm.config = config
-        Person.base_min_consumption = config['base_min_consumption']
-        Person.wage_under_market_multiplier = config['wage_under_market_multiplier']
-        Person.min_business_capital = config['min_business_capital']
+        # a seeded random stream for each subsystem
+        self.rng = RNG(config['seed'])
+        # all the city's firms learn together
+        self.firm_learners = Firm.new_learners(rng=self.rng.learning)
 
-        self.government = Government(config['tax_rate'], config['welfare'], config['tax_rate_increment'], config['welfare_increment'], config['starting_welfare_req'])
+        self.government = Government(config['tax_rate'], config['welfare'], config['tax_rate_increment'], config['welfare_increment'], config['starting_welfare_req'], rng=self.rng.learning)
 
         self.buildings = [
             Building(config['max_tenants'], config['rent'])
@@ -93,22 +113,120 @@ class City(Simulation):
             'mean_healthcare_profit': 1,
         }
 
-        self.people = people
+        self.people = Registry(people)
+
+        # columnar storage for people's state,
+        # so phases can work on whole arrays at once
+        self.store = StateStore(capacity=len(people))
+        for person in people:
+            self.store.add(person)
 
         # TODO create "real" households
-        self.households = [Household([p], config['consumer_good_utility']) for p in people]
+        self.households = Registry(Household([p], config['consumer_good_utility']) for p in people)
 
-        self.firms = []
-        self.consumer_good_firms = []
-        self.raw_material_firms = []
-        self.capital_equipment_firms = []
-        self.hospitals = []
+        self.firms = Registry()
+        self.firms_by_type = {typ: Registry() for typ in
+                              [ConsumerGoodFirm, RawMaterialFirm, CapitalEquipmentFirm, Hospital]}
+        self.consumer_good_firms = self.firms_by_type[ConsumerGoodFirm]
+        self.raw_material_firms = self.firms_by_type[RawMaterialFirm]
+        self.capital_equipment_firms = self.firms_by_type[CapitalEquipmentFirm]
+        self.hospitals = self.firms_by_type[Hospital]
 
+        self._attach()
         self.initialized = False
 
+        # the last checkpoint saved or loaded, to save the next one incrementally
+        self._checkpoint = None
+
+    def _configure(self, config):
+        self.config = config
+        Firm.config = config
+        Person.base_min_consumption = config['base_min_consumption']
+        Person.wage_under_market_multiplier = config['wage_under_market_multiplier']
+        Person.min_business_capital = config['min_business_capital']
+
+    def _attach(self):
+        """set up what's derived from the state store and config"""
+        config = self.config
+        if config['contagion_mode'] == 'sparse':
+            self.contagion = Contagion(self.store, rng=self.rng.contagion)
+        else:
+            self.contagion = None
+
+        if config['trace_path'] is not None:
+            self.tracer = tracing.Tracer(config['trace_path'], sample=config['trace_sample'])
+        else:
+            # e.g. the celery worker's
+            self.tracer = tracing.current()
+        if config['profile'] or self.tracer is not None:
+            self.profiler = Profiler(tracer=self.tracer)
+        else:
+            self.profiler = NullProfiler()
+
+        # population frames for the frontend
+        self.frames = FrameEncoder(self.store, keyframe_every=config['keyframe_every'])
+
+        if config['telemetry_path'] is not None:
+            self.telemetry = telemetry.Telemetry(config['telemetry_path'],
+                                                 fields=config['telemetry_fields'],
+                                                 every=config['telemetry_every'],
+                                                 month_end=config['telemetry_month_end'],
+                                                 sample=config['telemetry_sample'])
+        else:
+            self.telemetry = None
+
+    def save_checkpoint(self, path, incremental=True, compress=True):
+        """save everything needed to resume this run to `path`.
+        if `incremental`, only what changed since the last checkpoint saved or
+        loaded is written, and loading this checkpoint needs that one too.
+        that makes checkpoints smaller, not quicker to make: every entity is
+        still encoded to tell whether it changed"""
+        fields = {
+            'date': self.date,
+            'state': self.state,
+            'config': self.config,
+            'initialized': self.initialized,
+            'government': self.government,
+            'buildings': self.buildings,
+            'people': self.people,
+            'households': self.households,
+            'firms': self.firms,
+            'firms_by_type': self.firms_by_type,
+            'firm_learners': self.firm_learners,
+            'rng': self.rng
+        }
+        registries = {'household': (Household, self.households), 'firm': (Firm, self.firms)}
+        parent = self._checkpoint if incremental else None
+        self._checkpoint = checkpoint.save(path, fields, self.store, registries,
+                                           parent=parent, compress=compress)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        """resume a run from a checkpoint"""
+        fields, store, parent = checkpoint.load(path)
+        city = cls.__new__(cls)
+        super(City, city).__init__(list(fields['people']))
+        city._configure(fields['config'])
+        for name, value in fields.items():
+            setattr(city, name, value)
+
+        # the learners were saved with their own copies of the stream
+        city.firm_learners.rng = city.rng.learning
+        city.government.learner.learners.rng = city.rng.learning
+        city.store = store
+        city.consumer_good_firms = city.firms_by_type[ConsumerGoodFirm]
+        city.raw_material_firms = city.firms_by_type[RawMaterialFirm]
+        city.capital_equipment_firms = city.firms_by_type[CapitalEquipmentFirm]
+        city.hospitals = city.firms_by_type[Hospital]
+        city._attach()
+        city._checkpoint = parent
+        return city
+
     def step(self):
         """one time step in the model (a day)"""
         super().step()
+        profiler = self.profiler
+        profiler.start_step()
 
         prev_month = self.date.month
 
@@ -116,18 +234,19 @@ class City(Simulation):
         self.state['month'] = self.date.month
         self.state['year'] = self.date.year
 
-        self._log('step', {
-            'people': [p.as_json() for p in self.people]
-        })
+        if self.listening:
+            with profiler.phase('frames'):
+                self._log('step', self.frames.next_frame())
         self._log('datetime', {'month': self.date.month, 'day': self.date.day, 'year': self.date.year})
 
         if not self.initialized:
-            # create initial firms
-            for person in self.people:
-                if person._state['firm_owner']:
-                    industry = random.choice(['equip', 'material', 'consumer_good', 'healthcare'])
-                    building = random.choice(self.buildings)
-                    self.start_firm(person, industry, building)
+            with profiler.phase('initial_firms'):
+                # create initial firms
+                for person in self.people:
+                    if person._state['firm_owner']:
+                        industry = self.rng.pool('city').choice(['equip', 'material', 'consumer_good', 'healthcare'])
+                        building = self.rng.pool('city').choice(self.buildings)
+                        self.start_firm(person, industry, building)
             self.initialized = True
 
         # month change
@@ -137,11 +256,13 @@ class City(Simulation):
                 for tenant in building.tenants:
                     tenant.pay(building.rent)
 
-        for household in self.households:
-            household.step()
+        with profiler.phase('households'):
+            for household in self.households:
+                household.step()
 
-        n_deaths = self.contagion_model()
-        self.stat('n_sick', len([p for p in self.people if p._state['sick']]))
+        with profiler.phase('contagion'):
+            n_deaths = self.contagion_model()
+        self.stat('n_sick', int(self.store['sick'].sum()))
 
         # self.real_estate_market()
 
@@ -152,26 +273,37 @@ class City(Simulation):
         mean_rent = sum(b.rent * len(b.tenants) for b in self.buildings)/n_tenants if n_tenants else 0
         self.ewma_stat('mean_rent', mean_rent, graph=True)
         if self.state['available_space']:
-            for person in shuffle(self.people):
-                yes, industry, building = person.start_business(self.state, self.buildings)
-                if yes:
-                    self.start_firm(person, industry, building)
-
-        jobs = []
-        for firm in shuffle(self.firms):
-            n_vacancies, wage = firm.set_production_target(self.state)
-            jobs.append((n_vacancies, wage, firm))
-
-        self.labor_market(jobs)
-
-        labor_force = [p for p in self.people if p.wage != 0]
-        mean_wage = sum(p.wage for p in labor_force)/len(labor_force) if labor_force else 0
+            with profiler.phase('start_firms'):
+                for person in self.rng.shuffle('city', self.people):
+                    yes, industry, building = person.start_business(self.state, self.buildings, self.rng.pool('city'))
+                    if yes:
+                        self.start_firm(person, industry, building)
+
+        with profiler.phase('production_planning'):
+            jobs = []
+            firms = self.rng.shuffle('markets', self.firms)
+            profiler.count('firms', len(firms))
+            with profiler.span('plan_all_production'):
+                required_labor = Firm.plan_all_production(firms, self.state, self.firm_learners)
+            with profiler.span('assess_all_assets'):
+                assets = Firm.assess_all_assets(firms, required_labor, self.state)
+            for firm, (n_workers, wage, n_equip) in zip(firms, assets):
+                with profiler.span('set_assets'):
+                    n_vacancies, wage = firm.set_assets(self.state, n_workers, wage, n_equip, self.rng.labor)
+                jobs.append((n_vacancies, wage, firm))
+
+        with profiler.phase('labor_market'):
+            self.labor_market(jobs)
+
+        wages = self.store['wage']
+        wages = wages[wages != 0]
+        mean_wage = wages.mean() if wages.size else 0
         self.ewma_stat('mean_wage', mean_wage, graph=True)
 
-        for firm in self.raw_material_firms:
-            firm.produce(self.state)
-
-        sold, profits = self.raw_material_market()
+        with profiler.phase('raw_material_market'):
+            for firm in self.raw_material_firms:
+                firm.produce(self.state)
+            sold, profits = self.raw_material_market()
         mean = sum(profits)/len(profits) if profits else 0
         self.ewma_stat('mean_material_profit', mean, graph=True)
 
@@ -181,10 +313,10 @@ class City(Simulation):
         mean = sum(sell_prices)/len(sell_prices) if sell_prices else 0
         self.ewma_stat('mean_material_price', mean, graph=True)
 
-        for firm in self.capital_equipment_firms:
-            firm.produce(self.state)
-
-        sold, profits = self.capital_equipment_market()
+        with profiler.phase('capital_equipment_market'):
+            for firm in self.capital_equipment_firms:
+                firm.produce(self.state)
+            sold, profits = self.capital_equipment_market()
         mean = sum(profits)/len(profits) if profits else 0
         self.ewma_stat('mean_equip_profit', mean, graph=True)
 
@@ -194,10 +326,10 @@ class City(Simulation):
         mean = sum(sell_prices)/len(sell_prices) if sell_prices else 0
         self.ewma_stat('mean_equip_price', mean, graph=True)
 
-        for firm in self.consumer_good_firms:
-            firm.produce(self.state)
-
-        sold, profits = self.consumer_good_market()
+        with profiler.phase('consumer_good_market'):
+            for firm in self.consumer_good_firms:
+                firm.produce(self.state)
+            sold, profits = self.consumer_good_market()
         mean = sum(profits)/len(profits) if profits else 0
         self.ewma_stat('mean_consumer_good_profit', mean, graph=True)
 
@@ -207,33 +339,23 @@ class City(Simulation):
         mean = sum(sell_prices)/len(sell_prices) if sell_prices else 0
         self.ewma_stat('mean_consumer_good_price', mean, graph=True)
 
-        for household in self.households:
-            if not household.check_goods():
-                for p in household.people:
-                    self.dies(p)
-                    n_deaths += 1
+        with profiler.phase('check_goods'):
+            for household in self.households:
+                if not household.check_goods():
+                    for p in household.people:
+                        self.dies(p)
+                        n_deaths += 1
         self.stat('n_deaths', n_deaths)
         self.stat('n_population', len(self.people))
 
         # taxes and wages
-        for person in self.people:
-            taxes = 0
-            if person._state['firm_owner']:
-                profit = max(person.firm.profit, 0)
-                taxes = profit * self.government.tax_rate
-                person.firm.cash -= taxes
-            elif person.employer is not None:
-                wage = min(person.wage, person.employer.cash)
-                taxes = wage * self.government.tax_rate
-                person._state['cash'] += (wage - taxes)
-                # TODO should people keep track of how much they are _actually_
-                # paid vs their stated wage?
-            self.government.cash += taxes
-
-        for firm in self.hospitals:
-            firm.produce(self.state)
-
-        sold, profits = self.healthcare_market()
+        with profiler.phase('collect_taxes'):
+            fiscal.collect_taxes(self.store, self.government)
+
+        with profiler.phase('healthcare_market'):
+            for firm in self.hospitals:
+                firm.produce(self.state)
+            sold, profits = self.healthcare_market()
         mean = sum(profits)/len(profits) if profits else 0
         self.ewma_stat('mean_healthcare_profit', mean, graph=True)
         mean = sum(sold)/len(sold) if sold else 0
@@ -253,12 +375,13 @@ class City(Simulation):
         for firm in self.raw_material_firms:
             firm.cash += subsidy
 
-        n_bankruptcies = 0
-        for firm in self.firms:
-            # bankrupt
-            if firm.cash < 0:
-                n_bankruptcies += 1
-                self.close_firm(firm)
+        with profiler.phase('bankruptcies'):
+            n_bankruptcies = 0
+            for firm in self.firms:
+                # bankrupt
+                if firm.cash < 0:
+                    n_bankruptcies += 1
+                    self.close_firm(firm)
 
         self.stat('n_bankruptcies', n_bankruptcies)
         self.stat('n_firms', len(self.firms))
@@ -269,65 +392,80 @@ class City(Simulation):
         mean_cash = sum(h.cash for h in self.households)/len(self.households) if self.households else 0
         self.ewma_stat('mean_cash', mean_cash, graph=True)
 
-        self.government.adjust(self.households)
+        with profiler.phase('government_adjust'):
+            self.government.adjust(self.households)
         self.stat('welfare', self.government.welfare)
         self.stat('tax_rate', self.government.tax_rate)
 
-        for person in self.people:
-            person._state['cash'] += self.government.welfare
-            self.government.cash -= self.government.welfare
+        with profiler.phase('pay_welfare'):
+            fiscal.pay_welfare(self.store, self.government)
+
+        if self.telemetry is not None:
+            with profiler.phase('telemetry'):
+                self.telemetry.observe(self.date, self.store)
+
+        self._publish_profile(profiler.end_step())
 
     def start_firm(self, person, industry, building):
         if industry == 'equip':
-            firm = CapitalEquipmentFirm(person)
-            self.capital_equipment_firms.append(firm)
+            firm = CapitalEquipmentFirm(person, self.firm_learners)
         elif industry == 'material':
-            firm = RawMaterialFirm(person)
-            self.raw_material_firms.append(firm)
+            firm = RawMaterialFirm(person, self.firm_learners)
         elif industry == 'consumer_good':
-            firm = ConsumerGoodFirm(person)
-            self.consumer_good_firms.append(firm)
+            firm = ConsumerGoodFirm(person, self.firm_learners)
         elif industry == 'healthcare':
-            firm = Hospital(person)
-            self.hospitals.append(firm)
+            firm = Hospital(person, self.firm_learners)
         building.add_tenant(firm)
-        self.firms.append(firm)
+        self.firms.add(firm)
+        self.firms_by_type[type(firm)].add(firm)
 
     def close_firm(self, firm):
         self.firms.remove(firm)
-        # messy
-        for firm_group in [self.consumer_good_firms, self.capital_equipment_firms, self.raw_material_firms]:
-            if firm in firm_group:
-                firm_group.remove(firm)
-        for building in self.buildings:
-            if firm in building.tenants:
-                building.remove_tenant(firm)
-                break
+        self.firms_by_type[type(firm)].remove(firm)
+        if firm.building is not None:
+            firm.building.remove_tenant(firm)
         firm.close()
+        self.store.release_firm(firm)
 
     def contagion_model(self):
         deaths = 0
 
         # if anyone is sick
-        if any(p._state['sick'] for p in self.people):
+        if self.store['sick'].any() and self.contagion is not None:
+            died, infected = self.contagion.step(
+                self.state['contact_rate'] * self.state['transmission_rate'],
+                self.state['sickness_severity'])
+            self.profiler.count('edges', self.contagion.n_edges)
+            for person in infected:
+                person.twoot('feeling sick...', self.state)
+            for person in died:
+                self.dies(person)
+            deaths += len(died)
+        elif self.store['sick'].any():
             # run contagion/sickness model
             c = self.state['contact_rate']
             for person in self.people:
                 if person._state['sick']:
                     # each sick person loses a little health
                     person._state['health'] -= self.state['sickness_severity']
+                    friends = person.friends
                     if person._state['health'] <= 0:
+                        # they can still pass it on today,
+                        # though dying ends their friendships
+                        friends = list(friends)
                         self.dies(person)
                         deaths += 1
                 else:
                     continue
-                for friend in person.friends:
-                    if random.random() <= c and random.random() <= self.state['transmission_rate']:
+                rand = self.rng.pool('contagion').random
+                self.profiler.count('edges', len(friends))
+                for friend in friends:
+                    if rand() <= c and rand() <= self.state['transmission_rate']:
                         friend.twoot('feeling sick...', self.state)
                         friend._state['sick'] = True
         # otherwise, see if a new sickness starts
-        elif random.random() < self.state['patient_zero_prob']:
-            patient_zero = random.choice(self.people)
+        elif self.rng.pool('contagion').random() < self.state['patient_zero_prob']:
+            patient_zero = self.rng.pool('contagion').choice(self.people)
             patient_zero._state['sick'] = True
             patient_zero.twoot('feeling sick...', self.state)
 
@@ -339,6 +477,9 @@ class City(Simulation):
         elif person.employer is not None:
             person.employer.fire(person)
         self.people.remove(person)
+        self.store.remove(person)
+        for friend in list(person.friends):
+            self.unfriend(person, friend)
         household = person.household
         household.people.remove(person)
         if not household.people:
@@ -348,145 +489,113 @@ class City(Simulation):
             'id': person.id
         })))
 
+    def befriend(self, a, b):
+        """make two people friends"""
+        for person, friend in ((a, b), (b, a)):
+            if friend not in person.friends:
+                person.friends.append(friend)
+                if person.employer is not None:
+                    person.employer.add_referral(friend)
+        self._friends_changed(a, b)
+
+    def unfriend(self, a, b):
+        """end a friendship between two people"""
+        for person, friend in ((a, b), (b, a)):
+            if friend in person.friends:
+                person.friends.remove(friend)
+                if person.employer is not None:
+                    person.employer.remove_referral(friend)
+        self._friends_changed(a, b)
+
+    def _friends_changed(self, a, b):
+        """let the frame encoder and sparse contagion know a friendship changed.
+        the adjacency already leaves out people who have left the store"""
+        present = [person for person in (a, b) if person in self.store]
+        for person in present:
+            self.frames.friends_changed(person)
+        if self.contagion is not None and len(present) == 2:
+            self.contagion.friendships_changed()
+
     def firm_distribution(self, firms):
-        """computes a probability distribution over firms based on their prices.
+        """a weighted sampler over firms based on their prices.
         the lower the price, the more likely they are to be chosen"""
-        firms = [f for f in firms if f.supply > 0]
-        probs = [math.exp(-math.log(f.price)) if f.price > 0 else 1. for f in firms]
-        mass = sum(probs)
-        return [(f, p/mass) for f, p in zip(firms, probs)]
+        self.profiler.count('firm_distribution_builds')
+        return SumTree(((f, supplier_weight(f)) for f in firms), rng=self.rng.pool('markets'))
 
     def labor_market(self, jobs):
         job_seekers = [p for p in self.people if p.seeking_job(self.state)]
-        applicants = {f: [] for _, __, f in jobs}
-
-        # iterate until there are no more job seekers or no more jobs
-        while job_seekers and jobs:
-            # job seekers apply to jobs which satisfy their wage criteria
-            # TODO should they apply to anything if nothing satifies their
-            # criteria?
-            for p in shuffle(job_seekers):
-                for job in jobs:
-                    n_vacancies, wage, firm = job
-                    if wage >= p.wage_minimum:
-                        applicants[firm].append(p)
-
-            # firms select from their applicants
-            _jobs = []
-            for job in jobs:
-                # filter down to valid applicants
-                n_vacancies, wage, firm = job
-                apps = [a for a in applicants[firm] if a in job_seekers]
-                hired, n_vacancies, wage = firm.hire(apps, wage, self.state)
-
-                # remove hired people from the job seeker pool
-                for p in hired:
-                    job_seekers.remove(p)
-
-                if not job_seekers:
-                    break
-
-                # if vacancies remain, post the new jobs with the new wage
-                if n_vacancies:
-                    _jobs.append((n_vacancies, wage, firm))
-            jobs = _jobs
+        self.profiler.count('seekers', len(job_seekers))
+        if self.config['labor_market_mode'] == 'deferred_acceptance':
+            labor.deferred_acceptance(job_seekers, jobs, self.state, rng=self.rng.labor, profiler=self.profiler)
+        else:
+            labor.labor_market(job_seekers, jobs, self.state, rng=self.rng.labor, profiler=self.profiler)
 
-    def raw_material_market(self):
-        sold = []
-        firm_dist = self.firm_distribution(self.raw_material_firms)
+    def goods_market(self, suppliers, buyers, purchase, demand=None):
+        """buyers purchase from suppliers (chosen by price) until no buyer
+        requires anything more, every supplier has sold out, or `MAX_ROUNDS`
+        rounds have passed. `purchase(buyer, supplier, desired)` returns
+        `(still_required, purchased)`.
 
-        firms = self.consumer_good_firms + self.capital_equipment_firms
+        each round, every buyer's supplier is drawn up front, so that if given,
+        `demand(buyers, suppliers)` can compute how much each buyer desires
+        from their supplier in one pass (otherwise `desired` is `None`)"""
+        sold = []
+        firm_dist = self.firm_distribution(suppliers)
+        buyers = Registry(buyers)
+        self.profiler.count('buyers', len(buyers))
         rounds = 0
-        while firms and firm_dist and rounds < MAX_ROUNDS:
-            for firm in shuffle(firms):
-                supplier = random_choice(firm_dist)
-                required, purchased = firm.purchase_materials(supplier)
-                sold.append((purchased, supplier.price))
-                if required == 0:
-                    firms.remove(firm)
-
-                # if supplier sold out, update firm distribution
-                if supplier.supply == 0:
-                    firm_dist = self.firm_distribution(self.raw_material_firms)
-
-                if not firm_dist:
-                    break
+        while buyers and firm_dist and rounds < MAX_ROUNDS:
+            with self.profiler.span('round', {'round': rounds, 'buyers': len(buyers)}):
+                order = self.rng.shuffle('markets', buyers)
+                draws = [firm_dist.sample() for _ in order]
+                desires = demand(order, draws) if demand is not None else [None] * len(order)
+                for buyer, supplier, desired in zip(order, draws, desires):
+                    # if the supplier sold out since the draw, redraw.
+                    # this is the same as drawing from the remaining suppliers
+                    if supplier.supply == 0:
+                        supplier = firm_dist.sample()
+                        desired = None
+                    required, purchased = purchase(buyer, supplier, desired)
+                    sold.append((purchased, supplier.price))
+                    if required == 0:
+                        buyers.remove(buyer)
+
+                    # if supplier sold out, update firm distribution
+                    if supplier.supply == 0:
+                        firm_dist.remove(supplier)
+
+                    if not firm_dist:
+                        break
             rounds += 1
+        self.profiler.count('rounds', rounds)
+        if rounds == MAX_ROUNDS:
+            self.profiler.count('max_rounds_reached')
+        return sold
+
+    def raw_material_market(self):
+        buyers = list(self.consumer_good_firms) + list(self.capital_equipment_firms)
+        sold = self.goods_market(self.raw_material_firms, buyers,
+                                 lambda firm, supplier, _: firm.purchase_materials(supplier))
         profits = [f.revenue - f.costs for f in self.raw_material_firms]
         return sold, profits
 
     def capital_equipment_market(self):
-        sold = []
-        firm_dist = self.firm_distribution(self.capital_equipment_firms)
-
-        firms = self.consumer_good_firms + self.raw_material_firms
-        rounds = 0
-        while firms and firm_dist and rounds < MAX_ROUNDS:
-            for firm in shuffle(firms):
-                supplier = random_choice(firm_dist)
-                required, purchased = firm.purchase_equipment(supplier)
-                sold.append((purchased, supplier.price))
-                if required == 0:
-                    firms.remove(firm)
-
-                # if supplier sold out, update firm distribution
-                if supplier.supply == 0:
-                    firm_dist = self.firm_distribution(self.capital_equipment_firms)
-
-                if not firm_dist:
-                    break
-            rounds += 1
+        buyers = list(self.consumer_good_firms) + list(self.raw_material_firms)
+        sold = self.goods_market(self.capital_equipment_firms, buyers,
+                                 lambda firm, supplier, _: firm.purchase_equipment(supplier))
         profits = [f.revenue - f.costs for f in self.capital_equipment_firms]
         return sold, profits
 
     def consumer_good_market(self):
-        firm_dist = self.firm_distribution(self.consumer_good_firms)
-
-        sold = []
-        households = [h for h in self.households]
-        rounds = 0
-        while households and firm_dist and rounds < MAX_ROUNDS:
-            for household in shuffle(households):
-                supplier = random_choice(firm_dist)
-                desired, purchased = household.purchase_goods(supplier)
-                sold.append((purchased, supplier.price))
-
-                if desired == 0:
-                    households.remove(household)
-
-                # if supplier sold out, update firm distribution
-                if supplier.supply == 0:
-                    firm_dist = self.firm_distribution(self.consumer_good_firms)
-
-                if not firm_dist:
-                    break
-            rounds += 1
-
+        demand = HouseholdDemand(self.households, self.store)
+        sold = self.goods_market(self.consumer_good_firms, self.households,
+                                 lambda household, supplier, desired: household.purchase_goods(supplier, desired),
+                                 lambda households, suppliers: demand.desired(households, [s.price for s in suppliers]))
         profits = [f.revenue - f.costs for f in self.consumer_good_firms]
         return sold, profits
 
     def healthcare_market(self):
-        sold = []
-        hospitals = [h for h in self.hospitals]
-        for person in shuffle(self.people):
-            if person._state['health'] < 1.:
-                affordable = [h for h in hospitals if h.price <= person._state['cash']]
-                if not affordable:
-                    continue
-                utilities = [person.health_change_utility(1 - person._state['health']) + person.cash_change_utility(-h.price) for h in affordable]
-                u_t = sum(utilities)
-                choices = [(h, u/u_t) for h, u in zip(hospitals, utilities)]
-                hospital = random_choice(choices)
-                hospital.sell(1)
-                person._state['cash'] -= hospital.price
-                person._state['health'] = 1
-                person._state['sick'] = False if random.random() < self.state['recovery_prob'] else True
-                sold.append(hospital.price)
-                if hospital.supply == 0:
-                    hospitals.remove(hospital)
-                if not hospitals:
-                    break
-
+        sold = healthcare.healthcare_market(self.store, self.hospitals, self.state['recovery_prob'], rng=self.rng.markets)
         profits = [f.revenue - f.costs for f in self.hospitals]
         return sold, profits
 
@@ -494,32 +603,68 @@ class City(Simulation):
         """updates an EWMA for a state, optionally send a socket message
         to graph the result"""
         self.state[name] = ewma(self.state.get(name, start_value), update)
-        if graph:
+        if self.telemetry is not None:
+            self.telemetry.stat(self.date, name, self.state[name])
+        if graph and self.listening:
             data = json.dumps({'graph':name,'data':{'time':self.date.isoformat(),'value': self.state[name]}})
             logger.info('graph:{}'.format(data))
 
     def stat(self, name, value):
-        """updates an EWMA for a state, optionally send a socket message
-        to graph the result"""
-        data = json.dumps({'graph':name,'data':{'time':self.date.isoformat(),'value': value}})
-        logger.info('graph:{}'.format(data))
+        """records a stat, and sends a socket message to graph it"""
+        if self.telemetry is not None:
+            self.telemetry.stat(self.date, name, value)
+        if self.listening:
+            data = json.dumps({'graph':name,'data':{'time':self.date.isoformat(),'value': value}})
+            logger.info('graph:{}'.format(data))
+
+    @property
+    def listening(self):
+        """whether anything is handling the log messages,
+        i.e. if it's worth serializing them"""
+        return logger.isEnabledFor(logging.INFO) and logger.hasHandlers()
 
     def _log(self, chan, data):
         """format a message for the logger"""
-        logger.info('{}:{}'.format(chan, json.dumps(data)))
+        if self.listening:
+            logger.info('{}:{}'.format(chan, json.dumps(data)))
+
+    def _publish_profile(self, step):
+        """send a step's phase times and work counts on their own channel"""
+        if step is None or not self.config['profile']:
+            return
+        if self.telemetry is not None:
+            for name, seconds in step['times'].items():
+                self.telemetry.stat(self.date, 'time.{}'.format(name), seconds)
+            for name, n in step['counts'].items():
+                self.telemetry.stat(self.date, 'count.{}'.format(name), n)
+        self._log('profile', {'time': self.date.isoformat(), 'times': step['times'], 'counts': step['counts']})
+
+    def profile_summary(self):
+        """a summary of phase times and work counts over all steps so far
+        (see `Profiler.summary`), or `None` if profiling is off"""
+        return self.profiler.summary()
+
+    def close(self):
+        """write out any buffered telemetry and trace events"""
+        if self.telemetry is not None:
+            self.telemetry.close()
+        # the process's tracer outlives the city
+        if self.tracer is not None and self.tracer is not tracing.current():
+            self.tracer.close()
 
     def firms_of_type(self, typ):
-        return [f for f in self.firms if type(f) == typ]
+        return self.firms_by_type[typ]
 
 
     def hire_dist(self, person):
         # more employed friends, more likely to have a referral
-        p_referral = st.beta.rvs(person._state['employed_friends'] + 1, 10)
-        if random.random() < p_referral:
+        p_referral = self.rng.labor.beta(person._state['employed_friends'] + 1, 10)
+        if self.rng.pool('labor').random() < p_referral:
             referral = 'friend'
         else:
             referral = 'ad_or_cold_call'
-        p = work.offer_prob(self.state['year'], self.state['month'], person._state['sex'], person._state['race'], referral)
+        p = work.offer_probs(employment_table('offer'), self.state['year'], self.state['month'],
+                             [person._state['sex']], [person._state['race']], [work.REFERRALS.index(referral)])[0]
         return [1-p, p]
 
     def get_job(self, person):
@@ -0,0 +1,83 @@
+"""
+firms' choice of productive assets: how many workers to employ, at what wage,
+and how much equipment to use, to cover the labor they require as cheaply as possible.
+
+each worker provides `labor_per_worker` labor, and each piece of equipment
+provides `labor_per_equipment` labor, but only if there's a worker to use it.
+so the cheapest mix is at most one piece of equipment per worker, and the
+problem is small enough to solve exactly by enumerating worker counts.
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+# solutions are memoized, keyed on their inputs
+CACHE_SIZE = 4096
+_cache = OrderedDict()
+
+
+def min_wage(mean_wage, altruism, wage_increment):
+    """the lowest wage a firm will offer; more altruistic owners pay more"""
+    down_wage_pressure = (-altruism+1.1) * -wage_increment
+    return mean_wage - down_wage_pressure
+
+
+def solve(required_labor, wage, equip_price, labor_per_worker, labor_per_equipment):
+    """cheapest integer numbers of workers and equipment providing at least
+    `required_labor`, for arrays of `required_labor`, `wage` and `equip_price`.
+    returns `(n_workers, n_equipment)` arrays"""
+    required_labor = np.asarray(required_labor, dtype=np.float64)
+    wage = np.asarray(wage, dtype=np.float64)
+    equip_price = np.asarray(equip_price, dtype=np.float64)
+    required_labor = np.maximum(required_labor, 0)
+
+    # with fewer workers than `lo`, even fully equipped they can't provide enough labor;
+    # with `hi` workers they provide enough without equipment
+    hi = np.ceil(required_labor/labor_per_worker).astype(np.int64)
+    if labor_per_equipment <= 0:
+        return hi, np.zeros_like(hi)
+    lo = np.ceil(required_labor/(labor_per_worker + labor_per_equipment)).astype(np.int64)
+
+    span = int((hi - lo).max()) + 1 if len(hi) else 1
+    n_workers = lo[:,None] + np.arange(span)[None,:]
+    n_equipment = np.ceil((required_labor[:,None] - n_workers * labor_per_worker)/labor_per_equipment)
+    n_equipment = np.maximum(n_equipment, 0).astype(np.int64)
+    cost = n_workers * wage[:,None] + n_equipment * equip_price[:,None]
+    cost[n_workers > hi[:,None]] = np.inf
+
+    best = np.argmin(cost, axis=1)
+    rows = np.arange(len(best))
+    return n_workers[rows, best], n_equipment[rows, best]
+
+
+def assess(required_labor, mean_wage, mean_equip_price, altruism, config):
+    """`(n_workers, wage, n_equipment)` for each firm, given
+    each firm's required labor and owner's altruism"""
+    # the mean wage and equipment price are EWMAs, so they're different every day.
+    # solutions are keyed on the (whole) wage offered instead, and the equipment
+    # price to the cent, so they carry over from one day to the next
+    params = (config['labor_per_worker'], config['labor_per_equipment'])
+    equip_price = round(mean_equip_price, 2)
+    wages = np.ceil([min_wage(mean_wage, a, config['wage_increment']) for a in altruism]).astype(np.int64)
+    keys = [(r, w, equip_price) + params for r, w in zip(required_labor, wages.tolist())]
+
+    missing = list({k for k in keys if k not in _cache})
+    solved = {}
+    if missing:
+        n_workers, n_equipment = solve([k[0] for k in missing], [k[1] for k in missing],
+                                       [equip_price] * len(missing), *params)
+        for k, n_w, n_e in zip(missing, n_workers.tolist(), n_equipment.tolist()):
+            solved[k] = (n_w, k[1], n_e)
+
+    results = []
+    for k in keys:
+        if k in solved:
+            results.append(solved[k])
+        else:
+            _cache.move_to_end(k)
+            results.append(_cache[k])
+
+    _cache.update(solved)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return results
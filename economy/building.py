@@ -1,6 +1,7 @@
 import json
 import logging
 from uuid import uuid4
+from world.registry import Registry
 
 logger = logging.getLogger('simulation.buildings')
 
@@ -9,13 +10,13 @@ class Building():
     def __init__(self, max_tenants, rent):
         self.id = uuid4().hex
         self.rent = rent
-        self.tenants = []
+        self.tenants = Registry()
         self.max_tenants = max_tenants
 
     def add_tenant(self, tenant):
         if len(self.tenants) >= self.max_tenants:
             return False
-        self.tenants.append(tenant)
+        self.tenants.add(tenant)
         tenant.building = self
         self.log({'event': 'added_tenant',
                   'tenant': {
@@ -4,27 +4,65 @@ import logging
 import numpy as np
 from scipy import optimize
 from cess import Agent
-from cess.util import random_choice
-from cess.agent.learn import QLearner
-from world.work import offer_prob, precompute_employment_dist
+from world import bundle
+from world.registry import Registry
+from world.work import offer_probs, offer_prob_table, unemployment_table, precompute_employment_dist, REFERRALS, FIRST_YEAR
+from .sampler import weighted_sample
+from .learning import BatchQLearner
+from . import assets
 
 logger = logging.getLogger('simulation.firms')
 
-# save time, precompute and cache
-emp_dist = precompute_employment_dist()
+# save time, precompute and cache. loaded from the world bundle or
+# computed on first use, since the employment distribution comes from the PUMS data
+_tables = {}
+
+
+def set_employment_dist(emp_dist):
+    """precompute the offer and unemployment tables from an employment
+    distribution, as from `precompute_employment_dist`"""
+    _tables['offer'] = offer_prob_table(emp_dist)
+    _tables['unemployed'] = unemployment_table(emp_dist)
+
+
+def employment_table(name):
+    """the `'offer'` (see `offer_prob_table`) or `'unemployed'` (see `unemployment_table`) table"""
+    if not _tables:
+        b = bundle.load()
+        if b is not None:
+            _tables['offer'] = b['employment.offer']
+            _tables['unemployed'] = b['employment.unemployed']
+        else:
+            set_employment_dist(precompute_employment_dist())
+    return _tables[name]
+
+FRIEND_REFERRAL = REFERRALS.index('friend')
+AD_REFERRAL = REFERRALS.index('ad_or_cold_call')
+
+
+def offer_weights(applicants, firms, world):
+    """probability of each firm offering the matching applicant a job"""
+    referrals = [FRIEND_REFERRAL if a in f.referrals else AD_REFERRAL for a, f in zip(applicants, firms)]
+    return offer_probs(employment_table('offer'), world['year'], world['month'],
+                       [a.sex for a in applicants], [a.race for a in applicants], referrals)
 
 
 class Firm(Agent):
     config = {}
 
-    def __init__(self, owner):
+    def __init__(self, owner, learners=None):
         self.owner = owner
         self.owner._state['firm_owner'] = True
         self.owner.firm = self
         self.desired_supply = 1
 
         # initialize
-        self.workers = []
+        self.workers = Registry()
+
+        # for each person, how many of their friends work here
+        # (friendships are mutual, so these are the friends of workers)
+        self.referrals = {}
+
         self.revenue = 0
         self.costs = 0
         self.supply = 0
@@ -33,10 +71,19 @@ class Firm(Agent):
         self.equipment = 0
         self.materials = 0
 
-        # all states map to the same actions
-        action_ids = [i for i in range(len(self.actions))]
-        states_actions = {s: action_ids for s in range(5)}
-        self.learner = QLearner(states_actions, self.reward, discount=0.5, explore=0.01, learning_rate=0.8)
+        # set when a building takes the firm as a tenant;
+        # if it's full, the firm goes without (and pays no rent)
+        self.building = None
+
+        # all states map to the same actions.
+        # firms sharing a learner population learn together; each firm is a row
+        self.learners = learners if learners is not None else self.new_learners()
+        self.learner = self.learners.alloc(self.reward)
+
+    @classmethod
+    def new_learners(cls, rng=None):
+        """a fresh learner population for firms: 5 states, 6 actions"""
+        return BatchQLearner(5, 6, discount=0.5, explore=0.01, learning_rate=0.8, rng=rng)
 
     @property
     def id(self):
@@ -96,36 +143,51 @@ class Firm(Agent):
         worker.employer = None
         worker.wage = 0
         self.workers.remove(worker)
+        for friend in worker.friends:
+            self.remove_referral(friend)
         logger.info('person:{}'.format(json.dumps({
             'event': 'fired',
             'id': worker.id
         })))
 
-    def hire(self, applicants, wage, world):
+    def add_referral(self, friend):
+        """a worker has a new friend who can be referred"""
+        self.referrals[friend] = self.referrals.get(friend, 0) + 1
+
+    def remove_referral(self, friend):
+        """a worker has lost a friend who could be referred"""
+        n = self.referrals[friend] - 1
+        if n:
+            self.referrals[friend] = n
+        else:
+            del self.referrals[friend]
+
+    def offer_weight(self, applicant, world):
+        """probability of the firm offering the applicant a job"""
+        return offer_weights([applicant], [self], world)[0]
+
+    def employ(self, worker, wage):
+        if worker.employer is not None:
+            worker.employer.fire(worker)
+        worker.wage = wage
+        worker.employer = self
+        self.workers.add(worker)
+        for friend in worker.friends:
+            self.add_referral(friend)
+        logger.info('person:{}'.format(json.dumps({
+            'event': 'hired',
+            'id': worker.id
+        })))
+        self.worker_change -= 1
+
+    def hire(self, applicants, wage, world, rng=np.random):
         hired = []
-        while self.worker_change > 0 and applicants:
-            # based on employment prob
-            apps = []
-            for a in applicants:
-                ref = 'friend' if set(a.friends).intersection(self.workers) else 'ad_or_cold_call'
-                p = offer_prob(world['year'], world['month'], a.sex, a.race, ref, precomputed_emp_dist=emp_dist)
-                apps.append((a, p))
-            apps_mass = sum(p for a, p in apps)
-            apps = [(a, pr/apps_mass) for a, pr in apps]
-
-            worker = random_choice(apps)
-            if worker.employer is not None:
-                worker.employer.fire(worker)
-            worker.wage = wage
-            worker.employer = self
-            applicants.remove(worker)
-            self.workers.append(worker)
-            hired.append(worker)
-            logger.info('person:{}'.format(json.dumps({
-                'event': 'hired',
-                'id': worker.id
-            })))
-            self.worker_change -= 1
+        n_hires = min(self.worker_change, len(applicants))
+        if n_hires > 0:
+            # draw without replacement, weighted by employment prob
+            for worker in applicants.sample(self, n_hires, world, rng):
+                self.employ(worker, wage)
+                hired.append(worker)
 
         # increase wage to attract more employees
         if self.worker_change > 0:
@@ -137,6 +199,7 @@ class Firm(Agent):
         self.owner.firm = None
         for worker in self.workers:
             self.fire(worker)
+        self.learner.free()
 
     def produce(self, world):
         """produce the firm's product. the firm will produce the desired supply if possible,
@@ -148,7 +211,8 @@ class Firm(Agent):
         # set desired price
         wages = sum(w.wage for w in self.workers)
         self.costs += wages
-        self.costs += self.building.rent/30 # approximately spread out rent cost
+        if self.building is not None:
+            self.costs += self.building.rent/30 # approximately spread out rent cost
         self.cash -= wages
         cost_per_unit = self.costs/self.supply
         self.price = max(0, cost_per_unit + self.profit_margin)
@@ -194,6 +258,21 @@ class Firm(Agent):
 
     def assess_assets(self, required_labor, mean_wage, mean_equip_price):
         """identify desired mixture of productive assets, i.e. workers, equipment, and wage"""
+        if self.config.get('asset_optimizer') == 'scipy':
+            return self.assess_assets_scipy(required_labor, mean_wage, mean_equip_price)
+        return assets.assess([required_labor], mean_wage, mean_equip_price, [self.owner.altruism], self.config)[0]
+
+    @classmethod
+    def assess_all_assets(cls, firms, required_labor, world):
+        """`assess_assets` for many firms at once"""
+        if cls.config.get('asset_optimizer') == 'scipy':
+            return [f.assess_assets_scipy(r, world['mean_wage'], world['mean_equip_price'])
+                    for f, r in zip(firms, required_labor)]
+        return assets.assess(required_labor, world['mean_wage'], world['mean_equip_price'],
+                             [f.owner.altruism for f in firms], cls.config)
+
+    def assess_assets_scipy(self, required_labor, mean_wage, mean_equip_price):
+        """`assess_assets` by numerical optimization; slow, kept for verification"""
         down_wage_pressure = (-self.owner.altruism+1.1) * -self.config['wage_increment']
 
         def objective(x):
@@ -233,16 +312,37 @@ class Firm(Agent):
         self.costs += cost
         return self.desired_equipment - self.equipment, to_purchase
 
-    def set_production_target(self, world):
+    def set_production_target(self, world, rng=np.random):
         """firm decides on how much supply they want to produce this step,
         and what they need to do to accomplish that"""
+        required_labor = self.plan_production(world)
+        n_workers, wage, n_equip = self.assess_assets(required_labor, world['mean_wage'], world['mean_equip_price'])
+        return self.set_assets(world, n_workers, wage, n_equip, rng)
 
-        # assess previous day's results
+    def review(self):
+        """assess previous day's results, returning the resulting state"""
         self.prev_profit = self.profit
         self.leftover = self.supply
+        return self.current_state
+
+    @classmethod
+    def plan_all_production(cls, firms, world, learners):
+        """`plan_production` for many firms at once, choosing all
+        their actions in one batch. `learners` is the population
+        the firms' learners are in"""
+        states = [f.review() for f in firms]
+        actions = learners.choose_actions([f.learner.row for f in firms], states,
+                                          [f.reward(s) for f, s in zip(firms, states)])
+        return [f.plan_production(world, a) for f, a in zip(firms, actions.tolist())]
+
+    def plan_production(self, world, action=None):
+        """decide how much supply to produce this step;
+        returns the labor required to produce it.
+        if `action` isn't given, the firm reviews its results and chooses one"""
+        if action is None:
+            action = self.learner.choose_action(self.review())
 
         # adjust production
-        action = self.learner.choose_action(self.current_state)
         action = self.actions[action]
         self.desired_supply = max(1, self.desired_supply + action.get('supply', 0))
         self.profit_margin += action.get('profit_margin', 0)
@@ -264,8 +364,12 @@ class Firm(Agent):
                 self.fire(worker)
 
         # figure out labor goal
-        required_labor = self.desired_supply * self.config['labor_cost_per_good']
-        n_workers, wage, n_equip = self.assess_assets(required_labor, world['mean_wage'], world['mean_equip_price'])
+        return self.desired_supply * self.config['labor_cost_per_good']
+
+    def set_assets(self, world, n_workers, wage, n_equip, rng=np.random):
+        """adjust the workforce and equipment towards the desired assets,
+        laying off workers drawn with `rng`.
+        returns the number of job vacancies and the wage offered"""
 
         # sometimes optimization function returns a huge negative value for
         # workers, need to look into that further
@@ -276,17 +380,15 @@ class Firm(Agent):
         self.desired_equipment = self.equipment + max(0, n_equip - self.equipment)
 
         # fire workers if necessary
-        while self.worker_change < 0:
+        if self.worker_change < 0:
             # weighted random choice by unemployment prob
-            ws = []
-            for w in self.workers:
-                pu = emp_dist[world['year']][world['month'] - 1][w.race.name][w.sex.name]
-                ws.append((w, pu['unemployed']))
-            ws_mass = sum(p for w, p in ws)
-            ws = [(w, p/ws_mass) for w, p in ws]
-            worker = random_choice(ws)
-            self.fire(worker)
-            self.worker_change += 1
+            workers = list(self.workers)
+            races = np.array([w.race for w in workers], dtype=np.int64)
+            sexes = np.array([w.sex for w in workers], dtype=np.int64)
+            weights = employment_table('unemployed')[world['year'] - FIRST_YEAR, world['month'] - 1, races - 1, sexes - 1]
+            for i in weighted_sample(weights, -self.worker_change, rng):
+                self.fire(workers[i])
+            self.worker_change = 0
 
         # job vacancies
         return self.worker_change, wage
@@ -346,7 +448,8 @@ class Hospital(Firm):
         # set desired price
         wages = sum(w.wage for w in self.workers)
         self.costs += wages
-        self.costs += self.building.rent/30 # approximately spread out rent cost
+        if self.building is not None:
+            self.costs += self.building.rent/30 # approximately spread out rent cost
         self.cash -= wages
         cost_per_unit = self.costs/self.supply if self.supply else 0
         self.price = max(0, cost_per_unit + self.profit_margin)
@@ -0,0 +1,55 @@
+"""
+the fiscal phase: taxes, wage payments and welfare,
+computed over the state store's columns rather than person by person.
+"""
+
+import numpy as np
+
+
+def collect_taxes(store, government):
+    """firm owners pay taxes on their firm's profit,
+    employees are paid their wages (capped by what their employer has)
+    and pay income tax on them. returns total taxes collected.
+
+    people are taken in row order, the order `city.people` goes in, so
+    a wage cap sees the employer's post-tax cash only if its owner comes
+    before the employee, as when paying them one at a time"""
+    cash = store['cash']
+    rate = government.tax_rate
+
+    # corporate taxes
+    owners = np.flatnonzero(store['firm_owner'])
+    profits = np.array([store.agents[r].firm.profit for r in owners], dtype=np.float64)
+    corporate_taxes = np.maximum(profits, 0) * rate
+
+    # each employer's cash before taxes, and the row of its owner
+    # (-1 if they aren't in the store, e.g. the government, so never taxed here)
+    employer_cash = np.array([f.cash if f is not None else 0. for f in store.firms], dtype=np.float64)
+    owner_row = np.array([f.owner._state.row if f is not None and f.owner in store else -1
+                          for f in store.firms], dtype=np.int64)
+    owner_tax = np.zeros(len(store))
+    owner_tax[owners] = corporate_taxes
+    cash[owners] -= corporate_taxes
+
+    # wages and income taxes
+    employer = store['employer']
+    employees = np.flatnonzero(~store['firm_owner'] & (employer >= 0))
+    slots = employer[employees]
+    owned_by = owner_row[slots]
+    taxed_first = (owned_by >= 0) & (owned_by < employees)
+    caps = employer_cash[slots] - np.where(taxed_first, owner_tax[owned_by], 0)
+    wages = np.minimum(store['wage'][employees], caps)
+    income_taxes = wages * rate
+    cash[employees] += wages - income_taxes
+
+    # TODO should people keep track of how much they are _actually_
+    # paid vs their stated wage?
+    taxes = corporate_taxes.sum() + income_taxes.sum()
+    government.cash += taxes
+    return taxes
+
+
+def pay_welfare(store, government):
+    """everyone receives the government's welfare payment"""
+    store['cash'][:] += government.welfare
+    government.cash -= government.welfare * len(store)
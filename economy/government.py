@@ -1,7 +1,6 @@
-import random
 from cess import Agent
 from enum import IntEnum
-from cess.agent.learn import QLearner
+from .learning import BatchQLearner
 from .firms import ConsumerGoodFirm, CapitalEquipmentFirm, RawMaterialFirm, Hospital
 
 industries = {
@@ -13,7 +12,7 @@ industries = {
 
 
 class Government(Agent):
-    def __init__(self, tax_rate, welfare, tax_rate_increment, welfare_increment, starting_welfare_req):
+    def __init__(self, tax_rate, welfare, tax_rate_increment, welfare_increment, starting_welfare_req, rng=None):
         self._state = {'cash': 0}
         self.tax_rate = tax_rate
         self.tax_rate_increment = tax_rate_increment
@@ -29,9 +28,8 @@ class Government(Agent):
         self.altruism = 0
 
         # all states map to the same actions
-        action_ids = [i for i in range(len(self.actions))]
-        states_actions = {s: action_ids for s in range(3)}
-        self.learner = QLearner(states_actions, self.reward, discount=0.5, explore=0.01, learning_rate=0.5)
+        learners = BatchQLearner(3, len(self.actions), discount=0.5, explore=0.01, learning_rate=0.5, capacity=1, rng=rng)
+        self.learner = learners.alloc(self.reward)
 
         # keep track of previous step's quality of life for comparison
         self.prev_qol = 0
@@ -84,11 +82,11 @@ class Government(Agent):
         v = float(proposal['value']) if proposal.get('value') is not None else None
         if t == ProposalType.nationalize.name:
             industry = proposal['target']
-            firm = random.choice(world.firms_of_type(industries[industry]))
+            firm = world.rng.pool('city').choice(world.firms_of_type(industries[industry]))
             firm.change_owner(self)
         elif t == ProposalType.privatize.name:
             industry = proposal['target']
-            firm = random.choice(world.firms_of_type(industries[industry]))
+            firm = world.rng.pool('city').choice(world.firms_of_type(industries[industry]))
 
             # randomly pick new owner
             # we pick the person with the most money who does not already have a firm
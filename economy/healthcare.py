@@ -0,0 +1,67 @@
+"""
+the healthcare market: people in less than full health
+buy treatment from hospitals, all in one batch.
+"""
+
+import numpy as np
+from .household import cash_utility
+from .sampler import weighted_keys
+
+
+def health_utility(health):
+    """`Person.health_utility`, over an array"""
+    return np.where(health <= 0, -10000, np.sqrt(np.maximum(health, 0)) * 100)
+
+
+def healthcare_market(store, hospitals, recovery_prob, rng=np.random):
+    """people in less than full health, in random order, each buy treatment
+    from a hospital which still has supply. they choose among the hospitals
+    they can afford in proportion to the utility of treatment there
+    (the restored health, less the cost). returns the price of each treatment sold"""
+    hospitals = [h for h in hospitals if h.supply > 0]
+    health = store['health']
+    rows = np.flatnonzero(health < 1.)
+    if not hospitals or not rows.size:
+        return []
+    rng.shuffle(rows)
+
+    cash = store['cash'][rows]
+    frugality = np.sqrt(1.1 + np.array([store.agents[r].frugality for r in rows], dtype=np.float64))
+    prices = np.array([h.price for h in hospitals], dtype=np.float64)
+
+    # utility of treatment, people × hospitals
+    health_change = health_utility(np.ones(len(rows))) - health_utility(health[rows])
+    cash_change = cash_utility(cash[:,None] - prices[None,:], frugality[:,None]) - cash_utility(cash, frugality)[:,None]
+    utility = health_change[:,None] + cash_change
+    options = (prices[None,:] <= cash[:,None]) & (utility > 0)
+
+    # each person's hospitals from first to last choice, as if drawn
+    # one at a time weighted by utility. so taking the first which still
+    # has supply is a weighted draw among what's left
+    keys = weighted_keys(np.where(options, utility, 1.), rng)
+    keys[~options] = -np.inf
+    prefs = np.argsort(-keys, axis=1).tolist()
+    n_options = options.sum(axis=1).tolist()
+
+    supply = [h.supply for h in hospitals]
+    n_supply = sum(supply)
+    choice = np.full(len(rows), -1, dtype=np.int64)
+    for i, (pref, n) in enumerate(zip(prefs, n_options)):
+        for j in pref[:n]:
+            if supply[j]:
+                supply[j] -= 1
+                n_supply -= 1
+                choice[i] = j
+                break
+        if not n_supply:
+            break
+
+    treated = choice >= 0
+    rows, choice = rows[treated], choice[treated]
+    store['cash'][rows] -= prices[choice]
+    store['health'][rows] = 1
+    store['sick'][rows] = rng.random(len(rows)) >= recovery_prob
+    for hospital, n_sold in zip(hospitals, np.bincount(choice, minlength=len(hospitals)).tolist()):
+        if n_sold:
+            hospital.sell(n_sold)
+    return prices[choice].tolist()
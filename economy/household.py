@@ -1,9 +1,14 @@
 import math
+import numpy as np
+from world.registry import Registry
+
+# TODO this is a stop-gap - limit consumption to 10 items
+MAX_EXCESS_CONSUMPTION = 10
 
 
 class Household():
     def __init__(self, people, consumer_good_utility):
-        self.people = people
+        self.people = Registry(people)
         self.goods = 0
         self.health = 1
         self.good_utility = consumer_good_utility
@@ -29,8 +34,7 @@ class Household():
 
     def excess_consumption(self, price):
         i = 0
-        # TODO this is a stop-gap - limit consumption to 10 items
-        while self.marginal_utility(price, self.min_consumption + i) > 0 and i < 10:
+        while self.marginal_utility(price, self.min_consumption + i) > 0 and i < MAX_EXCESS_CONSUMPTION:
             i += 1
         return i
 
@@ -46,6 +50,9 @@ class Household():
         u_ = self.consumer_good_utility(n_goods + 1)
         return round(u_ - u, 4)
 
+    def desired_goods(self, price):
+        return max(0, (self.min_consumption + self.excess_consumption(price)) - self.goods)
+
     def consumer_good_utility(self, n_goods):
         # sigmoid
         return 1/(1 + math.exp(-n_goods)) - 0.5
@@ -54,8 +61,11 @@ class Household():
     def cash(self):
         return sum(p._state['cash'] for p in self.people)
 
-    def purchase_goods(self, supplier):
-        desired_goods = max(0, (self.min_consumption + self.excess_consumption(supplier.price)) - self.goods)
+    def purchase_goods(self, supplier, desired_goods=None):
+        """`desired_goods` can be passed in if it's already been computed
+        for this supplier's price (see `HouseholdDemand`)"""
+        if desired_goods is None:
+            desired_goods = self.desired_goods(supplier.price)
 
         if not supplier.price:
             to_purchase = desired_goods
@@ -82,3 +92,74 @@ class Household():
             self.health += (self.goods - self.min_consumption) * 0.2
             self.health = min(1, self.health)
         return self.health > 0
+
+
+def _sigmoid_utility(n_goods):
+    """`Household.consumer_good_utility`, over an array"""
+    return 1/(1 + np.exp(-n_goods)) - 0.5
+
+
+def cash_utility(cash, frugality):
+    """`Person.cash_utility`, over arrays. `frugality` is `sqrt(1.1 + frugality)`"""
+    with np.errstate(over='ignore'):
+        u = np.where(cash <= 0, cash - 1, 400/(1 + np.exp(-cash/20000)) - (400/2))
+    return u * frugality
+
+
+class HouseholdDemand():
+    """computes `Household.desired_goods` for many households at once,
+    from their members' cash (read from the state store) and frugality.
+    households' membership shouldn't change while this is in use"""
+
+    def __init__(self, households, store):
+        self.store = store
+        self.households = list(households)
+        self.index = {h: i for i, h in enumerate(self.households)}
+
+        members = [(i, p) for i, h in enumerate(self.households) for p in h.people]
+        self.member_household = np.array([i for i, _ in members], dtype=np.int64)
+        self.member_rows = np.array([p._state.row for _, p in members], dtype=np.int64)
+        self.member_frugality = np.sqrt(1.1 + np.array([p.frugality for _, p in members], dtype=np.float64))
+
+        self.min_consumption = np.array([h.min_consumption for h in self.households])
+        self.good_utility = np.array([h.good_utility for h in self.households], dtype=np.float64)
+
+    def desired(self, households, prices):
+        """desired goods for each of `households`, at the matching price in `prices`"""
+        hh = np.array([self.index[h] for h in households], dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        n = len(hh)
+
+        # select the members of these households;
+        # `local` is the member's household's position in `hh`
+        position = np.full(len(self.households), -1, dtype=np.int64)
+        position[hh] = np.arange(n)
+        local = position[self.member_household]
+        sel = local >= 0
+        local = local[sel]
+        frugality = self.member_frugality[sel]
+        cash = self.store.columns['cash'][self.member_rows[sel]]
+        price = prices[local]
+        utility = self.good_utility[hh][local]
+
+        # the parts of each member's marginal utility
+        # which don't depend on the number of goods
+        cash_change = cash_utility(cash - price, frugality) - cash_utility(cash, frugality)
+        purchasing = np.divide(utility**2, price * frugality, out=utility**2, where=price != 0)
+        base = cash_change + purchasing
+
+        # step up through the excess consumption levels together
+        min_consumption = self.min_consumption[hh]
+        excess = np.zeros(n, dtype=np.int64)
+        buying = np.ones(n, dtype=np.bool_)
+        for i in range(MAX_EXCESS_CONSUMPTION):
+            n_goods = min_consumption + i
+            change = np.round(_sigmoid_utility(n_goods + 1) - _sigmoid_utility(n_goods), 4)
+            marginal = np.bincount(local, weights=np.round(base + change[local], 4), minlength=n)
+            buying &= marginal > 0
+            if not buying.any():
+                break
+            excess += buying
+
+        goods = np.array([h.goods for h in households])
+        return np.maximum(0, min_consumption + excess - goods).tolist()
@@ -0,0 +1,222 @@
+"""
+the labor market: matching job seekers to firms' vacancies.
+"""
+
+import numpy as np
+from world.profiler import NullProfiler
+from world.work import offer_probs
+from .firms import offer_weights, employment_table, AD_REFERRAL
+from .sampler import SumTree, RankTree, weighted_keys
+
+
+class SeekerIndex():
+    """job seekers sorted by their wage minimum, so the seekers
+    who would accept a wage are a prefix found by bisection.
+
+    apart from referrals, a firm's offer weight for a seeker only depends
+    on their sex and race, so seekers are also grouped by those, with a
+    `RankTree` per group of who's still looking. applicants can then be
+    counted and drawn from without listing them (see `Applicants`)"""
+
+    def __init__(self, seekers):
+        seekers = list(seekers)
+        minimums = np.array([p.wage_minimum for p in seekers], dtype=np.float64)
+        order = np.argsort(minimums, kind='stable')
+        self.seekers = [seekers[i] for i in order]
+        self.minimums = minimums[order]
+        self.position = {p: i for i, p in enumerate(self.seekers)}
+
+        # who is still looking
+        self.seeking = np.ones(len(self.seekers), dtype=np.bool_)
+        self.n_seeking = len(self.seekers)
+
+        # each group's positions (in ascending order), and each seeker's rank in their group
+        keys = [(p.sex, p.race) for p in self.seekers]
+        self.groups = sorted(set(keys))
+        index = {key: g for g, key in enumerate(self.groups)}
+        self.group = np.array([index[key] for key in keys], dtype=np.int64)
+        self.members = [np.flatnonzero(self.group == g) for g in range(len(self.groups))]
+        self.rank = np.zeros(len(self.seekers), dtype=np.int64)
+        for members in self.members:
+            self.rank[members] = np.arange(len(members))
+        self.looking = [RankTree(len(members)) for members in self.members]
+
+    def __bool__(self):
+        return self.n_seeking > 0
+
+    def __len__(self):
+        return self.n_seeking
+
+    def applicants(self, wage):
+        """seekers still looking who would accept this wage"""
+        return Applicants(self, np.searchsorted(self.minimums, wage, side='right'))
+
+    def remove(self, person):
+        i = self.position[person]
+        if self.seeking[i]:
+            self.seeking[i] = False
+            self.n_seeking -= 1
+            self.looking[self.group[i]].add(self.rank[i], -1)
+
+
+class Applicants():
+    """the seekers still looking among the first `end` of a `SeekerIndex`,
+    i.e. those who would accept a wage. they are counted and drawn from by
+    group, so the work is proportional to the draws (and the firm's
+    referrals), not to the number of applicants"""
+
+    def __init__(self, index, end):
+        self.index = index
+        self.end = end
+        # how many of each group's members would accept the wage
+        self.ends = [int(np.searchsorted(members, end)) for members in index.members]
+
+    def __len__(self):
+        return sum(looking.count(end) for looking, end in zip(self.index.looking, self.ends))
+
+    def sample(self, firm, n, world, rng=np.random):
+        """up to `n` applicants drawn without replacement, each weighted by the
+        firm's offer weight (the same distribution as `weighted_sample` over them
+        all). applicants with no chance of an offer aren't drawn"""
+        index = self.index
+        taken = []
+
+        # referred applicants have weights of their own, so they're set aside from their groups
+        referred = [p for p in firm.referrals if p in index.position]
+        referred = [p for p in referred if index.position[p] < self.end and index.seeking[index.position[p]]]
+        for p in referred:
+            i = index.position[p]
+            index.looking[index.group[i]].add(index.rank[i], -1)
+        referrals = SumTree(zip(referred, offer_weights(referred, [firm] * len(referred), world)), rng=rng)
+
+        sexes, races = zip(*index.groups) if index.groups else ((), ())
+        group_weights = offer_probs(employment_table('offer'), world['year'], world['month'],
+                                    sexes, races, [AD_REFERRAL] * len(index.groups))
+        counts = np.array([looking.count(end) for looking, end in zip(index.looking, self.ends)], dtype=np.float64)
+
+        drawn = []
+        while len(drawn) < n:
+            weights = counts * group_weights
+            total = weights.sum() + referrals.total
+            if total <= 0:
+                # no one left has any chance of an offer
+                break
+            roll = rng.random() * total
+            if roll < referrals.total:
+                person = referrals.sample()
+                referrals.remove(person)
+                drawn.append(person)
+                continue
+
+            # a group, then anyone in it
+            g = int(np.searchsorted(np.cumsum(weights), roll - referrals.total, side='right'))
+            g = min(g, len(weights) - 1)
+            while not weights[g]:
+                g -= 1
+            looking = index.looking[g]
+            rank = looking.find(int(rng.random() * counts[g]))
+            looking.add(rank, -1)
+            counts[g] -= 1
+            taken.append((g, rank))
+            drawn.append(index.seekers[index.members[g][rank]])
+
+        # leave the index as it was; the hired are removed from it separately
+        for g, rank in taken:
+            index.looking[g].add(rank, 1)
+        for p in referred:
+            i = index.position[p]
+            index.looking[index.group[i]].add(index.rank[i], 1)
+        return drawn
+
+
+def labor_market(job_seekers, jobs, world, rng=np.random, profiler=NullProfiler()):
+    """job seekers apply to every job which satisfies their wage criteria
+    and firms hire from their applicants. firms which still have vacancies
+    raise their wage and post again, until there are no more job seekers
+    or no more jobs. `jobs` are `(n_vacancies, wage, firm)`"""
+    # TODO should they apply to anything if nothing satifies their
+    # criteria?
+    seekers = SeekerIndex(job_seekers)
+    while seekers and jobs:
+        _jobs = []
+        with profiler.span('round', {'seekers': len(seekers), 'jobs': len(jobs)}):
+            for n_vacancies, wage, firm in jobs:
+                applicants = seekers.applicants(wage)
+                profiler.count('applicants', len(applicants))
+                hired, n_vacancies, wage = firm.hire(applicants, wage, world, rng)
+
+                # remove hired people from the job seeker pool
+                for p in hired:
+                    seekers.remove(p)
+
+                if not seekers:
+                    break
+
+                # if vacancies remain, post the new jobs with the new wage
+                if n_vacancies:
+                    _jobs.append((n_vacancies, wage, firm))
+        jobs = _jobs
+
+
+def deferred_acceptance(job_seekers, jobs, world, rng=np.random, profiler=NullProfiler()):
+    """clears the labor market in one batch, by seeker-proposing deferred
+    acceptance. seekers prefer higher wages (among the jobs which satisfy
+    their wage criteria). firms rank the seekers who propose to them by a
+    random key weighted by `Firm.offer_weight`, i.e. the order they'd hire
+    them in if they drew one applicant at a time. `jobs` are
+    `(n_vacancies, wage, firm)`; returns the hired `(person, firm)` pairs.
+
+    every seeker proposes to each job at most once,
+    so this takes at most `len(jobs) + 1` passes"""
+    jobs = [job for job in jobs if job[0] > 0]
+    seekers = list(job_seekers)
+    if not jobs or not seekers:
+        return []
+
+    # jobs from best to worst wage, ties in random order. since seekers
+    # only care about wage, each seeker's preference list is the prefix of
+    # these which satisfies their wage minimum
+    wages = np.array([wage for _, wage, _ in jobs], dtype=np.float64)
+    order = np.lexsort((rng.random(len(jobs)), -wages))
+    jobs = [jobs[i] for i in order]
+    wages = wages[order]
+    capacity = np.array([n_vacancies for n_vacancies, _, _ in jobs], dtype=np.int64)
+    minimums = np.array([p.wage_minimum for p in seekers], dtype=np.float64)
+    n_acceptable = np.searchsorted(-wages, -minimums, side='right')
+
+    next_choice = np.zeros(len(seekers), dtype=np.int64)
+    free = np.arange(len(seekers))
+    held_seekers = np.zeros(0, dtype=np.int64)
+    held_jobs = np.zeros(0, dtype=np.int64)
+    held_keys = np.zeros(0, dtype=np.float64)
+    for i in range(len(jobs) + 1):
+        proposing = free[next_choice[free] < n_acceptable[free]]
+        if not proposing.size:
+            break
+        with profiler.span('round', {'round': i, 'proposing': len(proposing)}):
+            proposed = next_choice[proposing]
+            next_choice[proposing] += 1
+            profiler.count('applicants', len(proposing))
+
+            # weighted random keys (larger is better): sorting by these is
+            # the same as drawing without replacement, weighted by offer weight
+            keys = weighted_keys(offer_weights([seekers[s] for s in proposing],
+                                               [jobs[j][2] for j in proposed], world), rng)
+
+            # each job holds on to its best proposals, up to its vacancies
+            s = np.concatenate([held_seekers, proposing])
+            j = np.concatenate([held_jobs, proposed])
+            k = np.concatenate([held_keys, keys])
+            o = np.lexsort((-k, j))
+            s, j, k = s[o], j[o], k[o]
+            rank = np.arange(len(j)) - np.searchsorted(j, j, side='left')
+            keep = rank < capacity[j]
+            held_seekers, held_jobs, held_keys = s[keep], j[keep], k[keep]
+            free = s[~keep]
+
+    hired = []
+    for s, j in zip(held_seekers, held_jobs):
+        _, wage, firm = jobs[j]
+        firm.employ(seekers[s], wage)
+        hired.append((seekers[s], firm))
+    return hired
@@ -0,0 +1,115 @@
+"""
+q-learning for a whole population of learners at once (e.g. all firms).
+
+every learner has the same states and actions, so their q-tables
+are rows of one `[n_learners, n_states, n_actions]` array, and choosing
+actions and learning from the results are done for all learners together.
+"""
+
+import numpy as np
+
+
+class BatchQLearner():
+    """learners are rows, allocated when a learner is created
+    and freed (to be reused) when it's done"""
+
+    def __init__(self, n_states, n_actions, discount=0.5, explore=0.01, learning_rate=0.5, capacity=16, rng=None):
+        self.n_states = n_states
+        self.n_actions = n_actions
+        self.discount = discount
+        self.explore = explore
+        self.learning_rate = learning_rate
+        self.rng = rng if rng is not None else np.random
+
+        self.Q = np.zeros((capacity, n_states, n_actions))
+
+        # each learner's previous state and action, -1 if none yet
+        self.prev_state = np.full(capacity, -1, dtype=np.int64)
+        self.prev_action = np.full(capacity, -1, dtype=np.int64)
+
+        self.active = np.zeros(capacity, dtype=np.bool_)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def alloc(self, reward=None):
+        """a fresh learner, as a `QRow`. `reward` maps a state to a reward;
+        by default the state is the reward"""
+        if not self._free:
+            self._grow()
+        row = self._free.pop()
+        self.Q[row] = 0
+        self.prev_state[row] = -1
+        self.prev_action[row] = -1
+        self.active[row] = True
+        return QRow(self, row, reward)
+
+    def free(self, row):
+        if self.active[row]:
+            self.active[row] = False
+            self._free.append(row)
+
+    def _grow(self):
+        capacity = len(self.active)
+        new_capacity = 2 * capacity
+        Q = np.zeros((new_capacity, self.n_states, self.n_actions))
+        Q[:capacity] = self.Q
+        self.Q = Q
+        self.prev_state = np.concatenate([self.prev_state, np.full(capacity, -1, dtype=np.int64)])
+        self.prev_action = np.concatenate([self.prev_action, np.full(capacity, -1, dtype=np.int64)])
+        self.active = np.concatenate([self.active, np.zeros(capacity, dtype=np.bool_)])
+        self._free.extend(range(new_capacity - 1, capacity - 1, -1))
+
+    def learn(self, rows, states, rewards):
+        """update the value of each learner's previous state and action,
+        given the state it led to and that state's reward"""
+        rows = np.asarray(rows, dtype=np.int64)
+        states = np.asarray(states, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.float64)
+
+        # learners which haven't acted yet have nothing to learn
+        acted = self.prev_state[rows] >= 0
+        rows, states, rewards = rows[acted], states[acted], rewards[acted]
+        prev_s, prev_a = self.prev_state[rows], self.prev_action[rows]
+
+        old = self.Q[rows, prev_s, prev_a]
+        best = self.Q[rows, states].max(axis=1)
+        self.Q[rows, prev_s, prev_a] = old + self.learning_rate * (rewards + self.discount * best - old)
+
+    def choose_actions(self, rows, states, rewards):
+        """learn from each learner's new state, then choose its next action:
+        the best known action for the state (ties go to the first),
+        or with probability `explore` a random one"""
+        rows = np.asarray(rows, dtype=np.int64)
+        states = np.asarray(states, dtype=np.int64)
+        self.learn(rows, states, rewards)
+
+        actions = self.Q[rows, states].argmax(axis=1)
+        explore = self.rng.random(len(rows)) < self.explore
+        actions[explore] = (self.rng.random(int(explore.sum())) * self.n_actions).astype(np.int64)
+
+        self.prev_state[rows] = states
+        self.prev_action[rows] = actions
+        return actions
+
+
+class QRow():
+    """one learner in a `BatchQLearner`, for choosing actions one at a time"""
+
+    def __init__(self, learners, row, reward=None):
+        self.learners = learners
+        self.row = row
+        self.reward = reward
+
+    @property
+    def Q(self):
+        """this learner's `[n_states, n_actions]` q-table"""
+        return self.learners.Q[self.row]
+
+    def choose_action(self, state):
+        reward = self.reward(state) if self.reward is not None else state
+        return int(self.learners.choose_actions([self.row], [state], [reward])[0])
+
+    def free(self):
+        self.learners.free(self.row)
@@ -0,0 +1,132 @@
+"""
+weighted sampling: of suppliers for the goods markets,
+and of people (e.g. applicants to hire, workers to lay off).
+"""
+
+import math
+import random
+import numpy as np
+
+
+class SumTree():
+    """weighted random choice over a fixed set of keys.
+    weights live in the leaves of a binary tree whose inner nodes hold
+    the sums of their children, so drawing a key and updating (or zeroing)
+    a key's weight are both O(log n)."""
+
+    def __init__(self, weights, rng=random):
+        """`weights` is an iterable of `(key, weight)`. `rng` is
+        anything with a `random()` method, e.g. a `world.rng.RandomPool`"""
+        self.rng = rng
+        weights = list(weights)
+        self.keys = [k for k, _ in weights]
+        self.index = {k: i for i, k in enumerate(self.keys)}
+
+        self.size = 1
+        while self.size < len(self.keys):
+            self.size *= 2
+        self.tree = [0.] * (2 * self.size)
+        for i, (_, w) in enumerate(weights):
+            self.tree[self.size + i] = w
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = self.tree[2*i] + self.tree[2*i + 1]
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __bool__(self):
+        return self.total > 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def weight(self, key):
+        return self.tree[self.size + self.index[key]]
+
+    def update(self, key, weight):
+        i = self.size + self.index[key]
+        self.tree[i] = weight
+        i //= 2
+        while i:
+            self.tree[i] = self.tree[2*i] + self.tree[2*i + 1]
+            i //= 2
+
+    def remove(self, key):
+        """a removed key can no longer be drawn"""
+        self.update(key, 0.)
+
+    def sample(self):
+        """draw a key in proportion to its weight. there must be some weight left"""
+        roll = self.rng.random() * self.total
+        i = 1
+        while i < self.size:
+            left = self.tree[2*i]
+            # never descend into an empty subtree, even if
+            # rounding pushes the roll past the right subtree's sum
+            if roll < left or not self.tree[2*i + 1]:
+                i = 2*i
+            else:
+                roll -= left
+                i = 2*i + 1
+        return self.keys[i - self.size]
+
+
+class RankTree():
+    """which of `n` positions are still counted (all of them, to start with),
+    as a fenwick tree: counting those before a position, finding the i-th
+    counted one and adding or taking one away are all O(log n)"""
+
+    def __init__(self, n):
+        self.n = n
+        # all ones: each node counts the positions it covers
+        self.tree = [0] + [i & -i for i in range(1, n + 1)]
+        self.top = 1
+        while self.top * 2 <= n:
+            self.top *= 2
+
+    def add(self, pos, delta):
+        i = pos + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count(self, end):
+        """how many of the positions before `end` are counted"""
+        total, i = 0, end
+        while i:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, rank):
+        """the position of the `rank`-th (from 0) counted position"""
+        pos, step = 0, self.top
+        while step:
+            if pos + step <= self.n and self.tree[pos + step] <= rank:
+                pos += step
+                rank -= self.tree[pos]
+            step //= 2
+        return pos
+
+
+def supplier_weight(firm):
+    """the lower the price, the more likely a firm is to be chosen.
+    firms with nothing to sell are never chosen"""
+    if firm.supply <= 0:
+        return 0.
+    return math.exp(-math.log(firm.price)) if firm.price > 0 else 1.
+
+
+def weighted_keys(weights, rng=np.random):
+    """random keys for weighted sampling without replacement: ordering
+    by key (largest first) is the same as drawing one at a time, each draw
+    weighted among what's left"""
+    weights = np.asarray(weights, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        return np.log(1 - rng.random(weights.shape))/weights
+
+
+def weighted_sample(weights, k, rng=np.random):
+    """indices of `k` weighted draws without replacement"""
+    return np.argsort(-weighted_keys(weights, rng))[:k]
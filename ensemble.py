@@ -0,0 +1,173 @@
+"""
+run many headless cities across config overrides and seeds, in parallel,
+aggregating their stats as they come in.
+
+    from ensemble import grid, run_ensemble
+    configs = grid({'tax_rate': [0.1, 0.3, 0.5], 'contact_rate': [0.05, 0.1]})
+    results = run_ensemble(configs, seeds=range(10), n_days=90)
+    results[0]['mean_wage']['mean'] # the mean wage on each day, for the first config
+
+the base population is loaded once, before the worker processes are forked,
+so it (and the precomputed world tables) are shared copy-on-write. each run
+gets its own copy of the population to mutate.
+
+each run's stats come back as one `[n_days]` array per stat, and are folded
+into running means and variances, and a bounded reservoir of runs for
+quantiles, so memory doesn't grow with the number of runs. likewise only a
+few runs per worker are queued at a time. runs are folded in in the order
+they were queued, and each config's reservoir is seeded by its index, so
+the summaries don't depend on which worker finishes first.
+"""
+
+import random
+import warnings
+import itertools
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from city import City
+from world import bundle
+from economy.firms import employment_table
+from world.population import load_population, copy_population
+
+# the base population, shared with forked workers
+_population = None
+
+
+def grid(overrides):
+    """every combination of `overrides`, a dict of `{config key: [values]}`"""
+    keys = sorted(overrides)
+    return [dict(zip(keys, values)) for values in itertools.product(*[overrides[k] for k in keys])]
+
+
+def random_configs(ranges, n, seed=None):
+    """`n` configs drawn uniformly from `ranges`, a dict of `{config key: (low, high)}`"""
+    rng = np.random.RandomState(seed)
+    return [{k: rng.uniform(low, high) for k, (low, high) in sorted(ranges.items())} for _ in range(n)]
+
+
+class StatCollector():
+    """stands in for a city's telemetry, keeping only the stats, one value per stat per day"""
+
+    def __init__(self, start_date, n_days):
+        self.start = start_date.toordinal()
+        self.n_days = n_days
+        self.stats = {}
+
+    def stat(self, date, name, value):
+        day = date.toordinal() - self.start - 1
+        if name not in self.stats:
+            self.stats[name] = np.full(self.n_days, np.nan)
+        if 0 <= day < self.n_days:
+            self.stats[name][day] = value
+
+    def observe(self, date, store):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(config, seed, n_days, n_people=None):
+    """run one city headless; returns its stats, `{name: [n_days] array}`"""
+    random.seed(seed)
+    np.random.seed(seed)
+    population = copy_population(_population[:n_people] if n_people else _population)
+    city = City(population, dict(config, seed=seed))
+    city.telemetry = StatCollector(city.date, n_days)
+    for _ in range(n_days):
+        city.step()
+    return city.telemetry.stats
+
+
+class Aggregate():
+    """online summary of one stat over runs: per-day mean and variance
+    (Welford's method) and a fixed-size reservoir of runs for quantiles.
+    `seed` seeds which runs the reservoir keeps"""
+
+    def __init__(self, n_days, reservoir_size=256, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.n_runs = 0
+        self.n = np.zeros(n_days)
+        self.mean = np.zeros(n_days)
+        self.m2 = np.zeros(n_days)
+        self.reservoir = np.full((reservoir_size, n_days), np.nan)
+
+    def add(self, values):
+        seen = ~np.isnan(values)
+        self.n[seen] += 1
+        delta = np.where(seen, values - self.mean, 0)
+        self.mean[seen] += delta[seen]/self.n[seen]
+        self.m2[seen] += (delta * (values - self.mean))[seen]
+
+        size = len(self.reservoir)
+        if self.n_runs < size:
+            self.reservoir[self.n_runs] = values
+        else:
+            i = self.rng.integers(self.n_runs + 1)
+            if i < size:
+                self.reservoir[i] = values
+        self.n_runs += 1
+
+    @property
+    def var(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > 1, self.m2/(self.n - 1), np.nan)
+
+    def quantiles(self, qs):
+        rows = self.reservoir[:min(self.n_runs, len(self.reservoir))]
+        if not len(rows):
+            return np.full((len(qs), rows.shape[1]), np.nan)
+        with warnings.catch_warnings():
+            # days no run reached are all nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanquantile(rows, qs, axis=0)
+
+    def summary(self, qs):
+        return {'n': self.n.copy(), 'mean': self.mean.copy(), 'var': self.var, 'quantiles': self.quantiles(qs)}
+
+
+def run_ensemble(configs, seeds, n_days, population=None, n_people=None,
+                 max_workers=None, quantiles=(0.05, 0.5, 0.95), reservoir_size=256):
+    """run every config in `configs` once per seed in `seeds`, for `n_days` each.
+    returns, for each config (in order), `{stat: {'n', 'mean', 'var', 'quantiles'}}`,
+    each an array over days (`quantiles` is `[len(quantiles), n_days]`)"""
+    global _population
+    _population = population if population is not None else load_population('data/population.json')
+
+    # fill the world tables now, so forked workers share them rather than each computing them
+    bundle.load()
+    employment_table('offer')
+
+    seeds = list(seeds)
+    aggregates = [{} for _ in configs]
+    jobs = enumerate((i, config, seed) for i, config in enumerate(configs) for seed in seeds)
+    max_workers = max_workers or mp.cpu_count()
+    ctx = mp.get_context('fork')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as executor:
+        # keep a few runs queued per worker. runs are folded in in order,
+        # so those finished ahead of an earlier one wait for it (within the same window)
+        window = 2 * max_workers
+        futures = {}
+        finished = {}
+        next_run = 0
+        def submit(n):
+            for k, (i, config, seed) in itertools.islice(jobs, n):
+                futures[executor.submit(run, config, seed, n_days, n_people)] = k, i
+        submit(window)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                k, i = futures.pop(future)
+                finished[k] = i, future.result()
+            while next_run in finished:
+                i, stats = finished.pop(next_run)
+                aggs = aggregates[i]
+                for name, values in stats.items():
+                    if name not in aggs:
+                        aggs[name] = Aggregate(n_days, reservoir_size, seed=i)
+                    aggs[name].add(values)
+                next_run += 1
+            submit(window - len(futures) - len(finished))
+
+    return [{name: agg.summary(quantiles) for name, agg in aggs.items()} for aggs in aggregates]
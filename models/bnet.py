@@ -1,85 +1,192 @@
 """
 for using probabilistic graphical models (bayes' nets in particular).
+
+a net is fit to data through its `Counts`: how many rows fall in each of
+each node's groups, and for each edge, in each pair of groups. these are
+sufficient statistics for its distributions, and counts of different data
+add up, so a net can be fit to a file in chunks (see `count_csv`), in
+parallel, and updated with more data (e.g. another year's) without going
+over the data it was already fit to.
 """
 
+import os
 import logging
+import numpy as np
 import pandas as pd
 import networkx as nx
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from cess.util import random_choice
 
 logger = logging.getLogger(__name__)
 
+# likelihood of a value never seen in a group (as smoothed in `probs_given`)
+MIN_LIKELIHOOD = 1e-20
+
+# how many posterior probabilities `sample_batch` works on at a time
+BLOCK_SIZE = 2**22
+
+# how many posteriors `probs_given` keeps, keyed on node and evidence
+CACHE_SIZE = 4096
+
+# rows per chunk when counting a csv
+CHUNK_SIZE = 100000
+
+
+def _codes(df, n, bins):
+    """a node's groups (its bins, if it has them, otherwise its values),
+    and the index of each row's group in them (-1 if it has none)"""
+    if bins.get(n) is not None:
+        cut = pd.cut(df[n.value], bins[n])
+        return list(cut.cat.categories), np.asarray(cut.cat.codes, dtype=np.int64)
+    codes, labels = pd.factorize(df[n.value], sort=True)
+    return list(labels), np.asarray(codes, dtype=np.int64)
+
+
+class Counts():
+    """sufficient statistics for fitting a `BNet`: the number of rows, how
+    many are in each node's groups (`sizes`, `{node: series}`) and for each
+    edge, how many are in each pair of groups (`joint`, `{(node, parent):
+    dataframe}`, indexed by the node's groups, with a column per parent group).
+    adding counts of different data gives the counts of all of it"""
+
+    def __init__(self, n_rows=0, sizes=None, joint=None):
+        self.n_rows = n_rows
+        self.sizes = sizes or {}
+        self.joint = joint or {}
+
+    def __add__(self, other):
+        sizes = dict(self.sizes)
+        for n, size in other.sizes.items():
+            sizes[n] = size if n not in sizes else \
+                sizes[n].add(size, fill_value=0).astype(np.int64)
+        joint = dict(self.joint)
+        for edge, table in other.joint.items():
+            joint[edge] = table if edge not in joint else \
+                joint[edge].add(table, fill_value=0).fillna(0).astype(np.int64)
+        return Counts(self.n_rows + other.n_rows, sizes, joint)
+
+
+def count(df, nodes, edges, bins):
+    """the `Counts` of a dataframe, for a net's nodes and `(parent, node)` edges"""
+    coded = {n: _codes(df, n, bins) for n in nodes}
+    sizes, joint = {}, {}
+    for n, (labels, codes) in coded.items():
+        sizes[n] = pd.Series(np.bincount(codes[codes >= 0], minlength=len(labels)),
+                             index=pd.Index(labels), dtype=np.int64)
+    for parent, n in edges:
+        labels, codes = coded[n]
+        p_labels, p_codes = coded[parent]
+        k, m = len(labels), len(p_labels)
+        both = (codes >= 0) & (p_codes >= 0)
+        table = np.bincount(codes[both] * m + p_codes[both], minlength=k * m).reshape(k, m)
+        joint[n, parent] = pd.DataFrame(table, index=pd.Index(labels), columns=pd.Index(p_labels))
+    return Counts(len(df), sizes, joint)
+
+
+def count_csv(path, nodes, edges, bins, chunksize=CHUNK_SIZE, max_workers=None):
+    """the `Counts` of a csv, read in chunks of `chunksize` rows and counted
+    by up to `max_workers` processes (or in this one, if it's 1). only a few
+    chunks are read ahead of the workers, so memory is bounded by the chunk size"""
+    nodes, edges = list(nodes), list(edges)
+    chunks = pd.read_csv(path, usecols=[n.value for n in nodes], chunksize=chunksize)
+    counts = Counts()
+    if max_workers == 1:
+        for chunk in chunks:
+            counts += count(chunk, nodes, edges, bins)
+        return counts
+
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(count, chunk, nodes, edges, bins))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    counts += future.result()
+        for future in pending:
+            counts += future.result()
+    return counts
+
+
 class BNet():
-    def __init__(self, nodes, edges, data, bins, precompute=True):
-        """creates the graphical model (bayes net)"""
+    def __init__(self, nodes, edges, data, bins, cache_size=CACHE_SIZE):
+        """creates the graphical model (bayes net), fit to
+        `data`, a dataframe or its `Counts` (see `count`)"""
         self.g = nx.DiGraph()
         self.g.add_nodes_from(nodes)
         self.g.add_edges_from(edges)
         self.bins = bins
-        self.df = data
 
-        if precompute:
-            self._cache = self._precompute_dists()
-        else:
-            self._cache = {}
-
-    def groups(self, n):
-        """get user-specified grouping criteria (bins) if it exists,
-        otherwise just group by the variable"""
-        bins = self.bins.get(n)
-        if bins is not None:
-            grouper = pd.cut(self.df[n.value], bins)
-        else:
-            grouper = n.value
-        return self.df.groupby(grouper)
+        # normalized posteriors, least recently used first
+        self.cache_size = cache_size
+        self._posteriors = OrderedDict()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        self.fit(data)
+
+    @classmethod
+    def from_csv(cls, path, nodes, edges, bins, chunksize=CHUNK_SIZE, max_workers=None, **kwargs):
+        """creates the model, fit to a csv in chunks (see `count_csv`)"""
+        counts = count_csv(path, nodes, edges, bins, chunksize, max_workers)
+        return cls(nodes, edges, counts, bins, **kwargs)
+
+    def fit(self, data):
+        """fit the model to data (a dataframe or its `Counts`),
+        dropping anything computed from earlier data"""
+        self.counts = Counts()
+        self.update(data)
+
+    def update(self, data):
+        """fit the model to more data (a dataframe or its `Counts`,
+        e.g. another year's) on top of what it was fit to"""
+        if not isinstance(data, Counts):
+            data = count(data, self.g.nodes(), self.g.edges(), self.bins)
+        self.counts = self.counts + data
+        self._cache = self._precompute_dists()
+
+        # compiled on first use, see `compile`
+        self._compiled = None
+        self._posteriors.clear()
 
     def probs_given(self, n, given={}):
         """computes distribution across groups
         given other variable values, assuming given
         variables are independent. that is, it computes
-        prod(p(g|x_i) for x_i in given)/Z"""
-        probs = {}
+        prod(p(g|x_i) for x_i in given)/Z. values
+        of nodes which aren't parents of `n` are ignored.
 
-        # used cached distributions, if available
-        if self._cache:
-            dist = self._cache[n.name]
-            prior_probs = dist['_']
+        the most recently used distributions are cached,
+        so don't modify the returned dict"""
+        key = (n, frozenset(given.items()))
+        probs = self._posteriors.get(key)
+        if probs is not None:
+            self._posteriors.move_to_end(key)
+            self.cache_stats['hits'] += 1
+            return probs
 
-            for group, prior_prob in prior_probs.items():
-                likelihood = 1.
-                for key, val in given.items():
-                    try:
-                        likelihood *= dist[key.name][val]
-                    except KeyError:
-                        likelihood = 1e-20 # non-zero likelihood
-                probs[group] = prior_prob * likelihood
+        self.cache_stats['misses'] += 1
+        probs = self._probs_given(n, given)
+        if self.cache_size:
+            self._posteriors[key] = probs
+            if len(self._posteriors) > self.cache_size:
+                self._posteriors.popitem(last=False)
+                self.cache_stats['evictions'] += 1
+        return probs
 
-        else:
-            groups = self.groups(n)
-            prior_probs = (groups.size()/len(self.df)).to_dict()
-
-            # compute conditional probabilities for each group
-            for group, prior_prob in prior_probs.items():
-                df_g = groups.get_group(group)
-                group_size = len(df_g)
-
-                likelihood = 1.
-                for key, val in given.items():
-                    bins = self.bins.get(key)
-                    if bins is None:
-                        # smoothing
-                        likelihood *= max(len(df_g[df_g[key.value] == val])/group_size, 1e-20)
-                    else:
-                        # bin this group accordingly
-                        # and count the corresponding bin
-                        grouper = pd.cut(df_g[key.value], bins)
-                        subgroup = df_g.groupby(grouper)
-                        try:
-                            likelihood *= len(subgroup.get_group(val))/group_size
-                        except KeyError:
-                            likelihood = 0
-
-                probs[group] = prior_prob * likelihood
+    def _probs_given(self, n, given):
+        probs = {}
+        dist = self._cache[n.name]
+        prior_probs = dist['_']
+        likelihoods = [(dist[key.name], val) for key, val in given.items() if key.name in dist]
+
+        for group, prior_prob in prior_probs.items():
+            likelihood = 1.
+            for p_p_n, val in likelihoods:
+                # smoothing, for values never seen in this group
+                likelihood *= p_p_n[group].get(val, MIN_LIKELIHOOD)
+            probs[group] = prior_prob * likelihood
 
         # normalize to a distribution
         total = sum(probs.values())
@@ -89,7 +196,7 @@ class BNet():
         if total == 0:
             logger.warn('Not enough data to learn a conditional distribution for {} given {}; falling back to unconditional distribution'.format(n, given))
             total = sum(prior_probs.values())
-            probs = prior_probs
+            probs = dict(prior_probs)
 
         for group in probs.keys():
             probs[group] /= total
@@ -99,14 +206,11 @@ class BNet():
     def sample_node(self, n, sampled):
         """sample an individual node,
         samples from parents as necessary"""
-        parents = self.g.predecessors(n)
+        parents = list(self.g.predecessors(n))
 
         if not parents:
             # if no parents, use p(n)
-            try:
-                prob_dist = self._cache[n.name]['_']
-            except KeyError:
-                prob_dist = self.p_n(n)
+            prob_dist = self._cache[n.name]['_']
         else:
             # if parents, use prod(p(n|x_i) for x_i in parents)
             for parent in parents:
@@ -118,7 +222,7 @@ class BNet():
         return sampled
 
     def _precompute_dists(self):
-        """precompute pgm distributions in advance"""
+        """precompute pgm distributions from the counts"""
         dists = {}
         for n in self.g.nodes():
             name = n.name
@@ -131,23 +235,122 @@ class BNet():
 
     def p_n(self, n):
         """p(n) for a node"""
-        return (self.groups(n).size()/len(self.df)).to_dict()
+        return (self.counts.sizes[n]/self.counts.n_rows).to_dict()
 
     def p_p_n(self, n, parent):
-        """p(parent|n) for a node"""
+        """p(parent|n) for a node, as `{group: {parent group: p}}`"""
+        sizes = self.counts.sizes[n]
+        table = self.counts.joint[n, parent].reindex(index=sizes.index, fill_value=0)
+        vals = list(table.columns)
         dist = {}
-        groups = self.groups(n)
-        bins = self.bins.get(parent)
-        for group, df_g in groups:
-            group_size = len(df_g)
-            if bins is None:
-                grouper = parent.value
-            else:
-                grouper = pd.cut(df_g[parent.value], bins)
-            subgroups = df_g.groupby(grouper)
-            dist = (subgroups.size()/group_size).to_dict()
+        for group, size, row in zip(sizes.index, sizes.values, table.values):
+            dist[group] = {vals[j]: row[j]/size for j in np.flatnonzero(row)} if size else {}
         return dist
 
+    def compile(self):
+        """integer-code the net for `sample_batch`. returns its nodes in
+        topological order, as `(node, groups, log p(n), parents)`, where
+        `parents` are `(parent, log p(parent|n))` and each `p(parent|n)` is
+        a `(parent groups + 1, groups)` array, its last row for parent
+        values which aren't in the data"""
+        compiled = []
+        for n in nx.topological_sort(self.g):
+            sizes = self.counts.sizes[n]
+            with np.errstate(divide='ignore'):
+                log_prior = np.log(sizes.values/self.counts.n_rows)
+
+            parents = []
+            for parent in self.g.predecessors(n):
+                p_sizes = self.counts.sizes[parent]
+                counts = self.counts.joint[n, parent].reindex(
+                    index=sizes.index, columns=p_sizes.index, fill_value=0).values
+                likelihood = np.full((len(p_sizes) + 1, len(sizes)), MIN_LIKELIHOOD)
+                likelihood[:-1] = np.maximum(counts.T/np.maximum(sizes.values, 1), MIN_LIKELIHOOD)
+                parents.append((parent, np.log(likelihood).astype(np.float32)))
+            compiled.append((n, list(sizes.index), log_prior, parents))
+        self._compiled = compiled
+        return compiled
+
+    def sample_batch(self, n, evidence=None, rng=np.random):
+        """sample `n` complete records at once, as `{node: array of values}`.
+        `evidence` fixes nodes' values, either one for all records or a
+        sequence of one per record.
+
+        this is `sample` with the net compiled to arrays (see `compile`):
+        each node's posterior, `p(n) * prod(p(x_i|n) for x_i in parents)`, is
+        computed in log space for each distinct combination of parent values
+        and drawn from by inverse CDF. `p(x_i|n)` is estimated within each of
+        `n`'s groups, and values not in the data get a likelihood of
+        `MIN_LIKELIHOOD`"""
+        evidence = evidence or {}
+        compiled = self._compiled or self.compile()
+        values, codes = {}, {}
+        for node, labels, log_prior, parents in compiled:
+            if node in evidence:
+                val = evidence[node]
+                index = pd.Index(labels)
+                if np.ndim(val) == 0:
+                    values[node] = np.full(n, val, dtype=object)
+                    codes[node] = np.full(n, index.get_indexer([val])[0], dtype=np.int64)
+                else:
+                    values[node] = np.asarray(val)
+                    codes[node] = index.get_indexer(values[node]).astype(np.int64)
+                continue
+
+            k = len(labels)
+
+            # number each combination of parent values (-1, i.e. not in the
+            # data, is the last value of each), so records which share one
+            # share its posterior. if there are too many to number, every
+            # record gets its own
+            radices = [len(log_likelihood) for _, log_likelihood in parents]
+            n_configs = 1
+            for radix in radices:
+                n_configs *= radix
+            shared = n_configs < 2**63
+            if shared:
+                config = np.zeros(n, dtype=np.int64)
+                for (parent, _), radix in zip(parents, radices):
+                    config = config * radix + codes[parent] % radix
+
+            drawn = np.empty(n, dtype=np.int64)
+            block = max(1, BLOCK_SIZE//k)
+            for start in range(0, n, block):
+                end = min(start + block, n)
+                if shared:
+                    configs, inverse = np.unique(config[start:end], return_inverse=True)
+                    rows = len(configs)
+                    parent_codes = []
+                    for radix in reversed(radices):
+                        configs, c = np.divmod(configs, radix)
+                        parent_codes.append(c)
+                    parent_codes.reverse()
+                else:
+                    rows = end - start
+                    inverse = np.arange(rows)
+                    parent_codes = [codes[parent][start:end] for parent, _ in parents]
+
+                log_probs = np.repeat(log_prior[None,:].astype(np.float32), rows, axis=0)
+                for (_, log_likelihood), c in zip(parents, parent_codes):
+                    log_probs += log_likelihood[c]
+
+                # inverse CDF: offset each row's CDF by its row number,
+                # so one search finds every record's draw in its own row
+                log_probs -= log_probs.max(axis=1, keepdims=True)
+                cdf = np.cumsum(np.exp(log_probs, out=log_probs), axis=1, dtype=np.float64)
+                cdf /= cdf[:,-1:]
+                cdf[:,-1] = 1.
+                cdf += np.arange(rows)[:,None]
+                rolls = inverse + rng.random(len(inverse))
+                drawn[start:end] = np.minimum(
+                    np.searchsorted(cdf.ravel(), rolls, side='right') - inverse * k, k - 1)
+
+            groups = np.empty(k, dtype=object)
+            groups[:] = labels
+            values[node] = groups[drawn]
+            codes[node] = drawn
+        return values
+
     def sample(self, sampled=None):
         """sample from the complete PGM"""
         sampled = sampled or {}
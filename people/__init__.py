@@ -1,19 +1,33 @@
 import math
 import json
+import random
 import logging
 import asyncio
 import numpy as np
 from datetime import datetime
 from cess import Agent
 from .names import generate_name
-from .generate import generate
+from .generate import generate, generate_batch
 from .attribs import Sex, Race, Education
-from cess.util import random_choice
+from .state import StateView, StateStore
 
 
 logger = logging.getLogger('simulation.people')
 
 
+def weighted_choice(choices, rng=random):
+    """like `cess.util.random_choice`, but drawing from `rng`
+    (anything with a `random()` method). `choices` are `(choice, prob)`"""
+    roll = rng.random()
+    acc = 0
+    for choice, p in choices:
+        acc += p
+        if roll <= acc:
+            return choice
+    # the probs may sum to a bit less than 1
+    return choice
+
+
 class Person(Agent):
     base_min_consumption = 1
     wage_under_market_multiplier = 2
@@ -27,6 +41,16 @@ class Person(Agent):
         attribs.update(kwargs)
         return cls(**attribs)
 
+    @classmethod
+    def generate_batch(cls, year, n, given=None, rng=np.random, **kwargs):
+        """generate `n` random people at once"""
+        people = []
+        for attribs in generate_batch(year, n, given, rng=rng):
+            attribs.pop('year', None)
+            attribs.update(kwargs)
+            people.append(cls(**attribs))
+        return people
+
     @property
     def quality_of_life(self):
         if hasattr(self, 'household'):
@@ -52,6 +76,34 @@ class Person(Agent):
     def cash_change_utility(self, change):
         return self.cash_utility(self._state['cash'] + change) - self.cash_utility(self._state['cash'])
 
+    # wage and employer read/write through to
+    # the state store, if this person is in one
+    @property
+    def wage(self):
+        if isinstance(self.__dict__.get('_state'), StateView):
+            return self._state.wage
+        return self._wage
+
+    @wage.setter
+    def wage(self, value):
+        if isinstance(self.__dict__.get('_state'), StateView):
+            self._state.wage = value
+        else:
+            self._wage = value
+
+    @property
+    def employer(self):
+        if isinstance(self.__dict__.get('_state'), StateView):
+            return self._state.employer
+        return self._employer
+
+    @employer.setter
+    def employer(self, firm):
+        if isinstance(self.__dict__.get('_state'), StateView):
+            self._state.employer = firm
+        else:
+            self._employer = firm
+
     """an individual in the city"""
     def __init__(self, **kwargs):
         for k, v in kwargs.items():
@@ -169,7 +221,7 @@ class Person(Agent):
             return True
         return False
 
-    def start_business(self, world, buildings):
+    def start_business(self, world, buildings, rng=random):
         # can only have one business
         if self._state['firm_owner']:
             return False, None, None
@@ -180,7 +232,7 @@ class Person(Agent):
             return False, None, None
 
         denom = sum(1/b.rent for b in buildings)
-        building = random_choice([(b, 1/(b.rent*denom)) for b in buildings])
+        building = weighted_choice([(b, 1/(b.rent*denom)) for b in buildings], rng)
 
         # must be able to hire at least one employee
         min_cost = self.min_business_capital + building.rent + world['mean_wage']
@@ -191,7 +243,7 @@ class Person(Agent):
         industries = ['equip', 'material', 'consumer_good', 'healthcare']
         total_mean_profit = sum(world['mean_{}_profit'.format(name)] for name in industries)
         industry_dist = [(name, world['mean_{}_profit'.format(name)]/total_mean_profit) for name in industries]
-        industry = random_choice(industry_dist)
+        industry = weighted_choice(industry_dist, rng)
 
         # choose an industry (based on highest EWMA profit)
         self.twoot('i\'m starting a BUSINESS in {}!'.format(industry), world)
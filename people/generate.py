@@ -6,12 +6,12 @@ based on PUMS data
 
 import json
 import random
-import pandas as pd
+import numpy as np
 from . import attribs
 from enum import Enum
 from models.bnet import BNet
-from world import rent
-from world.work import income_brackets
+from world import rent, bundle
+from world.work import pums, income_brackets
 
 
 with open('data/world/nyc.json', 'r') as f:
@@ -89,9 +89,37 @@ for income_var in income_vars:
     edges.append((income_var, Var.puma))
 
 
-df = pd.read_csv('data/people/gen/pums_nyc.csv')
-bins = {income_var: income_brackets[income_var.value] for income_var in income_vars}
-pgm = BNet(nodes, edges, df, bins, precompute=True)
+# loaded or fit on first use, so importing this module doesn't need the PUMS data
+_model = {}
+
+
+def model():
+    """the bayes' net fit to the PUMS data, and the top code of each income
+    variable (which means N/A), as `(income_max, pgm)`. the net's counts
+    come from the world bundle if there is one (see `world/bundle.py`)"""
+    if not _model:
+        brackets = income_brackets()
+        bins = {income_var: brackets[income_var.value] for income_var in income_vars}
+        b = bundle.load()
+        if b is not None:
+            _model['income_max'] = {Var[k]: v for k, v in b.meta['bnet']['income_max'].items()}
+            _model['pgm'] = BNet(nodes, edges, b.counts(nodes, edges, bins), bins)
+        else:
+            df, _ = pums()
+            _model['income_max'] = {income_var: df[income_var.value].max() for income_var in income_vars}
+            _model['pgm'] = BNet(nodes, edges, df, bins)
+    return _model['income_max'], _model['pgm']
+
+
+def income_bounds(income_max, income_var, income_bracket):
+    """the bounds of an income bracket, or `None` if it means no income"""
+    na_val = '{}]'.format(income_max[income_var])
+    if income_bracket.endswith(na_val)\
+            or income_bracket.endswith('0]')\
+            or income_bracket.startswith('(0'):
+        return None
+    lbound, ubound = income_bracket[1:-1].split(',')
+    return int(float(lbound)), int(float(ubound))
 
 
 def generate(year, given=None):
@@ -100,19 +128,17 @@ def generate(year, given=None):
     given = {Var[k]: v for k, v in given.items()}
     given[Var.year] = year
 
+    income_max, pgm = model()
     sample = pgm.sample(sampled=given)
 
     income_brackets = {}
     for income_var in income_vars:
-        na_val = '{}]'.format(df[income_var.value].max())
         income_bracket = sample[income_var]
-        if income_bracket.endswith(na_val)\
-                or income_bracket.endswith('0]')\
-                or income_bracket.startswith('(0'):
+        bounds = income_bounds(income_max, income_var, income_bracket)
+        if bounds is None:
             sample[income_var] = 0
         else:
-            lbound, ubound = income_bracket[1:-1].split(',')
-            sample[income_var] = random.randint(int(float(lbound)), int(float(ubound)))
+            sample[income_var] = random.randint(*bounds)
 
         income_brackets['{}_bracket'.format(income_var.name)] = income_bracket
 
@@ -144,3 +170,62 @@ def generate(year, given=None):
     sample['puma'] = int(sample['puma'])
 
     return sample
+
+
+def generate_batch(year, n, given=None, rng=np.random):
+    """generates `n` people at once (see `BNet.sample_batch`),
+    as a list of what `generate` returns for each"""
+    given = given or {}
+    given = {Var[k]: v for k, v in given.items()}
+    given[Var.year] = year
+
+    income_max, pgm = model()
+    samples = pgm.sample_batch(n, given, rng=rng)
+
+    # incomes, drawn uniformly within their brackets
+    incomes = {}
+    for income_var in income_vars:
+        brackets = samples[income_var]
+        income = np.zeros(n, dtype=np.int64)
+        for income_bracket in set(brackets):
+            bounds = income_bounds(income_max, income_var, income_bracket)
+            if bounds is not None:
+                idx = np.flatnonzero(brackets == income_bracket)
+                lbound, ubound = bounds
+                income[idx] = lbound + (rng.random(len(idx)) * (ubound - lbound + 1)).astype(np.int64)
+        incomes[income_var] = income
+
+    pumas = [int(puma) for puma in samples[Var.puma]]
+    rents = rent.sample_rents(year, pumas, rng=rng)
+    rolls = rng.random((n, 2))
+
+    people = []
+    for i in range(n):
+        sample = {var.name: samples[var][i] for var in samples}
+        for income_var in income_vars:
+            sample['{}_bracket'.format(income_var.name)] = sample[income_var.name]
+            sample[income_var.name] = int(incomes[income_var][i])
+
+        # convert to enums
+        for var, enum in [
+            (Var.sex, attribs.Sex),
+            (Var.race, attribs.Race),
+            (Var.education, attribs.Education),
+            (Var.employed, attribs.Employed)
+        ]:
+            sample[var.name] = enum(sample[var.name])
+
+        puma = pumas[i]
+        neighborhoods = puma_to_neighborhoods[puma]
+        sample['puma'] = puma
+        sample['neighborhood'] = neighborhoods[int(rolls[i,0] * len(neighborhoods))]
+        sample['rent'] = rents[i]
+
+        sample['occupation_code'] = int(sample['occupation'])
+        occupation_names = occupations[str(sample['occupation_code'])]
+        sample['occupation'] = occupation_names[int(rolls[i,1] * len(occupation_names))]
+
+        sample['industry_code'] = int(sample['industry'])
+        sample['industry'] = industries[str(sample['industry_code'])]
+        people.append(sample)
+    return people
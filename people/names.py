@@ -1,10 +1,43 @@
 import json
 import random
+import numpy as np
 from cess.util import random_choice
+from world import bundle
 
-surname_given_race = json.load(open('data/names/gen/surname_given_race.json', 'r'))
 name_given_sex = json.load(open('data/names/gen/name_given_sex.json', 'r'))
 
+# the surname data is large, so it's loaded on first use
+_surname_given_race = None
+
+
+def surname_given_race():
+    global _surname_given_race
+    if _surname_given_race is None:
+        _surname_given_race = json.load(open('data/names/gen/surname_given_race.json', 'r'))
+    return _surname_given_race
+
+
+def surname_tables(surname_given_race):
+    """`{race: (surnames, cdf)}` to draw surnames from, least likely
+    first (the order `random_choice` goes through them in)"""
+    tables = {}
+    for race, dist in surname_given_race.items():
+        items = sorted(dist.items(), key=lambda x: x[1])
+        tables[race] = ([name for name, _ in items], np.cumsum([p for _, p in items]))
+    return tables
+
+
+# from the world bundle if there is one, otherwise the surname data
+_surname_tables = {}
+
+
+def surnames(race):
+    """`(surnames, cdf)` for a race (as in `race_map`)"""
+    if not _surname_tables:
+        b = bundle.load()
+        _surname_tables.update(b.surname_tables() if b is not None else surname_tables(surname_given_race()))
+    return _surname_tables[race]
+
 race_map = {
     # in the PUMS data, "white" encompasses "hispanic" as well
     'white': ['white', 'hispanic'],
@@ -24,5 +57,6 @@ def generate_name(sex, race):
     race = race_map[race.name]
     if isinstance(race, list):
         race = random.choice(race)
-    surname = random_choice(surname_given_race[race].items())
+    names, cdf = surnames(race)
+    surname = names[min(int(np.searchsorted(cdf, random.random())), len(names) - 1)]
     return '{} {}'.format(name, surname).title()
@@ -0,0 +1,227 @@
+"""
+columnar (struct-of-arrays) storage for agent state.
+
+a `Person` normally keeps its state in a plain dict (`person._state`).
+when added to a `StateStore`, the hot fields are moved into numpy arrays
+(one row per person) and `person._state` is replaced with a `StateView`,
+which reads and writes through to those arrays. everything else in the
+state dict stays in a small per-person dict.
+
+rows are kept dense (removal swaps the last row into the hole), so
+`store['cash']` etc are always aligned with `store.agents`. since rows move,
+each person also gets a stable integer uid; `store.rows` maps uids to
+current rows (-1 once removed).
+"""
+
+import numpy as np
+from collections.abc import MutableMapping
+from copy import deepcopy
+from .attribs import Sex, Race, Education
+
+# state keys backed by arrays: name -> (dtype, decoder)
+STATE_COLUMNS = {
+    'cash': (np.float64, None),
+    'health': (np.float64, None),
+    'stress': (np.float64, None),
+    'sick': (np.bool_, None),
+    'firm_owner': (np.bool_, None),
+    'age': (np.int32, None),
+    'sex': (np.int8, Sex),
+    'race': (np.int8, Race),
+    'education': (np.int8, Education),
+}
+
+# person attributes (not part of `_state`) backed by arrays
+ATTR_COLUMNS = {
+    'wage': np.float64,
+    'employer': np.int32, # firm slot, -1 for none
+    'uid': np.int64,
+}
+
+NO_EMPLOYER = -1
+
+
+class StateView(MutableMapping):
+    """dict-like view onto one row of a `StateStore`"""
+    __slots__ = ('store', 'row', 'extra')
+
+    def __init__(self, store, row, extra):
+        self.store = store
+        self.row = row
+        self.extra = extra
+
+    def __getitem__(self, key):
+        try:
+            dtype, decode = STATE_COLUMNS[key]
+        except KeyError:
+            return self.extra[key]
+        val = self.store.columns[key][self.row].item()
+        return decode(val) if decode is not None else val
+
+    def __setitem__(self, key, value):
+        if key in STATE_COLUMNS:
+            self.store.columns[key][self.row] = value
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in STATE_COLUMNS:
+            raise KeyError('can\'t delete columnar state key: {}'.format(key))
+        del self.extra[key]
+
+    def __iter__(self):
+        yield from STATE_COLUMNS
+        yield from self.extra
+
+    def __len__(self):
+        return len(STATE_COLUMNS) + len(self.extra)
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.copy(), memo)
+
+    @property
+    def uid(self):
+        return self.store.columns['uid'][self.row].item()
+
+    @property
+    def wage(self):
+        return self.store.columns['wage'][self.row].item()
+
+    @wage.setter
+    def wage(self, value):
+        self.store.columns['wage'][self.row] = value
+
+    @property
+    def employer(self):
+        return self.store.firm_at(self.store.columns['employer'][self.row])
+
+    @employer.setter
+    def employer(self, firm):
+        self.store.columns['employer'][self.row] = self.store.firm_slot(firm)
+
+
+class StateStore():
+    """struct-of-arrays store for agent state"""
+
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self.agents = []
+        self.columns = {}
+        for name, (dtype, _) in STATE_COLUMNS.items():
+            self.columns[name] = np.zeros(capacity, dtype=dtype)
+        for name, dtype in ATTR_COLUMNS.items():
+            self.columns[name] = np.zeros(capacity, dtype=dtype)
+        self.columns['employer'].fill(NO_EMPLOYER)
+
+        # uid -> row
+        self.rows = np.full(capacity, -1, dtype=np.int64)
+        self.n_uids = 0
+
+        # firms are referred to by slot in the employer column
+        self.firms = []
+        self._firm_slots = {}
+        self._free_slots = []
+
+    def __getitem__(self, name):
+        """the live (length `n`) array for a column;
+        writes to it go through to the agents"""
+        return self.columns[name][:self.n]
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, person):
+        state = person._state
+        return isinstance(state, StateView) and state.store is self
+
+    @property
+    def capacity(self):
+        return len(self.columns['cash'])
+
+    def _grow(self, capacity):
+        for name, arr in self.columns.items():
+            new = np.zeros(capacity, dtype=arr.dtype)
+            if name == 'employer':
+                new.fill(NO_EMPLOYER)
+            new[:self.n] = arr[:self.n]
+            self.columns[name] = new
+
+    def add(self, person):
+        """move a person's state into the store"""
+        if self.n == self.capacity:
+            self._grow(max(1, 2 * self.capacity))
+        row = self.n
+        self.n += 1
+
+        uid = self.n_uids
+        self.n_uids += 1
+        if uid == len(self.rows):
+            rows = np.full(max(1, 2 * len(self.rows)), -1, dtype=np.int64)
+            rows[:uid] = self.rows
+            self.rows = rows
+        self.rows[uid] = row
+        self.columns['uid'][row] = uid
+
+        state = person._state
+        extra = {k: v for k, v in state.items() if k not in STATE_COLUMNS}
+        for k in STATE_COLUMNS:
+            self.columns[k][row] = state[k]
+        self.columns['wage'][row] = person._wage
+        self.columns['employer'][row] = self.firm_slot(person._employer)
+
+        self.agents.append(person)
+        person._state = StateView(self, row, extra)
+        return row
+
+    def remove(self, person):
+        """take a person out of the store, restoring their plain dict state.
+        the last row is moved into the freed row"""
+        view = person._state
+        row, last = view.row, self.n - 1
+        person._wage = view.wage
+        person._employer = view.employer
+        person._state = view.copy()
+        self.rows[view.uid] = -1
+
+        if row != last:
+            for arr in self.columns.values():
+                arr[row] = arr[last]
+            moved = self.agents[last]
+            moved._state.row = row
+            self.agents[row] = moved
+            self.rows[moved._state.uid] = row
+        self.agents.pop()
+        self.columns['employer'][last] = NO_EMPLOYER
+        self.n -= 1
+
+    def firm_slot(self, firm):
+        if firm is None:
+            return NO_EMPLOYER
+        try:
+            return self._firm_slots[firm]
+        except KeyError:
+            pass
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.firms[slot] = firm
+        else:
+            slot = len(self.firms)
+            self.firms.append(firm)
+        self._firm_slots[firm] = slot
+        return slot
+
+    def firm_at(self, slot):
+        return None if slot == NO_EMPLOYER else self.firms[slot]
+
+    def release_firm(self, firm):
+        """free a closed firm's slot. it should no longer employ anyone"""
+        slot = self._firm_slots.pop(firm, None)
+        if slot is not None:
+            self.firms[slot] = None
+            self._free_slots.append(slot)
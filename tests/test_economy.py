@@ -0,0 +1,220 @@
+import random
+import unittest
+import numpy as np
+from collections import Counter
+from economy.sampler import SumTree, RankTree, weighted_sample
+from economy import assets
+from economy.learning import BatchQLearner
+from economy import fiscal
+from economy.firms import set_employment_dist, offer_weights
+from economy.labor import SeekerIndex
+from economy.healthcare import healthcare_market
+from people import Person, StateStore
+from world import synthetic
+
+random.seed(0)
+np.random.seed(0)
+
+
+class EconomyTests(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_sum_tree(self):
+        tree = SumTree([('a', 1.), ('b', 0.), ('c', 3.), ('d', 6.)])
+        self.assertEqual(tree.total, 10.)
+
+        counts = Counter(tree.sample() for _ in range(10000))
+        self.assertNotIn('b', counts)
+        self.assertAlmostEqual(counts['d']/10000, 0.6, places=1)
+
+        tree.remove('d')
+        self.assertEqual(tree.total, 4.)
+        self.assertNotIn('d', set(tree.sample() for _ in range(1000)))
+
+        tree.remove('a')
+        tree.remove('c')
+        self.assertFalse(tree)
+
+    def test_weighted_sample(self):
+        idx = weighted_sample([1., 0., 5., 2.], 3, rng=np.random.default_rng(0))
+        self.assertEqual(len(idx), 3)
+        self.assertNotIn(1, idx)
+
+    def test_rank_tree(self):
+        tree = RankTree(10)
+        self.assertEqual(tree.count(10), 10)
+        for pos in [0, 3, 4, 9]:
+            tree.add(pos, -1)
+        self.assertEqual(tree.count(5), 2)
+        self.assertEqual([tree.find(i) for i in range(6)], [1, 2, 5, 6, 7, 8])
+        tree.add(3, 1)
+        self.assertEqual(tree.find(2), 3)
+
+    def test_applicants(self):
+        set_employment_dist(synthetic.employment_dist())
+
+        class MockSeeker():
+            def __init__(self, wage_minimum, sex, race):
+                self.wage_minimum, self.sex, self.race = wage_minimum, sex, race
+
+        class MockFirm():
+            referrals = {}
+
+        world = {'year': 2010, 'month': 1}
+        seekers = [MockSeeker(m, 1 + i % 2, 1 + i % 3) for i, m in enumerate([5, 1, 8, 3, 2, 9, 4, 7])]
+        index = SeekerIndex(seekers)
+        index.remove(seekers[6])
+
+        # the seekers still looking with a minimum of at most 5
+        applicants = index.applicants(5)
+        eligible = [seekers[i] for i in [0, 1, 3, 4]]
+        self.assertEqual(len(applicants), 4)
+        rng = np.random.default_rng(0)
+        self.assertEqual(set(applicants.sample(MockFirm(), 10, world, rng)), set(eligible))
+
+        # first draws are in proportion to offer weights, referrals included
+        firm = MockFirm()
+        firm.referrals = {seekers[1]: 1, seekers[5]: 1}
+        weights = offer_weights(eligible, [firm] * len(eligible), world)
+        counts = Counter(applicants.sample(firm, 1, world, rng)[0] for _ in range(10000))
+        for person, weight in zip(eligible, weights):
+            self.assertAlmostEqual(counts[person]/10000, weight/weights.sum(), places=1)
+
+        # drawing doesn't take anyone out of the index
+        self.assertEqual(len(applicants), 4)
+        self.assertEqual(len(index.applicants(10)), 7)
+
+    def test_solve_assets(self):
+        labor_per_worker, labor_per_equipment = 20, 1
+        required = [0, 2, 21, 40, 41, 200, 420]
+        wages = [10, 10, 10, 10, 10, 10, 10]
+
+        # equipment is cheap, so each worker should get equipment
+        n_workers, n_equipment = assets.solve(required, wages, [0.1] * len(required), labor_per_worker, labor_per_equipment)
+        for r, n_w, n_e in zip(required, n_workers, n_equipment):
+            self.assertGreaterEqual(n_w * labor_per_worker + min(n_w, n_e) * labor_per_equipment, r)
+            self.assertLessEqual(n_e, n_w)
+        np.testing.assert_array_equal(n_workers, [0, 1, 1, 2, 2, 10, 20])
+        np.testing.assert_array_equal(n_equipment, [0, 0, 1, 0, 1, 0, 20])
+
+        # equipment is expensive, so only hire workers
+        n_workers, n_equipment = assets.solve(required, wages, [100.] * len(required), labor_per_worker, labor_per_equipment)
+        np.testing.assert_array_equal(n_workers, [0, 1, 2, 2, 3, 10, 21])
+        np.testing.assert_array_equal(n_equipment, [0] * len(required))
+
+    def test_batch_q_learner(self):
+        learners = BatchQLearner(3, 2, discount=0.5, explore=0., learning_rate=1., capacity=1,
+                                 rng=np.random.default_rng(0))
+        a, b = learners.alloc(), learners.alloc()
+        self.assertEqual(len(learners), 2)
+
+        # nothing learned yet, so ties go to the first action
+        actions = learners.choose_actions([a.row, b.row], [0, 1], [0, 1])
+        self.assertEqual(actions.tolist(), [0, 0])
+
+        # a is rewarded for action 0 in state 0, so keeps it
+        learners.choose_actions([a.row, b.row], [2, 0], [2, 0])
+        self.assertEqual(a.Q[0, 0], 2.)
+        self.assertEqual(b.Q[1, 0], 0.)
+
+        # freed rows are reused, and start fresh
+        a.free()
+        c = learners.alloc()
+        self.assertEqual(c.row, a.row)
+        self.assertFalse(c.Q.any())
+
+    def test_healthcare_market(self):
+        class MockHospital():
+            def __init__(self, price, supply):
+                self.price, self.supply = price, supply
+            def sell(self, n):
+                self.supply -= n
+
+        class MockPerson():
+            frugality = 0
+            _wage, _employer = 0, None
+            def __init__(self, health, cash):
+                self._state = {'cash': cash, 'health': health, 'stress': 0, 'sick': False,
+                               'firm_owner': False, 'age': 30, 'sex': 1, 'race': 1, 'education': 1}
+
+        store = StateStore()
+        for health in [0.1, 0.5, 1., 0.2, 0.3]:
+            store.add(MockPerson(health, 100))
+        cheap, pricey = MockHospital(10, 2), MockHospital(1000, 10)
+        sold = healthcare_market(store, [cheap, pricey], recovery_prob=1., rng=np.random.default_rng(0))
+
+        # no one can afford the pricey hospital, and the cheap one only has 2 treatments
+        self.assertEqual(sold, [10., 10.])
+        self.assertEqual((cheap.supply, pricey.supply), (0, 10))
+        self.assertEqual(int((store['health'] == 1.).sum()), 3)
+        self.assertEqual(store['cash'].sum(), 480)
+        self.assertFalse(store['sick'].any())
+
+    def test_fiscal(self):
+        class MockGovernment():
+            tax_rate, welfare, cash = 0.3, 10, 0.
+
+        class MockFirm():
+            def __init__(self, owner, profit):
+                self.owner, self.profit = owner, profit
+                owner.firm = self
+                owner._state['firm_owner'] = True
+            @property
+            def cash(self):
+                return self.owner._state['cash']
+            @cash.setter
+            def cash(self, value):
+                self.owner._state['cash'] = value
+
+        def city():
+            people = [Person(name='Person {}'.format(i), sex=1, race=1, education=1, employed=1, age=30,
+                             wage_income=0, business_income=0, investment_income=0, welfare_income=0,
+                             retirement_income=0, puma=3701, neighborhood=None, rent=0,
+                             occupation=None, occupation_code=0, industry=None, industry_code=0)
+                      for i in range(8)]
+            for person, cash in zip(people, [0, 50, 1000, 5, 0, 0, 20, 7]):
+                person._state['cash'] = cash
+
+            # the first firm's owner can't cover all of their wages once taxed.
+            # the first person is paid before their employer's owner is taxed
+            firms = [MockFirm(people[1], 100.), MockFirm(people[2], -20.)]
+            for person, firm, wage in [(people[0], firms[0], 30), (people[3], firms[0], 30),
+                                       (people[4], firms[0], 30), (people[5], firms[1], 40),
+                                       (people[6], firms[1], 40)]:
+                person.employer = firm
+                person.wage = wage
+            return people, MockGovernment()
+
+        # the original per-person loop
+        people, loop_gov = city()
+        for person in people:
+            taxes = 0
+            if person._state['firm_owner']:
+                profit = max(person.firm.profit, 0)
+                taxes = profit * loop_gov.tax_rate
+                person.firm.cash -= taxes
+            elif person.employer is not None:
+                wage = min(person.wage, person.employer.cash)
+                taxes = wage * loop_gov.tax_rate
+                person._state['cash'] += (wage - taxes)
+            loop_gov.cash += taxes
+        loop_taxes = loop_gov.cash
+        for person in people:
+            person._state['cash'] += loop_gov.welfare
+            loop_gov.cash -= loop_gov.welfare
+        loop_cash = [p._state['cash'] for p in people]
+
+        people, government = city()
+        store = StateStore()
+        for person in people:
+            store.add(person)
+        taxes = fiscal.collect_taxes(store, government)
+        self.assertAlmostEqual(taxes, loop_taxes)
+        self.assertAlmostEqual(government.cash, loop_taxes)
+        fiscal.pay_welfare(store, government)
+        self.assertAlmostEqual(government.cash, loop_gov.cash)
+        np.testing.assert_allclose(store['cash'], loop_cash)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from enum import Enum
+from models.bnet import BNet, count, count_csv
+
+
+class Var(Enum):
+    a = 'A'
+    b = 'B'
+    c = 'C'
+
+
+class BNetTests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 5000
+        a = rng.choice([1, 2, 3], size=n, p=[0.5, 0.3, 0.2])
+        b = np.where(rng.random(n) < 0.2 + 0.3 * (a - 1), 1, 0)
+        c = rng.normal(10 * a + 5 * b, 3)
+        df = pd.DataFrame({'A': a, 'B': b, 'C': c})
+        nodes = list(Var)
+        edges = [(Var.a, Var.b), (Var.a, Var.c), (Var.b, Var.c)]
+        bins = {Var.c: [-100, 10, 20, 30, 100]}
+        self.df = df
+        self.pgm = BNet(nodes, edges, df, bins)
+
+    def assertMatches(self, samples, dist, delta=0.015):
+        for group, p in dist.items():
+            self.assertAlmostEqual(np.mean(samples == group), p, delta=delta)
+
+    def test_sample_batch(self):
+        samples = self.pgm.sample_batch(50000, rng=np.random.default_rng(1))
+        self.assertEqual(set(samples), set(Var))
+        self.assertMatches(samples[Var.a], self.pgm.p_n(Var.a))
+
+        # the same seed, the same samples
+        again = self.pgm.sample_batch(50000, rng=np.random.default_rng(1))
+        for var in Var:
+            np.testing.assert_array_equal(samples[var], again[var])
+
+    def test_sample_batch_evidence(self):
+        samples = self.pgm.sample_batch(50000, {Var.a: 3}, rng=np.random.default_rng(1))
+        self.assertTrue((samples[Var.a] == 3).all())
+        self.assertMatches(samples[Var.b], self.pgm.probs_given(Var.b, {Var.a: 3}))
+
+        given = {Var.a: 2, Var.b: 1}
+        samples = self.pgm.sample_batch(50000, given, rng=np.random.default_rng(1))
+        self.assertMatches(samples[Var.c], self.pgm.probs_given(Var.c, given))
+
+        # one value per record
+        samples = self.pgm.sample_batch(4, {Var.a: [1, 2, 3, 1]}, rng=np.random.default_rng(1))
+        self.assertEqual(list(samples[Var.a]), [1, 2, 3, 1])
+
+        # values not in the data tell nothing
+        samples = self.pgm.sample_batch(50000, {Var.a: 7}, rng=np.random.default_rng(1))
+        self.assertMatches(samples[Var.b], self.pgm.p_n(Var.b))
+
+    def test_posterior_cache(self):
+        probs = self.pgm.probs_given(Var.b, {Var.a: 2})
+        self.assertIs(self.pgm.probs_given(Var.b, {Var.a: 2}), probs)
+        self.assertEqual(self.pgm.cache_stats, {'hits': 1, 'misses': 1, 'evictions': 0})
+
+        # least recently used are evicted
+        self.pgm.cache_size = 2
+        self.pgm.probs_given(Var.b, {Var.a: 1})
+        self.pgm.probs_given(Var.b, {Var.a: 2})
+        self.pgm.probs_given(Var.b, {Var.a: 3})
+        self.assertEqual(self.pgm.cache_stats['evictions'], 1)
+        self.assertIs(self.pgm.probs_given(Var.b, {Var.a: 2}), probs)
+        self.pgm.probs_given(Var.b, {Var.a: 1})
+        self.assertEqual(self.pgm.cache_stats, {'hits': 3, 'misses': 4, 'evictions': 2})
+
+        # refitting drops them
+        df = self.df.copy()
+        df['B'] = 1 - df['B']
+        self.pgm.fit(df)
+        refit = self.pgm.probs_given(Var.b, {Var.a: 2})
+        self.assertAlmostEqual(refit[0], probs[1])
+
+    def test_counts(self):
+        pgm = self.pgm
+        nodes, edges = list(pgm.g.nodes()), list(pgm.g.edges())
+
+        # counts of parts add up to the counts of the whole
+        chunks = [self.df[i:i+1000] for i in range(0, len(self.df), 1000)]
+        total = sum((count(chunk, nodes, edges, pgm.bins) for chunk in chunks[1:]),
+                    count(chunks[0], nodes, edges, pgm.bins))
+        self.assertEqual(total.n_rows, len(self.df))
+        for n in nodes:
+            self.assertTrue(total.sizes[n].equals(pgm.counts.sizes[n]))
+        for edge in pgm.counts.joint:
+            self.assertTrue(total.joint[edge].equals(pgm.counts.joint[edge]))
+
+        # p(parent|n) is for each of n's groups
+        dist = pgm.p_p_n(Var.b, Var.a)
+        for b in (0, 1):
+            df_b = self.df[self.df.B == b]
+            for a in (1, 2, 3):
+                self.assertAlmostEqual(dist[b][a], np.mean(df_b.A == a))
+
+        # updating with more data is the same as fitting to all of it
+        updated = BNet(nodes, edges, self.df[:2000], pgm.bins)
+        updated.update(self.df[2000:])
+        self.assertEqual(updated.p_p_n(Var.c, Var.b), pgm.p_p_n(Var.c, Var.b))
+        self.assertEqual(updated.p_n(Var.c), pgm.p_n(Var.c))
+
+    def test_count_csv(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'data.csv')
+            self.df.to_csv(path, index=False)
+            pgm = self.pgm
+            nodes, edges = list(pgm.g.nodes()), list(pgm.g.edges())
+            for max_workers in (1, 2):
+                fit = BNet.from_csv(path, nodes, edges, pgm.bins, chunksize=700, max_workers=max_workers)
+                self.assertEqual(fit.counts.n_rows, len(self.df))
+                self.assertEqual(fit.p_n(Var.a), pgm.p_n(Var.a))
+                self.assertEqual(fit.p_p_n(Var.c, Var.a), pgm.p_p_n(Var.c, Var.a))
+        finally:
+            shutil.rmtree(dir)
@@ -0,0 +1,303 @@
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from datetime import datetime
+from people import Person, StateStore
+from world import synthetic, telemetry, tracing
+from world.frames import FrameEncoder
+from world.contagion import Contagion
+from economy.firms import set_employment_dist
+from city import City
+from ensemble import run_ensemble
+
+np.random.seed(0)
+
+with open('data/world/nyc.json', 'r') as f:
+    PUMA, NEIGHBORHOODS = next(iter(json.load(f)['puma_to_neighborhoods'].items()))
+
+
+def population(n, seed=0, n_friends=4):
+    """`n` people with a few friends each"""
+    rng = np.random.RandomState(seed)
+    people = []
+    for i in range(n):
+        employed = rng.randint(4)
+        person = Person(
+            name='Person {}'.format(i), sex=rng.randint(1, 3), race=rng.randint(1, 10),
+            education=rng.randint(12), employed=employed, age=rng.randint(18, 91),
+            wage_income=rng.randint(10000, 80000) if employed == 1 else 0,
+            business_income=rng.randint(5000, 30000) if rng.rand() < 0.05 else 0,
+            investment_income=0, welfare_income=0, retirement_income=0,
+            puma=int(PUMA), neighborhood=NEIGHBORHOODS[0], rent=float(rng.randint(500, 2000)),
+            occupation=None, occupation_code=0, industry=None, industry_code=0)
+        person.id = 'person-{}'.format(i)
+        people.append(person)
+    for i, j in rng.randint(n, size=(n * n_friends//2, 2)):
+        if i != j and people[j] not in people[i].friends:
+            people[i].friends.append(people[j])
+            people[j].friends.append(people[i])
+    return people
+
+
+class SimulationTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        set_employment_dist(synthetic.employment_dist())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_telemetry(self):
+        store = StateStore()
+        for p in population(20):
+            store.add(p)
+        t = telemetry.Telemetry(self.dir, fields=('cash', 'sick'), every=2, chunk_size=2)
+        for day in range(1, 8):
+            t.observe(datetime(2005, 1, day), store)
+            t.stat(datetime(2005, 1, day), 'n_sick', day)
+        t.close()
+
+        agents, stats = telemetry.read(self.dir)
+        self.assertEqual(len(agents['uid']), 3 * 20)
+        np.testing.assert_array_equal(np.unique(agents['day']),
+                                      [datetime(2005, 1, d).toordinal() for d in (2, 4, 6)])
+        np.testing.assert_array_equal(agents['cash'][:20], store['cash'])
+        np.testing.assert_array_equal(stats['n_sick'][1], np.arange(1, 8))
+
+    def test_frames(self):
+        people = population(20)
+        store = StateStore()
+        for p in people:
+            store.add(p)
+        frames = FrameEncoder(store, keyframe_every=10)
+
+        frame = frames.next_frame()
+        self.assertTrue(frame['keyframe'])
+        self.assertEqual(len(frame['people']), 20)
+
+        # only what changed is sent
+        people[3]._state['cash'] += 10
+        store.remove(people[5])
+        frame = frames.next_frame()
+        self.assertFalse(frame['keyframe'])
+        self.assertEqual(frame['seq'], 1)
+        self.assertEqual([c['id'] for c in frame['changed']], [people[3].id])
+        self.assertEqual(frame['changed'][0]['cash'], people[3]._state['cash'])
+        self.assertEqual(frame['removed'], [people[5].id])
+
+        # friend changes are sent once they're marked
+        people[4].friends = people[4].friends[1:]
+        frames.friends_changed(people[4])
+        frame = frames.next_frame()
+        self.assertEqual([c['id'] for c in frame['changed']], [people[4].id])
+        self.assertEqual(frame['changed'][0]['friends'], [f.id for f in people[4].friends])
+
+        # a keyframe to resync doesn't move the sequence along
+        self.assertEqual(frames.keyframe()['seq'], 2)
+        self.assertEqual(frames.next_frame()['changed'], [])
+
+    def test_checkpoint(self):
+        def summary(city):
+            return (city.date, len(city.people), len(city.firms), city.government.cash,
+                    city.store['cash'].sum(), city.state['mean_wage'])
+
+        city = City(population(200), {'seed': 0})
+        for _ in range(3):
+            city.step()
+        city.save_checkpoint('{}/base.ckpt'.format(self.dir))
+        for _ in range(2):
+            city.step()
+        city.save_checkpoint('{}/inc.ckpt'.format(self.dir))
+        for _ in range(3):
+            city.step()
+        expected = summary(city)
+
+        # incremental checkpoints load on top of their parents
+        resumed = City.load_checkpoint('{}/inc.ckpt'.format(self.dir))
+        for _ in range(3):
+            resumed.step()
+        self.assertEqual(summary(resumed), expected)
+
+        # the firms still learn together, in the city's pool
+        for firm in resumed.firms:
+            self.assertIs(firm.learners, resumed.firm_learners)
+
+    def test_firm_learners(self):
+        # each city's firms learn together, apart from other cities' firms
+        a, b = City(population(100), {'seed': 0}), City(population(100), {'seed': 1})
+        for city in [a, b]:
+            city.step()
+        self.assertIsNot(a.firm_learners, b.firm_learners)
+        for city in [a, b]:
+            self.assertTrue(city.firms)
+            self.assertEqual(len(city.firm_learners), len(city.firms))
+            for firm in city.firms:
+                self.assertIs(firm.learners, city.firm_learners)
+
+    def test_cities_independent(self):
+        def summary(city):
+            return (len(city.firms), city.government.cash, city.store['cash'].sum(),
+                    city.state['mean_wage'], sorted(len(f.workers) for f in city.firms))
+
+        alone = City(population(100), {'seed': 0})
+        for _ in range(3):
+            alone.step()
+
+        # a city's run doesn't depend on another city stepping alongside it
+        a, b = City(population(100), {'seed': 0}), City(population(100), {'seed': 1})
+        for _ in range(3):
+            a.step()
+            b.step()
+        self.assertEqual(summary(a), summary(alone))
+
+    def test_synthetic_population(self):
+        people = synthetic.population(500, seed=0)
+        self.assertEqual(len(set(p.id for p in people)), 500)
+        for p in people:
+            self.assertNotIn(p, p.friends)
+            for friend in p.friends:
+                self.assertIn(p, friend.friends)
+
+        # the same seed, the same people
+        again = synthetic.population(500, seed=0)
+        self.assertEqual([p._state['cash'] for p in people], [p._state['cash'] for p in again])
+        self.assertEqual([len(p.friends) for p in people], [len(p.friends) for p in again])
+
+    def test_profile(self):
+        city = City(synthetic.population(100, seed=0), dict(synthetic.config(100), seed=0, profile=True))
+        for _ in range(3):
+            city.step()
+        summary = city.profile_summary()
+        self.assertEqual(summary['steps'], 3)
+        self.assertEqual(summary['phases']['step']['calls'], 3)
+        self.assertEqual(summary['phases']['labor_market']['calls'], 3)
+        self.assertLessEqual(summary['phases']['labor_market']['total'], summary['phases']['step']['total'])
+        self.assertIn('labor_market.seekers', summary['counts'])
+        self.assertIn('consumer_good_market.rounds', summary['counts'])
+
+        city = City(synthetic.population(100, seed=0), dict(synthetic.config(100), seed=0))
+        city.step()
+        self.assertIsNone(city.profile_summary())
+
+    def test_trace(self):
+        path = '{}/trace.json.gz'.format(self.dir)
+        city = City(synthetic.population(100, seed=0),
+                    dict(synthetic.config(100), seed=0, trace_path=path, trace_sample=0.5))
+        for _ in range(4):
+            city.step()
+        city.close()
+
+        events = tracing.load(path)
+        names = {e['name'] for e in events}
+        self.assertTrue({'step', 'labor_market', 'round', 'plan_all_production'} <= names)
+        steps = [e for e in events if e['name'] == 'step']
+        self.assertEqual(len(steps), 2)
+
+        # phases are nested in their steps
+        for e in events:
+            if e['name'] == 'labor_market':
+                self.assertTrue(any(s['ts'] <= e['ts'] and e['ts'] + e['dur'] <= s['ts'] + s['dur'] for s in steps))
+
+        # a trace that wasn't closed loads what was flushed
+        path = '{}/unclosed.json.gz'.format(self.dir)
+        tracer = tracing.Tracer(path)
+        for i in range(3):
+            tracer.complete('span', 0, i)
+        tracer.flush()
+        tracer.complete('span', 0, 3)
+        self.assertEqual([e['dur'] for e in tracing.load(path)], [0, 1e6, 2e6])
+        tracer.close()
+        self.assertEqual(len(tracing.load(path)), 4)
+
+    def test_sparse_contagion(self):
+        people = population(50)
+        store = StateStore()
+        for p in people:
+            store.add(p)
+        for i in (0, 7, 19):
+            people[i]._state['sick'] = True
+        people[7]._state['health'] = 0.05
+        contagion = Contagion(store, rng=np.random.default_rng(0))
+
+        # people who leave the store can't be infected
+        gone = people[0].friends[0]
+        store.remove(gone)
+
+        # the dense path: roll each sick person's friends, in uid order, from the same seed
+        uids = {p: i for i, p in enumerate(people)}
+        adj = np.zeros((50, 50), dtype=bool)
+        for p in people:
+            for friend in p.friends:
+                adj[uids[p], uids[friend]] = True
+        sick = np.array([p in store and p._state['sick'] for p in people])
+        targets = np.concatenate([np.flatnonzero(adj[i]) for i in np.flatnonzero(sick)])
+        hit = targets[np.random.default_rng(0).random(targets.size) < 0.3]
+        expected = {people[i] for i in hit if not sick[i] and people[i] in store}
+
+        died, infected = contagion.step(0.3, 0.1)
+        self.assertEqual(set(infected), expected)
+        self.assertEqual(contagion.n_edges, targets.size)
+        self.assertEqual(died, [people[7]])
+        self.assertTrue(all(p._state['sick'] for p in expected))
+        self.assertAlmostEqual(people[0]._state['health'], 0.9)
+
+        # everyone who's sick infects all their friends
+        sick = [p for p in people if p in store and p._state['sick']]
+        _, infected = contagion.step(1., 0.)
+        expected = {f for p in sick for f in p.friends if f in store and f not in sick}
+        self.assertEqual(set(infected), expected)
+
+        # newcomers and new friendships spread it too
+        source = next(p for p in people if p in store and p._state['sick'] and p._state['health'] > 0)
+        newcomer = population(1, seed=1)[0]
+        newcomer.id = 'newcomer'
+        store.add(newcomer)
+        newcomer.friends, source.friends = [source], source.friends + [newcomer]
+        healthy = next(p for p in people if p in store and not p._state['sick'])
+        healthy.friends, source.friends = healthy.friends + [source], source.friends + [healthy]
+        contagion.friendships_changed()
+        _, infected = contagion.step(1., 0.)
+        self.assertIn(newcomer, infected)
+        self.assertIn(healthy, infected)
+
+    def test_friendships(self):
+        city = City(population(100), {'seed': 0, 'contagion_mode': 'sparse'})
+        city.step()
+        city.frames.next_frame()
+        firm = next(f for f in city.firms if f.workers)
+        worker = next(iter(firm.workers))
+        other = next(p for p in city.people
+                     if p is not worker and p not in worker.friends and not p._state['firm_owner'])
+        referrals = firm.referrals.get(other, 0)
+
+        # new friends can be referred, and are sent with the next frame
+        city.befriend(worker, other)
+        self.assertIn(other, worker.friends)
+        self.assertIn(worker, other.friends)
+        self.assertEqual(firm.referrals[other], referrals + 1)
+        self.assertTrue(city.contagion.dirty)
+        changed = {c['id']: c for c in city.frames.next_frame()['changed']}
+        self.assertEqual(changed[worker.id]['friends'], [f.id for f in worker.friends])
+        self.assertEqual(changed[other.id]['friends'], [f.id for f in other.friends])
+
+        # dying ends their friendships
+        city.dies(other)
+        self.assertNotIn(other, worker.friends)
+        self.assertFalse(any(other in f.referrals for f in city.firms))
+        changed = {c['id']: c for c in city.frames.next_frame()['changed']}
+        self.assertEqual(changed[worker.id]['friends'], [f.id for f in worker.friends])
+
+    def test_ensemble(self):
+        # the summaries don't depend on which worker finishes first
+        people = population(50)
+        configs = [{}, {'tax_rate': 0.5}]
+        one = run_ensemble(configs, range(3), 3, population=people, max_workers=1, reservoir_size=2)
+        many = run_ensemble(configs, range(3), 3, population=people, max_workers=3, reservoir_size=2)
+        self.assertTrue(np.nanmax(one[0]['mean_cash']['var']) > 0)
+        for a, b in zip(one, many):
+            self.assertEqual(sorted(a), sorted(b))
+            for name in a:
+                for key in a[name]:
+                    np.testing.assert_array_equal(a[name][key], b[name][key])
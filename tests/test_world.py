@@ -1,6 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
-from world import social
+from world import social, bundle
+from world.registry import Registry
+from world.rng import RNG
 
 np.random.seed(0)
 
@@ -33,3 +38,87 @@ class WorldTests(unittest.TestCase):
                                      [0., 0., 0., 0.]])
         adj_mat = social.friendship_matrix(people, base_prob=0.5)
         np.testing.assert_array_equal(adj_mat, expected_adj_mat)
+
+    def test_registry(self):
+        people = [Person(0, 1, 25, 10) for _ in range(4)]
+        reg = Registry(people)
+        ids = [reg.id_of(p) for p in people]
+        self.assertEqual(ids, [0, 1, 2, 3])
+
+        reg.remove(people[1])
+        self.assertEqual(len(reg), 3)
+        self.assertNotIn(people[1], reg)
+        self.assertIsNone(reg.get(1))
+        self.assertCountEqual(list(reg), [people[0], people[2], people[3]])
+
+        # ids are stable across removals
+        self.assertEqual(reg.id_of(people[3]), 3)
+        self.assertIs(reg.get(3), people[3])
+        self.assertEqual(reg.add(Person(1, 2, 30, 8)), 4)
+
+        with self.assertRaises(ValueError):
+            reg.remove(people[1])
+
+    def test_registry_remove_while_iterating(self):
+        people = [Person(0, 1, 25, 10) for _ in range(5)]
+        reg = Registry(people)
+        seen = []
+        for p in reg:
+            seen.append(p)
+            reg.remove(p)
+        self.assertEqual(seen, people)
+        self.assertEqual(len(reg), 0)
+
+    def test_rng(self):
+        a, b = RNG(1), RNG(1)
+        np.testing.assert_array_equal(a.contagion.random(5), b.contagion.random(5))
+        self.assertEqual(a.shuffle('city', range(10)), b.shuffle('city', range(10)))
+
+        # drawing from one stream doesn't change what another draws
+        a.markets.random(100)
+        np.testing.assert_array_equal(a.labor.random(5), b.labor.random(5))
+
+        # pools draw the same numbers, in order
+        c, d = RNG(2), RNG(2)
+        self.assertEqual([c.pool('labor').random() for _ in range(5)], d.labor.random(5).tolist())
+
+    def test_bundle(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'world.bundle')
+            names = ['Smith', 'Nguyễn', '']
+            data, offsets = bundle.strings(names)
+            arrays = {'a': np.arange(10, dtype=np.int64), 'b': np.linspace(0, 1, 12).reshape(3, 4),
+                      'empty': np.zeros(0), 'names.data': data, 'names.offsets': offsets}
+            digest = bundle.write(path, arrays, {'keys': [1, 2]})
+
+            b = bundle.load(path)
+            self.assertEqual(b.hash, digest)
+            self.assertEqual(b.meta, {'keys': [1, 2]})
+            for name, arr in arrays.items():
+                np.testing.assert_array_equal(b[name], arr)
+                self.assertEqual(b[name].dtype, arr.dtype)
+            self.assertIsInstance(b['b'], np.memmap)
+            self.assertEqual(list(b.strings('names')), names)
+            self.assertTrue(b.verify())
+
+            # loaded once per process
+            self.assertIs(bundle.load(path), b)
+
+            # corrupted
+            with open(path, 'r+b') as f:
+                f.seek(-1, os.SEEK_END)
+                f.write(b'x')
+            self.assertFalse(bundle.Bundle(path).verify())
+
+            # other versions are ignored
+            path = os.path.join(dir, 'old.bundle')
+            bundle.VERSION += 1
+            try:
+                bundle.write(path, arrays, {})
+            finally:
+                bundle.VERSION -= 1
+            self.assertIsNone(bundle.load(path))
+            self.assertIsNone(bundle.load(os.path.join(dir, 'missing.bundle')))
+        finally:
+            shutil.rmtree(dir)
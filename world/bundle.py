@@ -0,0 +1,281 @@
+"""
+a prebuilt bundle of the tables derived from the source data, so processes
+don't derive them again at startup:
+
+- the bayes' net's counts and the income brackets (see `people/generate.py`)
+- the rent and mortgage distributions (see `world/rent.py`)
+- the surname tables (see `people/names.py`)
+- the job offer and unemployment tables (see `economy/firms.py`)
+
+build it from the repo root, once the source data is in place:
+
+    python -m world.bundle                 # writes `BUNDLE_PATH`
+    python -m world.bundle --verify        # checks an existing bundle's hash
+
+it's one file: a json index (the format version, a sha256 of the contents and
+any small tables) followed by numpy arrays, which are memory-mapped when
+it's loaded, so processes start quickly and share its pages. where there's no
+bundle, or one of another version (which is ignored, with a warning), each
+table is derived from the source data on first use, as before.
+set `WORLD_BUNDLE` to use a bundle elsewhere.
+"""
+
+import os
+import json
+import struct
+import hashlib
+import logging
+import argparse
+import numpy as np
+
+VERSION = 1
+BUNDLE_PATH = os.environ.get('WORLD_BUNDLE', 'data/world/gen/world.bundle')
+MAGIC = b'HOSNYWB\x00'
+
+# arrays start on multiples of this many bytes
+ALIGN = 64
+
+# what's bundled for each year and PUMA's rents
+RENT_DISTS = ['rent_dist', 'mortgage1_dist', 'mortgage2_dist']
+OWNERSHIPS = ['free', 'mortgage1', 'mortgage2']
+
+logger = logging.getLogger(__name__)
+
+_bundles = {}
+
+
+def _align(n):
+    return -(-n//ALIGN) * ALIGN
+
+
+def _hash(meta, index, arrays):
+    h = hashlib.sha256()
+    h.update(json.dumps({'version': VERSION, 'meta': meta, 'arrays': index}, sort_keys=True).encode())
+    for arr in arrays:
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+def strings(seq):
+    """a sequence of strings as `(utf-8 bytes, offsets)` arrays, to bundle"""
+    encoded = [s.encode('utf8') for s in seq]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class Strings():
+    """a bundled sequence of strings, decoded as they're accessed"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i+1]]).decode('utf8')
+
+
+def write(path, arrays, meta):
+    """write a bundle of `arrays` (`{name: array}`) and `meta` (anything json-serializable)"""
+    names = sorted(arrays)
+    arrays = {name: np.ascontiguousarray(arrays[name]) for name in names}
+    index, offset = {}, 0
+    for name in names:
+        arr = arrays[name]
+        index[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset = _align(offset + arr.nbytes)
+    digest = _hash(meta, index, (arrays[name] for name in names))
+    header = json.dumps({'version': VERSION, 'hash': digest, 'meta': meta, 'arrays': index}).encode()
+
+    # write elsewhere then move, so processes loading it never see half a bundle
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        start = _align(f.tell())
+        for name in names:
+            f.write(b'\0' * (start + index[name]['offset'] - f.tell()))
+            f.write(arrays[name].tobytes())
+    os.replace(tmp, path)
+    return digest
+
+
+class Bundle():
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a world bundle'.format(path))
+            length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(length).decode())
+            start = _align(f.tell())
+        self.version = header['version']
+        self.hash = header['hash']
+        self.meta = header['meta']
+        self._index = header['arrays']
+
+        # one read-only map of the whole file; arrays are views of it
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')[start:]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        spec = self._index[name]
+        dtype = np.dtype(spec['dtype'])
+        size = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+        data = self._data[spec['offset']:spec['offset'] + size]
+        return data.view(dtype).reshape(spec['shape'])
+
+    def strings(self, name):
+        return Strings(self['{}.data'.format(name)], self['{}.offsets'.format(name)])
+
+    def verify(self):
+        """whether the contents match the hash they were written with"""
+        names = sorted(self._index)
+        return _hash(self.meta, self._index, (self[name] for name in names)) == self.hash
+
+    def counts(self, nodes, edges, bins):
+        """the bayes' net's `Counts`, for its nodes, edges and bins"""
+        import pandas as pd
+        from models.bnet import Counts
+        meta = self.meta['bnet']
+        labels = {}
+        for n in nodes:
+            if bins.get(n) is not None:
+                # the same groups `pd.cut` makes
+                labels[n] = pd.cut(pd.Series([], dtype=np.float64), bins[n]).cat.categories
+            else:
+                labels[n] = pd.Index(self['bnet.labels.{}'.format(n.name)])
+        sizes = {n: pd.Series(self['bnet.sizes.{}'.format(n.name)], index=labels[n]) for n in nodes}
+        joint = {(n, parent): pd.DataFrame(self['bnet.joint.{}.{}'.format(n.name, parent.name)],
+                                           index=labels[n], columns=labels[parent])
+                 for parent, n in edges}
+        return Counts(meta['n_rows'], sizes, joint)
+
+    def rent_dists(self):
+        """`{year: {puma: distributions}}`, as `rent.fit_rent_dists` makes them"""
+        from world.rent import KDE
+        params, spans, scales = self['rent.params'], self['rent.spans'], self['rent.scales']
+        data = self['rent.data']
+        rent_dists = {}
+        for i, (year, puma) in enumerate(self.meta['rent']['keys']):
+            dists = {}
+            for j, name in enumerate(RENT_DISTS):
+                start, length = spans[i, j]
+                dists[name] = KDE(data[start:start+length], scales[i, j]) if length else float(scales[i, j])
+            dists['p_owned'] = float(params[i, 0])
+            dists['p_ownership'] = {k: float(p) for k, p in zip(OWNERSHIPS, params[i, 1:])}
+            rent_dists.setdefault(year, {})[puma] = dists
+        return rent_dists
+
+    def surname_tables(self):
+        """`{race: (surnames, cdf)}`, as `names.surname_tables` makes them"""
+        data, offsets, cdf = self['surnames.data'], self['surnames.offsets'], self['surnames.cdf']
+        return {race: (Strings(data, offsets[start:end+1]), cdf[start:end])
+                for race, (start, end) in self.meta['surnames'].items()}
+
+
+def load(path=None):
+    """the bundle at `path` (by default `BUNDLE_PATH`), loaded once per process,
+    or `None` if there isn't one (or it's of another version)"""
+    path = path or BUNDLE_PATH
+    if path not in _bundles:
+        bundle = None
+        if os.path.exists(path):
+            bundle = Bundle(path)
+            if bundle.version != VERSION:
+                logger.warning('ignoring {}, which is version {} (not {}); rebuild it with `python -m world.bundle`'.format(
+                    path, bundle.version, VERSION))
+                bundle = None
+        _bundles[path] = bundle
+    return _bundles[path]
+
+
+def build(path=BUNDLE_PATH, max_workers=None):
+    """derive every bundled table from the source data and write them to `path`"""
+    from models.bnet import count_csv
+    from people.generate import nodes, edges, income_vars
+    from people.names import surname_given_race, surname_tables
+    from world import rent, work
+    arrays, meta = {}, {}
+
+    # the bayes' net, fit to the PUMS data in parallel chunks
+    df, _ = work.pums()
+    brackets = {code: work.income_bracket(code) for code in work.income_codes}
+    bins = {income_var: brackets[income_var.value] for income_var in income_vars}
+    counts = count_csv(work.PUMS_PATH, nodes, edges, bins, max_workers=max_workers)
+    meta['income_brackets'] = {code: np.asarray(bs).tolist() for code, bs in brackets.items()}
+    meta['bnet'] = {
+        'n_rows': counts.n_rows,
+        'income_max': {income_var.name: df[income_var.value].max().item() for income_var in income_vars}
+    }
+    for n in nodes:
+        sizes = counts.sizes[n]
+        arrays['bnet.sizes.{}'.format(n.name)] = sizes.values.astype(np.int64)
+        if bins.get(n) is None:
+            arrays['bnet.labels.{}'.format(n.name)] = np.asarray(sizes.index)
+    for parent, n in edges:
+        table = counts.joint[n, parent].reindex(index=counts.sizes[n].index,
+                                                columns=counts.sizes[parent].index, fill_value=0)
+        arrays['bnet.joint.{}.{}'.format(n.name, parent.name)] = table.values.astype(np.int64)
+
+    # rent and mortgage distributions, for every year and PUMA
+    rent.fit_rent_dists()
+    keys = [(int(year), int(puma)) for year in sorted(rent.rent_dists) for puma in sorted(rent.rent_dists[year])]
+    params = np.zeros((len(keys), 1 + len(OWNERSHIPS)))
+    spans = np.zeros((len(keys), len(RENT_DISTS), 2), dtype=np.int64)
+    scales = np.zeros((len(keys), len(RENT_DISTS)))
+    data, offset = [], 0
+    for i, (year, puma) in enumerate(keys):
+        dists = rent.rent_dists[year][puma]
+        params[i] = [dists['p_owned']] + [dists['p_ownership'][k] for k in OWNERSHIPS]
+        for j, name in enumerate(RENT_DISTS):
+            dist = dists[name]
+            if isinstance(dist, rent.KDE):
+                spans[i, j] = offset, len(dist.dataset)
+                scales[i, j] = dist.scale
+                data.append(dist.dataset)
+                offset += len(dist.dataset)
+            else:
+                scales[i, j] = dist
+    meta['rent'] = {'keys': keys}
+    arrays.update({'rent.params': params, 'rent.spans': spans, 'rent.scales': scales,
+                   'rent.data': np.concatenate(data) if data else np.zeros(0)})
+
+    # surnames, each race's in one span
+    names, cdfs, meta['surnames'] = [], [], {}
+    for race, (race_names, cdf) in sorted(surname_tables(surname_given_race()).items()):
+        meta['surnames'][race] = [len(names), len(names) + len(race_names)]
+        names.extend(race_names)
+        cdfs.append(cdf)
+    arrays['surnames.data'], arrays['surnames.offsets'] = strings(names)
+    arrays['surnames.cdf'] = np.concatenate(cdfs)
+
+    # job offer and unemployment tables
+    emp_dist = work.precompute_employment_dist()
+    arrays['employment.offer'] = work.offer_prob_table(emp_dist)
+    arrays['employment.unemployed'] = work.unemployment_table(emp_dist)
+
+    return write(path, arrays, meta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='build the world bundle from the source data')
+    parser.add_argument('--out', default=BUNDLE_PATH, help='where to write the bundle')
+    parser.add_argument('--workers', type=int, default=None, help='processes to fit the bayes\' net with')
+    parser.add_argument('--verify', action='store_true', help='check an existing bundle instead')
+    args = parser.parse_args()
+
+    if args.verify:
+        bundle = Bundle(args.out)
+        ok = bundle.verify()
+        print('{}: version {}, {} ({})'.format(args.out, bundle.version, bundle.hash, 'ok' if ok else 'corrupt'))
+        if not ok:
+            raise SystemExit(1)
+    else:
+        print('{}: {}'.format(args.out, build(args.out, args.workers)))
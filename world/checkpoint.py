@@ -0,0 +1,264 @@
+"""
+checkpoints: everything needed to pick a run back up later.
+
+a checkpoint is a zip file of
+    meta      the city's own fields (date, state, config, registries, ...), rng states
+    entities  a record for each person, household, firm, building, etc
+    arrays/*  the state store's columns, as .npy
+
+entities refer to each other by key rather than by reference: people and
+buildings by their id, households and firms by their registry id. the
+state store's columns are saved as arrays and people's state is restored
+as views onto them, so the uids and rows stay the same.
+
+checkpoints can be incremental: only the entities and arrays which changed
+since the previous checkpoint (the "parent") are written. loading an
+incremental checkpoint loads its parents first. what changed is found by
+comparing digests, so everything is still encoded and hashed: incremental
+checkpoints save space and writing, not the cost of encoding.
+"""
+
+import io
+import os
+import types
+import pickle
+import random
+import hashlib
+import zipfile
+import numpy as np
+from collections import namedtuple
+from people import Person, StateStore
+from people.state import StateView
+from economy import Firm, Household, Building, Government
+from economy.learning import BatchQLearner, QRow
+from world.registry import Registry
+
+VERSION = 1
+
+ENTITY_TYPES = (Person, Firm, Household, Building, Government, BatchQLearner)
+
+# how references and special containers are encoded in records
+Ref = namedtuple('Ref', ['key'])
+RegistryData = namedtuple('RegistryData', ['entries', 'next_id'])
+StateData = namedtuple('StateData', ['uid', 'extra'])
+MethodData = namedtuple('MethodData', ['obj', 'name'])
+ObjData = namedtuple('ObjData', ['cls', 'attrs'])
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Encoder():
+    """turns entities into records, following references to other entities.
+    `registries` maps a key prefix to the registry whose ids key those entities"""
+
+    def __init__(self, registries):
+        self.registries = registries
+        self.keys = {}
+        self.queue = []
+        self.n_detached = 0
+
+    def key(self, entity):
+        try:
+            return self.keys[entity]
+        except KeyError:
+            pass
+        if isinstance(entity, (Person, Building)):
+            key = (type(entity).__name__.lower(), entity.id)
+        elif isinstance(entity, Government):
+            key = ('government',)
+        else:
+            for prefix, registry in self.registries.items():
+                if isinstance(entity, registry[0]) and entity in registry[1]:
+                    key = (prefix, registry[1].id_of(entity))
+                    break
+            else:
+                # e.g. closed firms someone still refers to
+                key = ('detached', type(entity).__name__, self.n_detached)
+                self.n_detached += 1
+        self.keys[entity] = key
+        self.queue.append((key, entity))
+        return key
+
+    def encode(self, value):
+        if isinstance(value, ENTITY_TYPES):
+            return Ref(self.key(value))
+        elif isinstance(value, Registry):
+            return RegistryData([(self.encode(e), value.id_of(e)) for e in value], value._next_id)
+        elif isinstance(value, StateView):
+            return StateData(value.uid, self.encode(value.extra))
+        elif isinstance(value, QRow):
+            return ObjData(QRow, self.encode(value.__dict__))
+        elif isinstance(value, types.MethodType):
+            return MethodData(self.encode(value.__self__), value.__func__.__name__)
+        elif type(value) is list:
+            return [self.encode(v) for v in value]
+        elif type(value) is tuple:
+            return tuple(self.encode(v) for v in value)
+        elif type(value) is set:
+            return {self.encode(v) for v in value}
+        elif type(value) is dict:
+            return {self.encode(k): self.encode(v) for k, v in value.items()}
+        return value
+
+    def records(self):
+        """records for every entity referred to so far (and any they refer to)"""
+        records = {}
+        while self.queue:
+            key, entity = self.queue.pop()
+            records[key] = pickle.dumps((type(entity), self.encode(entity.__dict__)),
+                                        protocol=pickle.HIGHEST_PROTOCOL)
+        return records
+
+
+class Decoder():
+    """turns records back into entities, resolving references"""
+
+    def __init__(self, records, store):
+        self.store = store
+        self.objects = {}
+        attrs = {}
+        for key, data in records.items():
+            cls, attrs[key] = pickle.loads(data)
+            self.objects[key] = cls.__new__(cls)
+
+        # every entity exists before any are filled in,
+        # so references can be resolved in any order
+        for key, obj in self.objects.items():
+            obj.__dict__.update(self.decode(attrs[key]))
+
+    def decode(self, value):
+        if isinstance(value, Ref):
+            return self.objects[value.key]
+        elif isinstance(value, RegistryData):
+            registry = Registry()
+            for entity, id in value.entries:
+                registry.add(self.decode(entity), id)
+            registry._next_id = value.next_id
+            return registry
+        elif isinstance(value, StateData):
+            return StateView(self.store, int(self.store.rows[value.uid]), self.decode(value.extra))
+        elif isinstance(value, ObjData):
+            obj = value.cls.__new__(value.cls)
+            obj.__dict__.update(self.decode(value.attrs))
+            return obj
+        elif isinstance(value, MethodData):
+            return getattr(self.decode(value.obj), value.name)
+        elif type(value) is list:
+            return [self.decode(v) for v in value]
+        elif type(value) is tuple:
+            return tuple(self.decode(v) for v in value)
+        elif type(value) is set:
+            return {self.decode(v) for v in value}
+        elif type(value) is dict:
+            return {self.decode(k): self.decode(v) for k, v in value.items()}
+        return value
+
+
+def _store_arrays(store):
+    arrays = {'store/{}'.format(name): col[:store.n] for name, col in store.columns.items()}
+    arrays['store/rows'] = store.rows[:store.n_uids]
+    return arrays
+
+
+def save(path, fields, store, registries, parent=None, compress=True):
+    """save a checkpoint of `fields` (a dict of the city's own fields) and the state
+    store to `path`. `registries` maps key prefixes to `(type, registry)`.
+    if `parent` (what a previous `save` or `load` returned) is given, only what changed
+    since it is written. returns what's needed to save the next checkpoint incrementally"""
+    encoder = Encoder(registries)
+    meta = {
+        'version': VERSION,
+        'fields': encoder.encode(fields),
+        'store': {
+            'n': store.n,
+            'n_uids': store.n_uids,
+            'agents': encoder.encode(store.agents),
+            'firms': encoder.encode(store.firms),
+            'free_slots': list(store._free_slots)
+        },
+        'random': random.getstate(),
+        'np_random': np.random.get_state()
+    }
+    records = encoder.records()
+    arrays = _store_arrays(store)
+
+    digests = {key: _digest(data) for key, data in records.items()}
+    array_digests = {name: _digest(arr.tobytes()) for name, arr in arrays.items()}
+    if parent is not None:
+        meta['parent'] = os.path.relpath(parent['path'], os.path.dirname(os.path.abspath(path)))
+        meta['removed'] = [key for key in parent['digests'] if key not in records]
+        records = {key: data for key, data in records.items()
+                   if parent['digests'].get(key) != digests[key]}
+        arrays = {name: arr for name, arr in arrays.items()
+                  if parent['array_digests'].get(name) != array_digests[name]}
+    else:
+        meta['parent'] = None
+        meta['removed'] = []
+
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, 'w', compression) as z:
+        z.writestr('meta', pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL))
+        z.writestr('entities', pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL))
+        for name, arr in arrays.items():
+            buf = io.BytesIO()
+            np.save(buf, arr)
+            z.writestr('arrays/{}.npy'.format(name), buf.getvalue())
+
+    return {'path': os.path.abspath(path), 'digests': digests, 'array_digests': array_digests}
+
+
+def _read(path):
+    """the meta, records and arrays of a checkpoint, with its parents applied"""
+    with zipfile.ZipFile(path, 'r') as z:
+        meta = pickle.loads(z.read('meta'))
+        records = pickle.loads(z.read('entities'))
+        arrays = {}
+        for name in z.namelist():
+            if name.startswith('arrays/'):
+                arrays[name[len('arrays/'):-len('.npy')]] = np.load(io.BytesIO(z.read(name)))
+    if meta['version'] != VERSION:
+        raise ValueError('unsupported checkpoint version: {}'.format(meta['version']))
+
+    if meta['parent'] is not None:
+        parent = os.path.join(os.path.dirname(os.path.abspath(path)), meta['parent'])
+        _, parent_records, parent_arrays = _read(parent)
+        for key in meta['removed']:
+            parent_records.pop(key, None)
+        parent_records.update(records)
+        parent_arrays.update(arrays)
+        records, arrays = parent_records, parent_arrays
+    return meta, records, arrays
+
+
+def load(path):
+    """load a checkpoint, restoring the rng states.
+    returns `(fields, store, parent)`; `parent` is for saving
+    the next checkpoint incrementally"""
+    meta, records, arrays = _read(path)
+
+    info = meta['store']
+    store = StateStore(capacity=max(1, info['n']))
+    for name in store.columns:
+        store.columns[name][:info['n']] = arrays['store/{}'.format(name)]
+    store.rows = arrays['store/rows'].copy()
+    store.n = info['n']
+    store.n_uids = info['n_uids']
+
+    decoder = Decoder(records, store)
+    store.agents = decoder.decode(info['agents'])
+    store.firms = decoder.decode(info['firms'])
+    store._firm_slots = {firm: slot for slot, firm in enumerate(store.firms) if firm is not None}
+    store._free_slots = list(info['free_slots'])
+    fields = decoder.decode(meta['fields'])
+
+    random.setstate(meta['random'])
+    np.random.set_state(meta['np_random'])
+
+    parent = {
+        'path': os.path.abspath(path),
+        'digests': {key: _digest(data) for key, data in records.items()},
+        'array_digests': {name: _digest(arr.tobytes()) for name, arr in arrays.items()}
+    }
+    return fields, store, parent
@@ -0,0 +1,84 @@
+"""
+sparse-matrix contagion model.
+
+the friendship graph is held as a CSR adjacency matrix over state store uids,
+so a day of the epidemic is a handful of vector ops rather than a python loop
+over every sick person's friends. each edge leaving a sick person transmits
+with probability `contact_rate * transmission_rate` (the same two independent
+rolls the loop model makes), drawn for all such edges at once.
+
+unlike the loop model, everyone infected on a given day only becomes
+contagious the following day.
+
+the matrix is rebuilt before the next day's step when people join the store,
+or when told friendships changed (`friendships_changed`). people leaving
+the store needn't rebuild it: their uids are skipped.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def friendship_adjacency(store):
+    """CSR adjacency matrix of friendships between people in the store,
+    indexed by uid. friends outside the store are ignored"""
+    src, dst = [], []
+    for person in store.agents:
+        uid = person._state.uid
+        for friend in person.friends:
+            if friend in store:
+                src.append(uid)
+                dst.append(friend._state.uid)
+    n = store.n_uids
+    data = np.ones(len(src), dtype=np.bool_)
+    return sparse.csr_matrix((data, (src, dst)), shape=(n, n))
+
+
+class Contagion():
+    def __init__(self, store, rng=np.random):
+        self.store = store
+        self.rng = rng
+        self.adj = friendship_adjacency(store)
+        self.dirty = False
+
+        # number of edges rolled for transmission on the last day
+        self.n_edges = 0
+
+    def friendships_changed(self):
+        """rebuild the adjacency matrix before the next step"""
+        self.dirty = True
+
+    def step(self, p_transmit, severity):
+        """run one day of the epidemic. health loss and new infections are
+        written to the store; returns `(died, infected)`, the people whose
+        health ran out and the people newly infected, so the caller can handle
+        deaths and logging in bulk"""
+        store = self.store
+        if self.dirty or store.n_uids > self.adj.shape[0]:
+            self.adj = friendship_adjacency(store)
+            self.dirty = False
+        sick = store['sick']
+        health = store['health']
+
+        # each sick person loses a little health
+        sick_rows = np.flatnonzero(sick)
+        health[sick_rows] -= severity
+        dead_rows = sick_rows[health[sick_rows] <= 0]
+
+        # sick flags by uid, for people in the graph
+        rows = store.rows[:self.adj.shape[0]]
+        alive = rows >= 0
+        src = np.flatnonzero(alive)
+        src = src[sick[rows[src]]]
+
+        # roll every edge leaving a sick person at once
+        targets = self.adj[src].indices
+        self.n_edges = targets.size
+        hits = np.unique(targets[self.rng.random(targets.size) < p_transmit])
+        hit_rows = rows[hits[alive[hits]]]
+        new_rows = hit_rows[~sick[hit_rows]]
+        sick[new_rows] = True
+
+        died = [store.agents[r] for r in dead_rows]
+        infected = [store.agents[r] for r in new_rows]
+        return died, infected
@@ -0,0 +1,171 @@
+"""
+population frames for the live frontend: a keyframe with everyone's
+full json, then per-step deltas with only the people whose state changed.
+
+every frame has a sequence number and a delta applies on top of the frame
+before it, so a client which sees a gap in the sequence should ask for a
+keyframe to resync. a keyframe is also sent every `keyframe_every` frames.
+
+    keyframe: {'seq', 'keyframe': True, 'people': [person json, ...]}
+    delta:    {'seq', 'keyframe': False,
+               'changed': [{'id', <changed fields>}, ...],
+               'added': [person json, ...], 'removed': [id, ...]}
+"""
+
+import numpy as np
+from people.state import NO_EMPLOYER
+
+# state store columns compared between frames
+COLUMNS = ('cash', 'health', 'sick', 'firm_owner')
+
+
+class FrameEncoder():
+    def __init__(self, store, keyframe_every=30):
+        self.store = store
+        self.keyframe_every = keyframe_every
+        self.seq = -1
+
+        # what each person (by uid) looked like in the last frame
+        self.sent = np.zeros(0, dtype=np.bool_)
+        self.prev = {}
+        self.prev_employer = np.zeros(0, dtype=np.int32)
+        self.ids = {}
+
+        # uids of people whose friends changed since the last frame
+        self.friends_dirty = set()
+
+        # which firm was in each employer slot in the last frame;
+        # slots are reused, so a slot's workers may have a new employer
+        self.prev_firms = []
+
+    def next_frame(self):
+        """the frame for the current state: a delta
+        from the last frame, or a keyframe if one is due"""
+        self.seq += 1
+        if len(self.sent) == 0 or self.seq % self.keyframe_every == 0:
+            self._record(np.ones(len(self.store), dtype=np.bool_), reset=True)
+            return self.keyframe()
+        return self._delta()
+
+    def friends_changed(self, person):
+        """mark that a person's friends changed, to send them in the next delta.
+        friendships rarely change, so they aren't compared every frame"""
+        self.friends_dirty.add(person._state.uid)
+
+    def keyframe(self):
+        """a keyframe for the current state at the current sequence number,
+        e.g. to sync a new client. the next delta still applies on top of it"""
+        return {
+            'seq': self.seq,
+            'keyframe': True,
+            'people': [self._person_json(p) for p in self.store.agents]
+        }
+
+    def _delta(self):
+        store = self.store
+        uid = store['uid']
+        self._grow()
+        known = self.sent[uid]
+
+        changed = np.zeros(len(store), dtype=np.bool_)
+        fields = {}
+        for name in COLUMNS:
+            diff = store[name] != self.prev[name][uid]
+            fields[name] = diff
+            changed |= diff
+
+        employer = store['employer']
+        moved = np.array([firm is not prev for firm, prev in zip(store.firms, self.prev_firms)] +
+                         [True] * (len(store.firms) - len(self.prev_firms)), dtype=np.bool_)
+        diff = employer != self.prev_employer[uid]
+        has_employer = employer != NO_EMPLOYER
+        diff[has_employer] |= moved[employer[has_employer]]
+        fields['employer'] = diff
+        changed |= diff
+
+        agents = store.agents
+        fields['friends'] = np.zeros(len(store), dtype=np.bool_)
+        # (people who have since left are skipped)
+        dirty = store.rows[np.array(sorted(self.friends_dirty), dtype=np.int64)]
+        dirty = dirty[dirty >= 0]
+        fields['friends'][dirty] = True
+        changed[dirty] = True
+
+        records = []
+        for row in np.flatnonzero(changed & known).tolist():
+            person = agents[row]
+            record = {'id': person.id}
+            for name in COLUMNS:
+                if fields[name][row]:
+                    record[name] = store[name][row].item()
+            if fields['employer'][row]:
+                firm = person.employer
+                record['employer'] = firm.id if firm is not None else None
+            if fields['friends'][row]:
+                record['friends'] = list(self._friend_ids(person))
+            records.append(record)
+
+        added = [self._person_json(agents[row]) for row in np.flatnonzero(~known).tolist()]
+
+        present = np.zeros(len(self.sent), dtype=np.bool_)
+        present[uid] = True
+        removed = []
+        for u in np.flatnonzero(self.sent & ~present).tolist():
+            removed.append(self.ids.pop(u))
+
+        self._record(changed | ~known)
+        return {
+            'seq': self.seq,
+            'keyframe': False,
+            'changed': records,
+            'added': added,
+            'removed': removed
+        }
+
+    def _person_json(self, person):
+        obj = person.as_json()
+        employer = person.employer
+        obj['employer'] = employer.id if employer is not None else None
+        return obj
+
+    def _friend_ids(self, person):
+        return tuple(friend.id for friend in person.friends)
+
+    def _grow(self):
+        n = self.store.n_uids
+        if len(self.sent) >= n:
+            return
+        extra = n - len(self.sent)
+        self.sent = np.concatenate([self.sent, np.zeros(extra, dtype=np.bool_)])
+        for name in COLUMNS:
+            self.prev[name] = np.concatenate([self.prev[name], np.zeros(extra, dtype=self.store[name].dtype)])
+        self.prev_employer = np.concatenate([self.prev_employer, np.full(extra, NO_EMPLOYER, dtype=np.int32)])
+
+    def _record(self, rows, reset=False):
+        """remember the current state of the people at `rows` as sent.
+        if `reset`, forget everyone else"""
+        store = self.store
+        if not self.prev:
+            for name in COLUMNS:
+                self.prev[name] = np.zeros(0, dtype=store[name].dtype)
+        self._grow()
+
+        uid = store['uid']
+        self.friends_dirty = set()
+        if reset:
+            self.sent[:] = False
+            self.ids = {}
+        else:
+            present = np.zeros(len(self.sent), dtype=np.bool_)
+            present[uid] = True
+            self.sent &= present
+
+        sel = uid[rows]
+        self.sent[sel] = True
+        for name in COLUMNS:
+            self.prev[name][sel] = store[name][rows]
+        self.prev_employer[sel] = store['employer'][rows]
+        agents = store.agents
+        for row, u in zip(np.flatnonzero(rows).tolist(), sel.tolist()):
+            self.ids[u] = agents[row].id
+        self.prev_firms = list(store.firms)
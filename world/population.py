@@ -1,8 +1,9 @@
+import copy
 import json
-import click
 from datetime import datetime
 from people import Person
 from .social import social_network
+from .rng import RNG
 
 START_DATE = datetime(day=1, month=1, year=2005)
 
@@ -26,21 +27,29 @@ def load_population(path):
     return pop
 
 
+def copy_population(pop):
+    """a copy of a population which can be run without changing the original.
+    friendships are remapped onto the copies (without recursing through them,
+    which `copy.deepcopy` does)"""
+    copies = {p: copy.copy(p) for p in pop}
+    for p, c in copies.items():
+        c._state = dict(p._state)
+        c.diary = dict(p.diary)
+        c.friends = [copies.get(f, f) for f in p.friends]
+    return [copies[p] for p in pop]
+
+
 def save_population(pop, path):
     json_pop = [p.as_json() for p in pop]
     with open(path, 'w') as f:
         json.dump(json_pop, f)
 
 
-def generate_population(n):
-    population = []
-
-    with click.progressbar(range(n), label='populating...') as n:
-        for i in n:
-            agent = Person.generate(START_DATE.year)
-            population.append(agent)
+def generate_population(n, seed=None):
+    rng = RNG(seed).population
+    population = Person.generate_batch(START_DATE.year, n, rng=rng)
 
-    social_net = social_network(population, base_prob=0.4)
+    social_net = social_network(population, base_prob=0.4, rng=rng)
     for i, person in enumerate(population):
         person.friends = [population[j] for _, j in social_net.edges(i)]
     print('avg n of friends', sum(len(p.friends) for p in population)/len(population))
@@ -0,0 +1,184 @@
+"""
+opt-in instrumentation for `City.step`: wall time and calls for each phase,
+and counts of the work done in them (job seekers, applicants considered,
+market rounds, sampled contagion edges, ...).
+
+    with profiler.phase('labor_market'):
+        profiler.count('seekers', len(job_seekers))
+        ...
+
+counts are kept per phase, as `'<phase>.<name>'`. at the end of each step,
+its times and counts are returned (for the city to publish) and folded into
+running totals and a histogram of each phase's times, which `summary()`
+summarizes.
+
+phases are also traced, if the profiler has a tracer (see `world/tracing.py`),
+along with finer spans (e.g. market rounds) which aren't timed as phases.
+
+when profiling and tracing are off, cities use `NullProfiler`, which does nothing.
+"""
+
+import time
+import numpy as np
+
+# histogram bucket edges for phase times, in seconds: 1µs to 100s, log-spaced
+BUCKETS = np.logspace(-6, 2, 8 * 6 + 1)
+
+
+class NullProfiler():
+    """the profiler when profiling is off"""
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def span(self, name, args=None):
+        return _NULL_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+    def start_step(self):
+        pass
+
+    def end_step(self):
+        return None
+
+    def summary(self):
+        return None
+
+
+class _NullPhase():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.parent = self.profiler.current
+        self.profiler.current = self.name
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        profiler = self.profiler
+        profiler.record(self.name, end - self.start)
+        profiler.current = self.parent
+        tracer = profiler.tracer
+        if tracer is not None and tracer.active:
+            tracer.complete(self.name, self.start, end)
+        return False
+
+
+class Profiler():
+    enabled = True
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+
+        # the phase being timed, if any, for attributing counts
+        self.current = None
+
+        # this step's times and counts
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+        self._step_start = None
+
+        # the last step's, as returned by `end_step`
+        self.last = None
+
+        # running totals over all steps
+        self.n_steps = 0
+        self.total_times = {}
+        self.total_calls = {}
+        self.max_times = {}
+        self.histograms = {}
+        self.total_counts = {}
+
+    def phase(self, name):
+        """a context manager which times a phase"""
+        return _Phase(self, name)
+
+    def span(self, name, args=None):
+        """a context manager which traces a span, but doesn't time it as a phase"""
+        if self.tracer is None:
+            return _NULL_PHASE
+        return self.tracer.span(name, args)
+
+    def record(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        """count `n` of something, in the current phase"""
+        if self.current is not None:
+            name = '{}.{}'.format(self.current, name)
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def start_step(self):
+        self._step_start = time.perf_counter()
+        if self.tracer is not None:
+            self.tracer.start_step()
+
+    def end_step(self):
+        """finish a step, returning its `{'times', 'calls', 'counts'}`"""
+        if self._step_start is not None:
+            end = time.perf_counter()
+            self.record('step', end - self._step_start)
+            if self.tracer is not None:
+                if self.tracer.active:
+                    self.tracer.complete('step', self._step_start, end)
+                self.tracer.end_step()
+            self._step_start = None
+        step = {'times': self.times, 'calls': self.calls, 'counts': self.counts}
+
+        self.n_steps += 1
+        for name, seconds in self.times.items():
+            self.total_times[name] = self.total_times.get(name, 0.) + seconds
+            self.max_times[name] = max(self.max_times.get(name, 0.), seconds)
+            if name not in self.histograms:
+                self.histograms[name] = np.zeros(len(BUCKETS) + 1, dtype=np.int64)
+            self.histograms[name][np.searchsorted(BUCKETS, seconds)] += 1
+        for name, n in self.calls.items():
+            self.total_calls[name] = self.total_calls.get(name, 0) + n
+        for name, n in self.counts.items():
+            self.total_counts[name] = self.total_counts.get(name, 0) + n
+
+        self.times, self.calls, self.counts = {}, {}, {}
+        self.last = step
+        return step
+
+    def quantile(self, name, q):
+        """approximate quantile of a phase's time per step, from its histogram
+        (the upper edge of the bucket it falls in)"""
+        hist = self.histograms[name]
+        i = np.searchsorted(np.cumsum(hist), q * hist.sum())
+        return float(BUCKETS[min(i, len(BUCKETS) - 1)])
+
+    def summary(self):
+        """per phase: calls, total/mean/max time and approximate median and 95th
+        percentile time per step; per count: its total and mean per step"""
+        n = max(self.n_steps, 1)
+        return {
+            'steps': self.n_steps,
+            'phases': {name: {
+                'calls': self.total_calls[name],
+                'total': total,
+                'mean': total/n,
+                'max': self.max_times[name],
+                'p50': self.quantile(name, 0.5),
+                'p95': self.quantile(name, 0.95)
+            } for name, total in self.total_times.items()},
+            'counts': {name: {'total': total, 'mean': total/n}
+                       for name, total in self.total_counts.items()}
+        }
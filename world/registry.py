@@ -0,0 +1,79 @@
+"""
+a collection of entities (people, households, firms, tenants)
+with O(1) add, remove and membership tests.
+
+each entity gets a stable integer id when it's added, which can be used
+to refer to it (e.g. in logs or checkpoints) without holding the object.
+"""
+
+from collections.abc import Sequence
+
+
+class Registry(Sequence):
+    """unordered; removal swaps the last entity into the removed one's place"""
+
+    def __init__(self, entities=()):
+        self._entities = []
+        self._pos = {}
+        self._ids = {}
+        self._by_id = {}
+        self._next_id = 0
+        for entity in entities:
+            self.add(entity)
+
+    def add(self, entity, id=None):
+        """add an entity, optionally under a specific id"""
+        if entity in self._pos:
+            return self._ids[entity]
+        if id is None:
+            id = self._next_id
+        self._next_id = max(self._next_id, id + 1)
+        self._pos[entity] = len(self._entities)
+        self._entities.append(entity)
+        self._ids[entity] = id
+        self._by_id[id] = entity
+        return id
+
+    append = add
+
+    def extend(self, entities):
+        for entity in entities:
+            self.add(entity)
+
+    def remove(self, entity):
+        try:
+            pos = self._pos.pop(entity)
+        except KeyError:
+            raise ValueError('{} is not in the registry'.format(entity))
+        last = self._entities.pop()
+        if last is not entity:
+            self._entities[pos] = last
+            self._pos[last] = pos
+        del self._by_id[self._ids.pop(entity)]
+
+    def discard(self, entity):
+        if entity in self._pos:
+            self.remove(entity)
+
+    def id_of(self, entity):
+        return self._ids[entity]
+
+    def get(self, id):
+        return self._by_id.get(id)
+
+    def __contains__(self, entity):
+        return entity in self._pos
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __getitem__(self, i):
+        return self._entities[i]
+
+    def __iter__(self):
+        # iterate over a snapshot, so entities can be
+        # removed (or added) while iterating
+        return iter(self._entities[:])
+
+    def __repr__(self):
+        return 'Registry({})'.format(self._entities)
@@ -11,68 +11,104 @@ import numpy as np
 import pandas as pd
 from cess.util import random_choice
 from scipy.stats import gaussian_kde
+from world import bundle
 
-# prep the rent data
+# loaded or fit on first use, so importing this module doesn't need the PUMS household data
 rent_dists = {}
-df = pd.read_csv('data/world/gen/pums_household_nyc.csv')
-
-# group by years
-years = df.groupby('YEAR')
-
-# for each year
-for year in years.groups:
-    rent_dists[year] = {}
-    df_y = years.get_group(year)
-    pumas = df_y.groupby('PUMA')
-    for puma in pumas.groups:
-        puma_dists = {}
-
-        df_p = pumas.get_group(puma)
-        total = df_p.size
-
-        # https://usa.ipums.org/usa-action/variables/OWNERSHP#codes_section
-        # 1 == ownership or in process of purchasing
-        n_owned = df_p[df_p['OWNERSHP'] == 1].size
-        puma_dists['p_owned'] = n_owned/total
-
-        # https://usa.ipums.org/usa-action/variables/MORTGAGE#codes_section
-        # 1 == ownership, "free and clear"
-        n_owned_free = df_p[df_p['MORTGAGE'] == 1].size
-
-        # 3, 4 == yes, mortgage or similar
-        n_owned_mort = df_p[df_p['MORTGAGE'].isin([3,4])].size
-
-        # https://usa.ipums.org/usa-action/variables/MORTGAG2#codes_section
-        # 2, 3, 4, 5 == yes, second mortgage or home equity loan
-        n_owned_mort2 = df_p[df_p['MORTGAG2'].isin([2,3,4,5])].size - n_owned_mort
-
-        puma_dists['p_ownership'] = {
-            'free': n_owned_free/n_owned,
-            'mortgage1': n_owned_mort/n_owned,
-            'mortgage2': n_owned_mort2/n_owned
-        }
-
-        # assume mortgages (monthly payments) are normally distributed
-        mort1_arr = df_p[df_p['MORTGAGE'].isin([3,4])]['MORTAMT1'].as_matrix()
-        puma_dists['mortgage1_dist'] = gaussian_kde(mort1_arr)
-        mort2_arr = df_p[df_p['MORTGAG2'].isin([2,3,4,5])]['MORTAMT2'].as_matrix()
-        try:
-            puma_dists['mortgage2_dist'] = gaussian_kde(mort2_arr)
-        except np.linalg.linalg.LinAlgError:
-            puma_dists['mortgage2_dist'] = np.mean(mort2_arr)
-        except ValueError:
-            puma_dists['mortgage2_dist'] = 0 if not mort2_arr else np.mean(mort2_arr)
-
-        # assume rent is normally distributed
-        rent_arr = df_p[df_p['RENT'] != 0]['RENT'].as_matrix()
-        puma_dists['rent_dist'] = gaussian_kde(rent_arr)
-
-        rent_dists[year][puma] = puma_dists
+
+
+class KDE():
+    """a one-dimensional `gaussian_kde`, kept as its data and the standard
+    deviation of its kernel, so it can be bundled (see `world/bundle.py`)"""
+
+    def __init__(self, dataset, scale):
+        self.dataset = dataset
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, data):
+        kde = gaussian_kde(data)
+        return cls(kde.dataset[0], float(np.sqrt(kde.covariance[0,0])))
+
+    def resample(self, size):
+        """draws, shaped `(1, size)` as `gaussian_kde.resample`'s are"""
+        idx = np.random.randint(0, len(self.dataset), size=size)
+        return (self.dataset[idx] + np.random.normal(0, self.scale, size=size))[None,:]
+
+
+def load_rent_dists():
+    """the rent distributions, from the world bundle if there is one, otherwise fit"""
+    if not rent_dists:
+        b = bundle.load()
+        if b is not None:
+            rent_dists.update(b.rent_dists())
+        else:
+            fit_rent_dists()
+    return rent_dists
+
+
+def fit_rent_dists():
+    """fit the rent distributions for each year and PUMA"""
+    df = pd.read_csv('data/world/gen/pums_household_nyc.csv')
+
+    # group by years
+    years = df.groupby('YEAR')
+
+    # for each year
+    for year in years.groups:
+        rent_dists[year] = {}
+        df_y = years.get_group(year)
+        pumas = df_y.groupby('PUMA')
+        for puma in pumas.groups:
+            puma_dists = {}
+
+            df_p = pumas.get_group(puma)
+            total = df_p.size
+
+            # https://usa.ipums.org/usa-action/variables/OWNERSHP#codes_section
+            # 1 == ownership or in process of purchasing
+            n_owned = df_p[df_p['OWNERSHP'] == 1].size
+            puma_dists['p_owned'] = n_owned/total
+
+            # https://usa.ipums.org/usa-action/variables/MORTGAGE#codes_section
+            # 1 == ownership, "free and clear"
+            n_owned_free = df_p[df_p['MORTGAGE'] == 1].size
+
+            # 3, 4 == yes, mortgage or similar
+            n_owned_mort = df_p[df_p['MORTGAGE'].isin([3,4])].size
+
+            # https://usa.ipums.org/usa-action/variables/MORTGAG2#codes_section
+            # 2, 3, 4, 5 == yes, second mortgage or home equity loan
+            n_owned_mort2 = df_p[df_p['MORTGAG2'].isin([2,3,4,5])].size - n_owned_mort
+
+            puma_dists['p_ownership'] = {
+                'free': n_owned_free/n_owned,
+                'mortgage1': n_owned_mort/n_owned,
+                'mortgage2': n_owned_mort2/n_owned
+            }
+
+            # assume mortgages (monthly payments) are normally distributed
+            mort1_arr = df_p[df_p['MORTGAGE'].isin([3,4])]['MORTAMT1'].as_matrix()
+            puma_dists['mortgage1_dist'] = KDE.fit(mort1_arr)
+            mort2_arr = df_p[df_p['MORTGAG2'].isin([2,3,4,5])]['MORTAMT2'].as_matrix()
+            try:
+                puma_dists['mortgage2_dist'] = KDE.fit(mort2_arr)
+            except np.linalg.linalg.LinAlgError:
+                puma_dists['mortgage2_dist'] = np.mean(mort2_arr)
+            except ValueError:
+                puma_dists['mortgage2_dist'] = 0 if not mort2_arr else np.mean(mort2_arr)
+
+            # assume rent is normally distributed
+            rent_arr = df_p[df_p['RENT'] != 0]['RENT'].as_matrix()
+            puma_dists['rent_dist'] = KDE.fit(rent_arr)
+
+            rent_dists[year][puma] = puma_dists
 
 
 def sample_rent(year, puma):
     """generates a plausible rent amount (here, rent can mean a monthly mortgage payment)
     given a year and a PUMA"""
+    load_rent_dists()
     rent = 0
     rent_info = rent_dists[year][puma]
     if random.random() < rent_info['p_owned']:
@@ -89,3 +125,35 @@ def sample_rent(year, puma):
     else:
         rent = rent_info['rent_dist'].resample(1)[0][0]
     return rent
+
+
+def sample_rents(year, pumas, rng=np.random):
+    """`sample_rent` for many people at once, given each one's PUMA.
+    rolls are drawn from `rng`; the fitted distributions draw from numpy's global state"""
+    load_rent_dists()
+    pumas = np.asarray(pumas)
+    rents = np.zeros(len(pumas))
+    for puma in np.unique(pumas):
+        idx = np.flatnonzero(pumas == puma)
+        rent_info = rent_dists[year][puma]
+        owned = rng.random(len(idx)) < rent_info['p_owned']
+
+        renters = idx[~owned]
+        if len(renters):
+            rents[renters] = rent_info['rent_dist'].resample(len(renters))[0]
+
+        # owners who own free and clear pay nothing
+        owners = idx[owned]
+        p_ownership = rent_info['p_ownership']
+        rolls = rng.random(len(owners))
+        mortgage1 = owners[rolls < p_ownership['mortgage1']]
+        mortgage2 = owners[(rolls >= p_ownership['mortgage1'])
+                           & (rolls < p_ownership['mortgage1'] + p_ownership['mortgage2'])]
+        if len(mortgage1):
+            rents[mortgage1] = rent_info['mortgage1_dist'].resample(len(mortgage1))[0]
+        if len(mortgage2):
+            try:
+                rents[mortgage2] = rent_info['mortgage2_dist'].resample(len(mortgage2))[0]
+            except AttributeError:
+                rents[mortgage2] = rent_info['mortgage2_dist']
+    return rents
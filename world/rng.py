@@ -0,0 +1,57 @@
+"""
+seeded random number streams.
+
+a city owns an `RNG` which spawns an independent `numpy.random.Generator`
+for each subsystem from a single seed. so runs with the same seed are
+reproducible, and drawing more (or fewer) numbers in one subsystem doesn't
+shift what every other subsystem draws.
+
+hot loops which draw one number at a time can use a `RandomPool`,
+which draws numbers from a stream in blocks.
+"""
+
+import numpy as np
+
+STREAMS = ('city', 'contagion', 'markets', 'labor', 'learning', 'population')
+
+
+class RandomPool():
+    """uniform randoms in [0, 1), drawn from a generator `size` at a time"""
+
+    def __init__(self, generator, size=4096):
+        self.generator = generator
+        self.size = size
+        self._pool = []
+
+    def random(self):
+        if not self._pool:
+            # reversed, so popping takes them in the order they were drawn
+            self._pool = self.generator.random(self.size)[::-1].tolist()
+        return self._pool.pop()
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+
+class RNG():
+    """a stream per subsystem, as attributes (e.g. `rng.contagion`)"""
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        children = np.random.SeedSequence(seed).spawn(len(STREAMS))
+        self.streams = {}
+        self.pools = {}
+        for name, child in zip(STREAMS, children):
+            generator = np.random.Generator(np.random.PCG64(child))
+            self.streams[name] = generator
+            self.pools[name] = RandomPool(generator)
+            setattr(self, name, generator)
+
+    def pool(self, name):
+        """the pre-drawn pool for a stream"""
+        return self.pools[name]
+
+    def shuffle(self, name, seq):
+        """a shuffled copy of `seq`, using a stream"""
+        seq = list(seq)
+        return [seq[i] for i in self.streams[name].permutation(len(seq))]
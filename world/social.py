@@ -13,7 +13,7 @@ import numpy as np
 import networkx as nx
 
 
-def friendship_matrix(people, base_prob):
+def friendship_matrix(people, base_prob, rng=np.random):
     """friendship matrix :)
     takes a list of agents, returns an adjacency matrix of friendships
     `base_prob` is the probability that two individuals would be friends
@@ -45,7 +45,7 @@ def friendship_matrix(people, base_prob):
         probs = 1/(1+np.exp(-out))
 
         # rolls for friendship
-        rolls = np.random.uniform(size=len(diffs))
+        rolls = rng.random(len(diffs))
 
         # indices where true
         friend_idx = np.where(rolls < probs)[0]
@@ -61,7 +61,7 @@ def friendship_matrix(people, base_prob):
     return adj_mat
 
 
-def social_network(people, base_prob=0.5):
+def social_network(people, base_prob=0.5, rng=np.random):
     """generate a social network for a list of people"""
-    friendship_mat = friendship_matrix(people, base_prob)
+    friendship_mat = friendship_matrix(people, base_prob, rng)
     return nx.from_numpy_matrix(friendship_mat)
\ No newline at end of file
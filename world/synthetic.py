@@ -0,0 +1,136 @@
+"""
+synthetic cities, for benchmarks and tests: a population, its social
+network and an employment distribution, none of which need the PUMS data.
+
+attributes are drawn from rough marginals of the generated population
+(`data/population.json`), independently of each other. friendships are
+homophilous by construction: people are sorted by race and age and
+mostly befriend people near them in that order, plus a few at random.
+that's O(n) rather than the O(n^2) of `social.friendship_matrix`.
+"""
+
+import json
+import math
+import numpy as np
+from people import Person
+from .rng import RNG
+from . import work
+
+# rough marginals of the generated population
+RACES = ([1, 2, 3, 4, 5, 6, 7, 8, 9],
+         [0.457, 0.227, 0.005, 0.068, 0.003, 0.079, 0.141, 0.018, 0.002])
+EDUCATIONS = ([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+              [0.083, 0.072, 0.095, 0.022, 0.029, 0.036, 0.237, 0.098, 0.054, 0.0, 0.165, 0.109])
+EMPLOYED = ([0, 1, 2, 3], [0.184, 0.436, 0.058, 0.322])
+P_FEMALE = 0.56
+P_FIRM_OWNER = 0.043
+P_INVESTMENT = 0.097
+P_RENT = 0.767
+
+# median (nonzero) incomes and rent
+MEDIAN_WAGE = 33000
+MEDIAN_BUSINESS_INCOME = 16000
+MEDIAN_INVESTMENT_INCOME = 3600
+MEDIAN_RENT = 930
+
+# firms per building
+MAX_TENANTS = 10
+
+with open('data/world/nyc.json', 'r') as f:
+    puma_to_neighborhoods = {int(k): v for k, v in json.load(f)['puma_to_neighborhoods'].items()}
+
+
+def _lognormal(rng, median, n, sigma=1.):
+    return np.round(median * np.exp(sigma * rng.standard_normal(n)))
+
+
+def population(n, seed=None, mean_friends=18, locality=50, p_random_friend=0.2):
+    """`n` synthetic people, with friends. `locality` is roughly how far
+    (in race/age order) people look for friends; `p_random_friend` is the
+    fraction of friendships with anyone at all"""
+    rng = RNG(seed).population
+    sexes = np.where(rng.random(n) < P_FEMALE, 2, 1)
+    races = rng.choice(RACES[0], size=n, p=RACES[1])
+    educations = rng.choice(EDUCATIONS[0], size=n, p=EDUCATIONS[1])
+    employed = rng.choice(EMPLOYED[0], size=n, p=EMPLOYED[1])
+    ages = rng.integers(18, 91, size=n)
+    wages = np.where(employed == 1, _lognormal(rng, MEDIAN_WAGE, n), 0)
+    business = np.where(rng.random(n) < P_FIRM_OWNER, _lognormal(rng, MEDIAN_BUSINESS_INCOME, n), 0)
+    investment = np.where(rng.random(n) < P_INVESTMENT, _lognormal(rng, MEDIAN_INVESTMENT_INCOME, n), 0)
+    rents = np.where(rng.random(n) < P_RENT, _lognormal(rng, MEDIAN_RENT, n, sigma=0.5), 0)
+    pumas = list(puma_to_neighborhoods)
+    puma_idx = rng.integers(len(pumas), size=n)
+    neighborhood_rolls = rng.random(n)
+
+    people = []
+    for i in range(n):
+        puma = pumas[puma_idx[i]]
+        neighborhoods = puma_to_neighborhoods[puma]
+        person = Person(
+            name='Person {}'.format(i),
+            sex=int(sexes[i]), race=int(races[i]), education=int(educations[i]),
+            employed=int(employed[i]), age=int(ages[i]),
+            wage_income=int(wages[i]), business_income=int(business[i]),
+            investment_income=int(investment[i]), welfare_income=0, retirement_income=0,
+            puma=puma, neighborhood=neighborhoods[int(neighborhood_rolls[i] * len(neighborhoods))],
+            rent=float(rents[i]),
+            occupation=None, occupation_code=0, industry=None, industry_code=0)
+        person.id = 'synthetic-{}'.format(i)
+        people.append(person)
+
+    for person, friends in zip(people, social_network(races, ages, rng, mean_friends, locality, p_random_friend)):
+        person.friends = [people[j] for j in friends]
+    return people
+
+
+def social_network(races, ages, rng, mean_friends=18, locality=50, p_random_friend=0.2):
+    """each person's friends, as arrays of indices"""
+    n = len(races)
+    if n < 2:
+        return [np.zeros(0, dtype=np.int64) for _ in range(n)]
+
+    # everyone starts about half their friendships
+    order = np.lexsort((ages, races))
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    src = np.repeat(np.arange(n), rng.poisson(mean_friends/2, size=n))
+    m = len(src)
+
+    # mostly with people near them in race/age order
+    offsets = rng.geometric(1/locality, size=m) * np.where(rng.random(m) < 0.5, -1, 1)
+    dst = order[(position[src] + offsets) % n]
+    anyone = rng.random(m) < p_random_friend
+    dst[anyone] = rng.integers(n, size=int(anyone.sum()))
+
+    # friendship is mutual
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    pairs = np.unique(np.stack([np.minimum(src, dst), np.maximum(src, dst)], axis=1), axis=0)
+    src = np.concatenate([pairs[:,0], pairs[:,1]])
+    dst = np.concatenate([pairs[:,1], pairs[:,0]])
+    by_src = np.argsort(src, kind='stable')
+    return np.split(dst[by_src], np.cumsum(np.bincount(src, minlength=n))[:-1])
+
+
+def employment_dist():
+    """an employment distribution (as from `work.precompute_employment_dist`)
+    from the monthly unemployment rates alone, the same for every race and sex"""
+    from people.attribs import Sex, Race
+
+    emp_dist = {}
+    for year in range(work.FIRST_YEAR, work.LAST_YEAR + 1):
+        emp_dist[year] = {}
+        for month in range(12):
+            unemployed = float(work.monthly_df.loc[year].iloc[month][:-1])/100
+            dist = {'employed': 1 - unemployed, 'unemployed': unemployed}
+            emp_dist[year][month] = {race.name: {sex.name: dict(dist) for sex in Sex} for race in Race}
+    return emp_dist
+
+
+def config(n):
+    """city config overrides which scale with the population,
+    so there's room for everyone who would start a firm"""
+    return {
+        'max_tenants': MAX_TENANTS,
+        'n_buildings': max(16, math.ceil(n * P_FIRM_OWNER / MAX_TENANTS)),
+    }
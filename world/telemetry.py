@@ -0,0 +1,110 @@
+"""
+columnar telemetry: snapshots of agents' state and the city's stats,
+written to an append-only directory of chunked `.npz` files.
+
+agent snapshots are taken from the state store's columns, so observing
+is a few array copies rather than serializing every person. snapshots can
+be taken every `every` days or only at month end, of all agents or
+a stable sample of them.
+
+    <path>/agents_00000.npz  day, uid and each field, one row per agent per observation
+    <path>/stats_00000.npz   day, name (index into `names`), value, one row per stat
+
+`read(path)` loads them back.
+"""
+
+import os
+import glob
+import numpy as np
+from datetime import timedelta
+
+DEFAULT_FIELDS = ('cash', 'health', 'sick', 'employer', 'wage', 'firm_owner')
+
+
+class Telemetry():
+    def __init__(self, path, fields=DEFAULT_FIELDS, every=1, month_end=False,
+                 sample=1., chunk_size=30, compress=True):
+        """`sample` is the fraction of agents to snapshot; the same agents are
+        sampled every time. `chunk_size` is the number of observations per file"""
+        self.path = path
+        self.fields = tuple(fields)
+        self.every = every
+        self.month_end = month_end
+        self.sample = sample
+        self.chunk_size = chunk_size
+        self.compress = compress
+        os.makedirs(path, exist_ok=True)
+
+        # continue numbering after any existing chunks
+        self.n_chunks = len(glob.glob(os.path.join(path, 'agents_*.npz')))
+        self.n_stat_chunks = len(glob.glob(os.path.join(path, 'stats_*.npz')))
+        self.n_days = 0
+
+        self._snapshots = []
+        self._stats = []
+
+    def should_observe(self, date):
+        self.n_days += 1
+        if self.month_end:
+            return (date + timedelta(days=1)).month != date.month
+        return self.n_days % self.every == 0
+
+    def observe(self, date, store):
+        """snapshot agents' state from the store, if this is an observation day"""
+        if not self.should_observe(date):
+            return
+        uid = store['uid']
+        if self.sample < 1:
+            # a cheap hash of the uid, so the same agents are always sampled
+            keep = (uid * 2654435761) % 2**32 < self.sample * 2**32
+        else:
+            keep = slice(None)
+        snapshot = {'uid': uid[keep].copy()}
+        for field in self.fields:
+            snapshot[field] = store[field][keep].copy()
+        snapshot['day'] = np.full(len(snapshot['uid']), date.toordinal(), dtype=np.int32)
+        self._snapshots.append(snapshot)
+        if len(self._snapshots) >= self.chunk_size:
+            self.flush()
+
+    def stat(self, date, name, value):
+        self._stats.append((date.toordinal(), name, value))
+
+    def flush(self):
+        """write out everything buffered so far"""
+        save = np.savez_compressed if self.compress else np.savez
+        if self._snapshots:
+            arrays = {k: np.concatenate([s[k] for s in self._snapshots])
+                      for k in self._snapshots[0]}
+            save(os.path.join(self.path, 'agents_{:05d}.npz'.format(self.n_chunks)), **arrays)
+            self.n_chunks += 1
+            self._snapshots = []
+        if self._stats:
+            days, names, values = zip(*self._stats)
+            names, codes = np.unique(np.array(names), return_inverse=True)
+            save(os.path.join(self.path, 'stats_{:05d}.npz'.format(self.n_stat_chunks)),
+                 day=np.array(days, dtype=np.int32), name=codes.astype(np.int32),
+                 names=names, value=np.array(values, dtype=np.float64))
+            self.n_stat_chunks += 1
+            self._stats = []
+
+    def close(self):
+        self.flush()
+
+
+def read(path):
+    """load telemetry written to `path`. returns `(agents, stats)`:
+    `agents` maps `day`, `uid` and each field to one array across all snapshots,
+    `stats` maps each stat's name to `(days, values)` arrays"""
+    chunks = [np.load(f) for f in sorted(glob.glob(os.path.join(path, 'agents_*.npz')))]
+    agents = {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0].files} if chunks else {}
+
+    stats = {}
+    for f in sorted(glob.glob(os.path.join(path, 'stats_*.npz'))):
+        c = np.load(f)
+        for i, name in enumerate(c['names'].tolist()):
+            sel = c['name'] == i
+            stats.setdefault(name, []).append((c['day'][sel], c['value'][sel]))
+    stats = {name: (np.concatenate([d for d, _ in parts]), np.concatenate([v for _, v in parts]))
+             for name, parts in stats.items()}
+    return agents, stats
@@ -0,0 +1,173 @@
+"""
+opt-in tracing: nested spans (each phase of a step, each market round,
+firm planning, celery tasks, ...) written as chrome trace events, to view
+as a flame graph in `chrome://tracing` or perfetto.
+
+    tracer = Tracer('trace.json.gz', sample=0.1)
+    with tracer.span('task', {'name': 'step_simulation'}):
+        ...
+    tracer.close()
+
+a city traces through its profiler (see `world/profiler.py`): set `trace_path`
+in its config, or start a tracer for the whole process with `start`, which
+cities then use too (e.g. a celery worker, so its tasks and the steps they
+run are in the same trace).
+
+to keep long runs manageable, only a `sample` fraction of steps are traced,
+evenly spaced. spans outside of steps (e.g. tasks) are always traced.
+
+the file is the json array format, one event per line, and is written as it
+goes; an uncompressed file cut short (without the closing `]`) still loads
+in the viewers. paths ending in `.gz` are gzipped. `load` reads files cut
+short either way, up to the last whole event that was flushed.
+"""
+
+import os
+import zlib
+import gzip
+import json
+import time
+import atexit
+
+# flush to disk every this many events
+BUFFER_SIZE = 1000
+
+_tracer = None
+
+
+def start(path, sample=1.):
+    """start tracing this process to `path`. a `{pid}` in the
+    path is filled in, so each (e.g. celery worker) process gets its own file.
+    the tracer is closed by `stop`, or when the process exits"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    else:
+        atexit.register(stop)
+    _tracer = Tracer(path.format(pid=os.getpid()), sample=sample)
+    return _tracer
+
+
+def stop():
+    """close this process's tracer, if one was started"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def current():
+    """this process's tracer, if one was started"""
+    return _tracer
+
+
+class _Span():
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class _NullSpan():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer():
+    def __init__(self, path, sample=1., category='simulation'):
+        self.path = path
+        self.sample = sample
+        self.category = category
+        self.pid = os.getpid()
+        self._start = time.perf_counter()
+        self._events = []
+        self._file = None
+        self._n_written = 0
+
+        # traced steps are evenly spaced; outside of steps, spans are always traced
+        self.n_steps = 0
+        self.active = True
+        self.closed = False
+
+    def span(self, name, args=None):
+        """a context manager which traces a span, if tracing is active"""
+        if not self.active:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def complete(self, name, start, end, args=None):
+        """record a span from `start` to `end`, as `time.perf_counter()` values"""
+        event = {'name': name, 'cat': self.category, 'ph': 'X',
+                 'ts': round((start - self._start) * 1e6, 3),
+                 'dur': round((end - start) * 1e6, 3),
+                 'pid': self.pid, 'tid': self.pid}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+        if len(self._events) >= BUFFER_SIZE:
+            self.flush()
+
+    def start_step(self):
+        """whether this step is traced"""
+        self.n_steps += 1
+        self.active = int(self.n_steps * self.sample) > int((self.n_steps - 1) * self.sample)
+        return self.active
+
+    def end_step(self):
+        self.active = True
+
+    def flush(self):
+        if not self._events or self.closed:
+            return
+        if self._file is None:
+            opener = gzip.open if self.path.endswith('.gz') else open
+            self._file = opener(self.path, 'wt')
+            self._file.write('[\n')
+        for event in self._events:
+            if self._n_written:
+                self._file.write(',\n')
+            self._file.write(json.dumps(event))
+            self._n_written += 1
+        self._file.flush()
+        self._events = []
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+        self.closed = True
+
+
+def load(path):
+    """the events in a trace file, even if it was cut short"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.gz'):
+        # unlike `gzip.open`, doesn't fail on a file without its end
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+    data = data.decode('utf8', errors='replace').strip()
+    if data.endswith(']'):
+        return json.loads(data)
+
+    # cut short: take events (one per line) up to the first partial one
+    events = []
+    for line in data.split('\n')[1:]:
+        try:
+            events.append(json.loads(line.rstrip(',')))
+        except ValueError:
+            break
+    return events
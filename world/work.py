@@ -10,19 +10,35 @@ import json
 import random
 import numpy as np
 import pandas as pd
+from world import bundle
 
 # this gives us monthly unemployment percentages for NY
 monthly_df = pd.read_csv('data/world/gen/unemployment.csv', index_col='Year')
 
-# group by years
-df = pd.read_csv('data/people/gen/pums_nyc.csv')
-years = df.groupby('YEAR')
+# PUMS individual data, loaded on first use (see `pums`)
+PUMS_PATH = 'data/people/gen/pums_nyc.csv'
+_pums = {}
 
 # offer probabilities
 p_offer = json.load(open('data/world/gen/job_offer_probs.json', 'r'))
+REFERRALS = ['previous_contractor', 'other', 'headhunter_or_campus_recruiter', 'friend', 'ad_or_cold_call']
+
+# years covered by the precomputed tables
+FIRST_YEAR, LAST_YEAR = 2005, 2014
+
+def pums():
+    """the PUMS individual data and its groups by year, as `(df, years)`.
+    loaded on first use, so importing this module doesn't need the data"""
+    if 'df' not in _pums:
+        df = pd.read_csv(PUMS_PATH)
+        _pums['df'] = df
+        _pums['years'] = df.groupby('YEAR')
+    return _pums['df'], _pums['years']
+
 
 def income_bracket(code):
     """create income brackets for an income code"""
+    df, _ = pums()
     bins = []
     df_max = df[code].max()
     df_min = df[code].min()
@@ -39,7 +55,18 @@ def income_bracket(code):
 
 
 income_codes = ['INCWAGE', 'INCINVST', 'INCWELFR', 'INCRETIR', 'INCBUS00', 'INCSS']
-income_brackets = {code: income_bracket(code) for code in income_codes}
+
+
+def income_brackets():
+    """income brackets for every income code,
+    from the world bundle if there is one"""
+    if 'income_brackets' not in _pums:
+        b = bundle.load()
+        if b is not None:
+            _pums['income_brackets'] = b.meta['income_brackets']
+        else:
+            _pums['income_brackets'] = {code: income_bracket(code) for code in income_codes}
+    return _pums['income_brackets']
 
 
 def employment_dist(year, month, sex, race):
@@ -52,6 +79,7 @@ def employment_dist(year, month, sex, race):
     prior_unemployed = float(prior_str[:-1])/100
 
     # likelihood is generated from PUMS individual data
+    _, years = pums()
     df_y = years.get_group(year)
     employed = df_y[df_y.EMPSTAT == 1]
     unemployed = df_y[df_y.EMPSTAT == 2]
@@ -113,19 +141,80 @@ def _offer_prob(sex, race, referral, emp):
     return prob/(prob + not_prob)
 
 
+def _offer_races(race):
+    """the `p_offer` race keys `offer_prob` may map a race to"""
+    if race.name == 'aian':
+        return ['nativeamerican']
+    elif race.name == 'white':
+        return ['hispanic', 'white']
+    elif race.name in ['chinese', 'japanese', 'api']:
+        return ['asian']
+    elif race.name == 'black':
+        return ['black']
+    return list(p_offer['offered']['race'].keys())
+
+
+def offer_prob_table(precomputed_emp_dist):
+    """precomputes `offer_prob` for every year, month, race, sex and referral.
+    the table is indexed by `[year - FIRST_YEAR, month - 1, race - 1, sex - 1, referral]`,
+    where `referral` is an index into `REFERRALS`.
+
+    where `offer_prob` randomly picks a race key (white may be hispanic,
+    and multiple races are a mix of two random races)
+    the table holds the expected probability"""
+    from people.attribs import Sex, Race
+
+    table = np.zeros((LAST_YEAR - FIRST_YEAR + 1, 12, len(Race), len(Sex), len(REFERRALS)))
+    for y, year in enumerate(range(FIRST_YEAR, LAST_YEAR + 1)):
+        for month in range(12):
+            for race in Race:
+                races = _offer_races(race)
+                for sex in Sex:
+                    emp = precomputed_emp_dist[year][month][race.name][sex.name]
+                    for r, referral in enumerate(REFERRALS):
+                        probs = [_offer_prob(sex, race_key, referral, emp) for race_key in races]
+                        table[y, month, race - 1, sex - 1, r] = sum(probs)/len(probs)
+    return table
+
+
+def unemployment_table(precomputed_emp_dist):
+    """probability of unemployment as an array,
+    indexed by `[year - FIRST_YEAR, month - 1, race - 1, sex - 1]`"""
+    from people.attribs import Sex, Race
+
+    table = np.zeros((LAST_YEAR - FIRST_YEAR + 1, 12, len(Race), len(Sex)))
+    for y, year in enumerate(range(FIRST_YEAR, LAST_YEAR + 1)):
+        for month in range(12):
+            for race in Race:
+                for sex in Sex:
+                    table[y, month, race - 1, sex - 1] = precomputed_emp_dist[year][month][race.name][sex.name]['unemployed']
+    return table
+
+
+def offer_probs(table, year, month, sexes, races, referrals):
+    """vectorized `offer_prob`, looked up in an `offer_prob_table`.
+    `sexes` and `races` are sequences of `Sex` and `Race` values,
+    `referrals` of indices into `REFERRALS`"""
+    races = np.asarray(races, dtype=np.int64)
+    sexes = np.asarray(sexes, dtype=np.int64)
+    return table[year - FIRST_YEAR, month - 1, races - 1, sexes - 1, referrals]
+
+
 def income_change(from_year, to_year, sex, race, income_bracket, income_code):
     """samples a wage change between two years, based on the years, sex, and race"""
     lbound, ubound = income_bracket[1:-1].split(',')
     lbound, ubound = int(lbound), int(ubound)
+    _, years = pums()
+    brackets = income_brackets()
 
     df_y = years.get_group(from_year)
     fr_group = df_y[df_y.EMPSTAT == 1][df_y.SEX == sex][df_y.RACE == race]
-    fr_group = fr_group.groupby(pd.cut(fr_group[income_code], income_brackets[income_code]))
+    fr_group = fr_group.groupby(pd.cut(fr_group[income_code], brackets[income_code]))
     fr_group = fr_group.get_group(income_bracket)
 
     df_y = years.get_group(to_year)
     to_group = df_y[df_y.EMPSTAT == 1][df_y.SEX == sex][df_y.RACE == race]
-    to_group = to_group.groupby(pd.cut(to_group[income_code], income_brackets[income_code]))
+    to_group = to_group.groupby(pd.cut(to_group[income_code], brackets[income_code]))
     to_group = to_group.get_group(income_bracket)
 
     mean_diff = to_group[income_code].mean() - fr_group[income_code].mean()